@@ -1,9 +1,9 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from watsonx_captioning import convert_image_to_base64, get_fish_description_from_watsonxai, get_json_generated_image_details, get_json_generated_image_details_gemini, get_json_generated_image_details_groq
 from elasticsearch_query import ElasticsearchQuery
 from embedding_service import EmbeddingService
-from function import return_top_n_fish, return_top_n_fish_simple, return_fish_info
-from generation import get_generated_response, get_generated_response_with_context
+from fish_results import return_top_n_fish, return_top_n_fish_simple, return_fish_info
+from generation import get_generated_response, get_generated_response_with_context, history_manager, retrieval_router
 import os
 from dotenv import load_dotenv
 import ibm_boto3
@@ -11,28 +11,55 @@ from ibm_botocore.client import Config
 import io
 import logging
 from groq import Groq
-import base64
 import traceback
-from fish_services import get_watsonx_token, identify_fish_candidates, identify_fish_candidates_gemini, identify_fish_candidates_gemini2, identify_fish_candidates_gemini2, identify_fish_candidates_groq
+from fish_services import image_bytes_of, get_watsonx_token, identify_fish_candidates, identify_fish_candidates_gemini, identify_fish_candidates_gemini2, identify_fish_candidates_gemini2, identify_fish_candidates_groq, identify_fish_candidates_streaming, stream_fish_candidates, STREAM_PROVIDERS
+import json
 from google import genai
+import threading
+from fake_providers import fake_backends_enabled, get_fake_backends
+from pipelines import CAPTION_PROVIDERS, run_caption_identify
+from species_catalogue import get_catalogue
+from provider_usage import usage_stats
+from job_queue import JobQueue
+from background_uploads import BackgroundUploader, upload_key
+from image_loader import ImageLoader, ImageRejected
+from single_flight import get_group, single_flight_stats
+from embedding_cache import normalize_text
+from perceptual_hash import IMAGE_DEDUP_CACHE, NearDuplicateCache
+from image_knn import get_image_classifier
+import hashlib
+import time
 
 
 load_dotenv()
-es_endpoint = os.environ["es_endpoint"]
-es_username = os.environ["es_username"]
-es_password = os.environ["es_password"]
 index_name = 'fish_index_v4'    
-esq = ElasticsearchQuery(es_endpoint, es_username, es_password)
-emb = EmbeddingService('watsonx')
 
 global USE_GEMINI
 USE_GEMINI = False 
 
-client = genai.Client(
-  api_key=os.getenv("GEMINI_API_KEY")
-)
-
-groq_client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+# FISH_FAKE_BACKENDS=1 swaps every external service for the local stand-ins in
+# fake_providers.py (load testing / benchmarking without credentials)
+USE_FAKE_BACKENDS = fake_backends_enabled()
+if USE_FAKE_BACKENDS:
+    fakes = get_fake_backends()
+    esq = fakes.es
+    emb = fakes.embedding
+    client = fakes.gemini
+    groq_client = fakes.groq
+    get_fish_description_from_watsonxai = fakes.caption
+    get_watsonx_token = fakes.watsonx_token
+else:
+    es_endpoint = os.environ["es_endpoint"]
+    es_username = os.environ["es_username"]
+    es_password = os.environ["es_password"]
+    esq = ElasticsearchQuery(es_endpoint, es_username, es_password)
+    emb = EmbeddingService('watsonx')
+
+    client = genai.Client(
+      api_key=os.getenv("GEMINI_API_KEY")
+    )
+
+    groq_client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
 
 # env
 watsonx_api_key = os.getenv("WATSONX_APIKEY", None)
@@ -41,7 +68,147 @@ project_id = os.getenv("PROJECT_ID", None)
 ibm_cloud_iam_url = os.getenv("IAM_IBM_CLOUD_URL", None)
 chat_url = os.getenv("IBM_WATSONX_AI_INFERENCE_URL", None)
 
+# Clients in the shape pipelines.py expects
+provider_clients = {"groq": groq_client, "gemini": client}
+
+# /search_possible_fish: stream the identification and stop generating as soon as the image is rejected
+IDENTIFY_EARLY_EXIT = os.getenv("IDENTIFY_EARLY_EXIT", "0") == "1"
+
 app = Flask(__name__)
+# Upper bound for directly uploaded images (multipart or raw body); larger requests get 413
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+
+_cos_client = None
+_cos_client_lock = threading.Lock()
+
+def get_cos_client():
+    """Returns the shared COS client, created on first use instead of once per request."""
+    global _cos_client
+    with _cos_client_lock:
+        if _cos_client is None:
+            if USE_FAKE_BACKENDS:
+                _cos_client = get_fake_backends().cos
+            else:
+                _cos_client = ibm_boto3.client(
+                    's3',
+                    ibm_api_key_id=os.environ.get('IBM_COS_API_KEY'),
+                    ibm_service_instance_id=os.environ.get('IBM_COS_RESOURCE_INSTANCE_ID'),
+                    config=Config(signature_version='oauth'),
+                    endpoint_url=os.environ.get('IBM_COS_ENDPOINT')
+                )
+        return _cos_client
+
+# Size-capped, streamed COS reads (MAX_IMAGE_BYTES); raw bytes for Gemini, base64 for the rest
+image_loader = ImageLoader()
+
+def provider_encoding(provider):
+    return "bytes" if provider == "gemini" else "base64"
+
+def fetch_image(image_key, encoding="base64"):
+    return image_loader.load_cos(get_cos_client(), 'fish-image-bucket', image_key, encoding).data
+
+# Concurrent identical requests (double taps, client retries) share one upstream call
+image_fetch_flight = get_group("cos_fetch")
+identify_flight = get_group("identify")
+embedding_flight = get_group("embedding")
+
+# Identification results for recompressed/resized/cropped re-uploads of an already identified photo
+near_duplicate_cache = NearDuplicateCache() if IMAGE_DEDUP_CACHE else None
+
+# Optional local reference-photo kNN in front of the vision LLM (IMAGE_KNN_FAST_PATH=1)
+image_classifier = get_image_classifier(esq)
+
+def fetch_image_shared(image_key, encoding="base64"):
+    pic, _ = image_fetch_flight.do((image_key, encoding), lambda: fetch_image(image_key, encoding))
+    return pic
+
+# Directly uploaded images are saved to COS in the background, off the response path
+uploader = BackgroundUploader(get_cos_client)
+
+def request_image():
+    """
+    (image_key, image_bytes, params) for the image routes, from one of:
+      - JSON {"image": "<cos key>", ...}: image_bytes is None, the route reads it from COS
+      - multipart/form-data with an "image" file, other parameters as form fields
+      - a raw image/* or application/octet-stream body, other parameters in the query string
+    Uploaded bytes are used as they are; load_image_payload stores them under image_key
+    (returned in the X-Image-Key header) with the background uploader. Uploads over
+    MAX_CONTENT_LENGTH raise RequestEntityTooLarge, so routes call this outside their
+    catch-all try blocks and the 413 handler answers.
+    """
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("image")
+        params = request.form
+        if upload is None:
+            return "", None, params
+        image_bytes, filename, content_type = upload.read(), upload.filename, upload.mimetype
+    elif request.mimetype.startswith("image/") or request.mimetype == "application/octet-stream":
+        params = request.args
+        image_bytes, filename, content_type = request.get_data(cache=False), None, request.mimetype
+    else:
+        params = request.get_json(silent=True) or {}
+        return params.get("image", ""), None, params
+    if not image_bytes:
+        return "", None, params
+    return upload_key(filename, content_type), image_bytes, params
+
+def load_image_payload(image_key, image_bytes, encoding="base64"):
+    """The route's image as base64 str or raw bytes, from the upload or from COS. Raises ImageRejected."""
+    if image_bytes is None:
+        return fetch_image_shared(image_key, encoding)
+    image = image_loader.load_bytes(image_bytes, image_key, encoding)
+    # Only validated images are persisted; the content type comes from the sniffed header
+    uploader.submit(image_key, image_bytes, image.mime_type)
+    g.image_key = image_key
+    return image.data
+
+@app.errorhandler(413)
+def request_too_large(e):
+    # Raised by werkzeug while reading an upload over MAX_CONTENT_LENGTH
+    return jsonify({"error": f"Request body larger than {app.config['MAX_CONTENT_LENGTH']} bytes"}), 413
+
+def image_rejected_response(e):
+    """413/415 for oversized or non-image inputs, None for any other error."""
+    if isinstance(e, ImageRejected):
+        return jsonify({"error": str(e)}), e.status
+    return None
+
+@app.after_request
+def add_image_key_header(response):
+    image_key = g.get("image_key")
+    if image_key:
+        response.headers["X-Image-Key"] = image_key
+    return response
+
+# Durable queue for the slow vision routes (handlers are registered next to /jobs below)
+job_queue = JobQueue()
+
+def start_background_workers():
+    """
+    Starts the job worker pool of this process, so queued jobs (e.g. left over
+    from before a restart) run without waiting for traffic. Called from the
+    gunicorn post_worker_init hook and before the development server starts.
+    """
+    job_queue.ensure_workers()
+
+@app.before_request
+def start_job_workers():
+    # Fallback for servers that call neither of the above; per process, so each forked worker runs its own pool
+    job_queue.ensure_workers()
+
+def after_fork():
+    """gunicorn post_fork hook: SQLite connections opened at import are not shared with the children."""
+    job_queue.after_fork()
+    cache = getattr(emb, "cache", None)
+    if cache is not None:
+        cache.after_fork()
+
+def shutdown():
+    """
+    gunicorn worker_exit hook: finish queued COS uploads before the process goes
+    away. Jobs still running are left leased and picked up again after JOB_LEASE_S.
+    """
+    uploader.shutdown(wait=True)
 
 # Dummy fallback response
 def fallback_response(service_name, error_msg=None):
@@ -54,6 +221,30 @@ def fallback_response(service_name, error_msg=None):
 def live():
     return jsonify(status="ok"), 200
 
+def catalogue_info():
+    try:
+        return get_catalogue(esq, index_name).info()
+    except Exception as e:
+        # The first catalogue load failed (e.g. ES unreachable); the other metrics are still useful
+        app.logger.error(f"Species catalogue unavailable for /metrics: {e}")
+        return {"status": "unavailable", "error": str(e)}
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return jsonify({
+        "embedding_cache": emb.cache_stats(),
+        "species_catalogue": catalogue_info(),
+        "providers": usage_stats(),
+        "jobs": job_queue.stats(),
+        "single_flight": single_flight_stats(),
+        "uploads": uploader.stats(),
+        "image_loader": image_loader.stats(),
+        "near_duplicates": near_duplicate_cache.stats() if near_duplicate_cache else None,
+        "image_knn": image_classifier.stats() if image_classifier else None,
+        "chat_history": history_manager.stats() if history_manager else None,
+        "retrieval_router": retrieval_router.stats() if retrieval_router else None,
+    }), 200
+
 
 @app.route("/search", methods=["POST"])
 def search():
@@ -63,7 +254,7 @@ def search():
         if not text_input:
             return jsonify({"error": "No text input provided"}), 400
 
-        caption_embedding = emb.embed_text(text_input)
+        caption_embedding, _ = embedding_flight.do(normalize_text(text_input), lambda: emb.embed_text(text_input))
         hits = esq.search_embedding(index_name=index_name, embedding_field='physical_description_embedding', query_vector=caption_embedding, size=5)
         # top_n_fish = return_top_n_fish(hits, n=5)
         top_n_fish = return_top_n_fish_simple(hits, n=5)
@@ -77,44 +268,25 @@ def search():
 # This service might take a while to respond due to image processing
 @app.route("/image_captioning", methods=["POST"])
 def image_captioning():
+    image, image_bytes, data = request_image()
     try:
-        data = request.get_json()
-        image = data.get("image", "")
         app.logger.info(f"Received image: {image}")
         if not image:
             app.logger.error("No image provided in request")
             return jsonify({"error": "No image provided"}), 400
 
-        # COS fetch block
+        # COS fetch + base64 block (streamed; uploaded images skip COS)
         try:
-            app.logger.info("loading COS credentials")
-            api_key = os.environ.get('IBM_COS_API_KEY')
-            resource_instance_id = os.environ.get('IBM_COS_RESOURCE_INSTANCE_ID')
-            endpoint_url = os.environ.get('IBM_COS_ENDPOINT')
-            cos = ibm_boto3.client(
-                's3',
-                ibm_api_key_id=api_key,
-                ibm_service_instance_id=resource_instance_id,
-                config=Config(signature_version='oauth'),
-                endpoint_url=endpoint_url
-            )
-            app.logger.info(f"Fetching image from COS: {image}")
-            response = cos.get_object(Bucket='fish-image-bucket', Key=image)
-            image_bytes = response['Body'].read()
+            app.logger.info(f"Loading image: {image}")
+            pic_string = load_image_payload(image, image_bytes)
         except Exception as cos_e:
+            rejected = image_rejected_response(cos_e)
+            if rejected:
+                return rejected
             traceback.print_exc()
             app.logger.error(f"COS fetch error: {cos_e}")
             return jsonify(fallback_response("image_captioning", f"COS fetch error: {cos_e}")), 503
 
-        # Base64 conversion block
-        try:
-            app.logger.info("Converting image to base64")
-            pic_string = base64.b64encode(image_bytes).decode('utf-8')
-        except Exception as b64_e:
-            traceback.print_exc()
-            app.logger.error(f"Base64 conversion error: {b64_e}")
-            return jsonify(fallback_response("image_captioning", f"Base64 error: {b64_e}")), 503
-
         # WatsonX call block
         try:
             app.logger.info("Calling WatsonX for image captioning")
@@ -132,44 +304,25 @@ def image_captioning():
 
 @app.route("/image_identification", methods=["POST"])
 def image_identification():
+    image, image_bytes, data = request_image()
     try:
-        data = request.get_json()
-        image = data.get("image", "")
         app.logger.info(f"Received image: {image}")
         if not image:
             app.logger.error("No image provided in request")
             return jsonify({"error": "No image provided"}), 400
 
-        # COS fetch block
+        # COS fetch block (streamed; raw bytes for Gemini, base64 for Groq; uploaded images skip COS)
         try:
-            app.logger.info("loading COS credentials")
-            api_key = os.environ.get('IBM_COS_API_KEY')
-            resource_instance_id = os.environ.get('IBM_COS_RESOURCE_INSTANCE_ID')
-            endpoint_url = os.environ.get('IBM_COS_ENDPOINT')
-            cos = ibm_boto3.client(
-                's3',
-                ibm_api_key_id=api_key,
-                ibm_service_instance_id=resource_instance_id,
-                config=Config(signature_version='oauth'),
-                endpoint_url=endpoint_url
-            )
-            app.logger.info(f"Fetching image from COS: {image}")
-            response = cos.get_object(Bucket='fish-image-bucket', Key=image)
-            image_bytes = response['Body'].read()
+            app.logger.info(f"Loading image: {image}")
+            pic_string = load_image_payload(image, image_bytes, "bytes" if USE_GEMINI else "base64")
         except Exception as cos_e:
+            rejected = image_rejected_response(cos_e)
+            if rejected:
+                return rejected
             traceback.print_exc()
             app.logger.error(f"COS fetch error: {cos_e}")
             return jsonify(fallback_response("image_captioning", f"COS fetch error: {cos_e}")), 503
 
-        # Base64 conversion block
-        try:
-            app.logger.info("Converting image to base64")
-            pic_string = base64.b64encode(image_bytes).decode('utf-8')
-        except Exception as b64_e:
-            traceback.print_exc()
-            app.logger.error(f"Base64 conversion error: {b64_e}")
-            return jsonify(fallback_response("image_captioning", f"Base64 error: {b64_e}")), 503
-
         # WatsonX call block
         try:
             # json_result = get_json_generated_image_details(pic_string)
@@ -222,10 +375,14 @@ def search_with_scientific_name():
             return jsonify({"error": "No scientific name provided"}), 400
 
         print(f"Searching for scientific name: {scientific_name}")
-        # Use text search on the scientific_name field, only 1 result
-        hits = esq.search_text(index_name=index_name, field='scientific_name', text=scientific_name, size=1)
+        # In-memory catalogue first (exact, then fuzzy), ES text search only when nothing matches
+        record = get_catalogue(esq, index_name).lookup(scientific_name, kinds=("scientific", "english", "thai"))
+        if record:
+            hits = [record]
+        else:
+            hits = esq.search_text(index_name=index_name, field='scientific_name', text=scientific_name, size=1)
 
-        fish_data = return_fish_info(hits)
+        fish_data = return_fish_info(hits or [])
         if not fish_data:
             return jsonify({
                 "scientific_name": scientific_name,
@@ -259,32 +416,21 @@ def identify_and_search():
     3. Uses the caption to perform a semantic vector search in Elasticsearch.
     4. Returns the search results.
     """
+    image, image_bytes, data = request_image()
     try:
-        data = request.get_json()
-        image = data.get("image", "")
         if not image:
             app.logger.error("No image path provided in request for /identify_and_search")
             return jsonify({"error": "No image path (COS Key) provided"}), 400
 
         app.logger.info(f"Starting 2-step process for image: {image}")
 
-        # --- STEP 1: Fetch Image and Encode (Code copied from /image_captioning) ---
+        # --- STEP 1: Fetch Image (unless uploaded directly) and Encode ---
         try:
-            app.logger.info("Loading COS credentials and fetching image.")
-            api_key = os.environ.get('IBM_COS_API_KEY')
-            resource_instance_id = os.environ.get('IBM_COS_RESOURCE_INSTANCE_ID')
-            endpoint_url = os.environ.get('IBM_COS_ENDPOINT')
-            cos = ibm_boto3.client(
-                's3',
-                ibm_api_key_id=api_key,
-                ibm_service_instance_id=resource_instance_id,
-                config=Config(signature_version='oauth'),
-                endpoint_url=endpoint_url
-            )
-            response = cos.get_object(Bucket='fish-image-bucket', Key=image)
-            image_bytes = response['Body'].read()
-            pic_string = base64.b64encode(image_bytes).decode('utf-8')
+            pic_string = load_image_payload(image, image_bytes)
         except Exception as cos_e:
+            rejected = image_rejected_response(cos_e)
+            if rejected:
+                return rejected
             traceback.print_exc()
             app.logger.error(f"COS/Base64 error in identify_and_search: {cos_e}")
             return jsonify(fallback_response("identify_and_search (Image Load)", f"Image load error: {cos_e}")), 503
@@ -327,45 +473,83 @@ def identify_and_search():
         app.logger.error(f"Unknown error in /identify_and_search: {e}")
         return jsonify(fallback_response("identify_and_search", str(e))), 503
 
+def identify_image_candidates(provider, pic_base64):
+    """
+    Vision identification plus catalogue names for /search_possible_fish. Concurrent
+    calls for the same image bytes and provider share one model call, so the
+    returned dict is shared and must not be modified. With IMAGE_KNN_FAST_PATH=1
+    a confident reference-photo kNN match is returned without calling the LLM.
+    """
+    image_bytes = image_bytes_of(pic_base64)
+
+    def run():
+        decision = image_classifier.classify(image_bytes) if image_classifier else None
+        if decision and decision["confident"]:
+            app.logger.info(f"Identified by image kNN (margin {decision['margin']:.3f}), LLM skipped")
+            ai_result = image_classifier.as_identification(decision)
+        elif IDENTIFY_EARLY_EXIT:
+            ai_result = identify_fish_candidates_streaming(provider, provider_clients[provider], pic_base64)
+        elif provider == "gemini":
+            print("Using Gemini model for identification")
+            ai_result = identify_fish_candidates_gemini2(client, pic_base64)
+        else:
+            # ai_result = identify_fish_candidates(pic_base64, access_token, project_id, chat_url)
+            ai_result = identify_fish_candidates_groq(groq_client, pic_base64)
+        if ai_result:
+            # Scientific/Thai names from the catalogue so clients need no extra lookups
+            try:
+                get_catalogue(esq, index_name).enrich(ai_result.get("results"))
+            except Exception as catalogue_error:
+                app.logger.error(f"Catalogue enrichment skipped: {catalogue_error}")
+        return ai_result
+
+    perceptual_hash = near_duplicate_cache.hash_image(image_bytes) if near_duplicate_cache else None
+    if perceptual_hash is not None:
+        cached = near_duplicate_cache.get(provider, perceptual_hash)
+        if cached is not None:
+            app.logger.info(f"Identification reused from a near-duplicate image (distance {cached[1]})")
+            return cached[0]
+
+    def run_and_remember():
+        start = time.perf_counter()
+        ai_result = run()
+        # Only complete answers are reused; a failed call must not stick to the image
+        if perceptual_hash is not None and ai_result and not ai_result.get("error"):
+            near_duplicate_cache.put(provider, perceptual_hash, ai_result, time.perf_counter() - start)
+        return ai_result
+
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    ai_result, shared = identify_flight.do((provider, image_hash), run_and_remember)
+    if shared:
+        app.logger.info(f"Identification coalesced with an in-flight {provider} call")
+    return ai_result
+
 # --- NEW ROUTE (Integrated from previous turn) ---
 @app.route("/search_possible_fish", methods=["POST"])
 def search_possible_fish():
     """
-    Input: JSON {"image": "user-upload/filename.jpg"}
+    Input: JSON {"image": "user-upload/filename.jpg"}, or the image itself as
+           multipart "image" file / raw body (see request_image)
     Output: Full JSON from AI (contains top_candidates, scores, reasons)
     """
+    # 1. Parse Input (JSON COS key, multipart file or raw image body)
+    image_key, image_bytes, data = request_image()
     try:
-        # 1. Parse JSON Input
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "Invalid JSON body"}), 400
-            
-        image_key = data.get("image", "")
         if not image_key:
-            return jsonify({"error": "No 'image' key provided in JSON"}), 400
+            return jsonify({"error": "No 'image' key or image file provided"}), 400
 
         app.logger.info(f"Processing image search for key: {image_key}")
 
-        # 2. Fetch Image from IBM COS
+        provider = "gemini" if USE_GEMINI else "groq"
+
+        # 2. Fetch Image from IBM COS (unless uploaded directly)
         try:
-            api_key = os.environ.get('IBM_COS_API_KEY')
-            resource_instance_id = os.environ.get('IBM_COS_RESOURCE_INSTANCE_ID')
-            endpoint_url = os.environ.get('IBM_COS_ENDPOINT')
-            bucket_name = 'fish-image-bucket' 
-
-            cos = ibm_boto3.client(
-                's3',
-                ibm_api_key_id=api_key,
-                ibm_service_instance_id=resource_instance_id,
-                config=Config(signature_version='oauth'),
-                endpoint_url=endpoint_url
-            )
-            
-            response = cos.get_object(Bucket=bucket_name, Key=image_key)
-            image_bytes = response['Body'].read()
-            pic_base64 = base64.b64encode(image_bytes).decode("utf-8")
+            pic_base64 = load_image_payload(image_key, image_bytes, provider_encoding(provider))
             
         except Exception as cos_error:
+            rejected = image_rejected_response(cos_error)
+            if rejected:
+                return rejected
             app.logger.error(f"COS Error: {cos_error}")
             return jsonify({"error": f"Failed to fetch image: {str(cos_error)}"}), 500
 
@@ -376,15 +560,7 @@ def search_possible_fish():
             return jsonify({"error": "Authentication failed"}), 500
 
         # เรียก AI
-        ai_result = None
-
-        if USE_GEMINI:
-          print("Using Gemini model for identification")
-          ai_result = identify_fish_candidates_gemini2(client, pic_base64)
-        else:
-          # ai_result = identify_fish_candidates(pic_base64, access_token, project_id, chat_url)
-          ai_result = identify_fish_candidates_groq(groq_client, pic_base64)
-          
+        ai_result = identify_image_candidates(provider, pic_base64)
 
         print("this is ai_result",ai_result)
 
@@ -401,6 +577,171 @@ def search_possible_fish():
         app.logger.error(f"Unhandled Error: {str(e)}")
         return jsonify(fallback_response("search_possible_fish", str(e))), 500
 
+@app.route("/search_possible_fish_stream", methods=["POST"])
+def search_possible_fish_stream():
+    """
+    Input: JSON {"image": "user-upload/filename.jpg", "provider": "groq"|"gemini" (optional)},
+           or the image itself as multipart "image" file / raw body (see request_image)
+    Output: NDJSON, one {"event": ..., "data": ...} per line while the model generates:
+    "candidate" for each result as soon as it is complete (with catalogue names), then
+    "result" with the full JSON, or "rejected" as soon as image_contains_fish is false.
+    """
+    image_key, image_bytes, data = request_image()
+    if not image_key:
+        return jsonify({"error": "No 'image' key or image file provided"}), 400
+    provider = data.get("provider") or ("gemini" if USE_GEMINI else "groq")
+    if provider not in STREAM_PROVIDERS:
+        return jsonify({"error": f"provider must be one of {list(STREAM_PROVIDERS)}"}), 400
+
+    try:
+        pic_base64 = load_image_payload(image_key, image_bytes, provider_encoding(provider))
+    except Exception as cos_error:
+        rejected = image_rejected_response(cos_error)
+        if rejected:
+            return rejected
+        app.logger.error(f"COS Error: {cos_error}")
+        return jsonify({"error": f"Failed to fetch image: {str(cos_error)}"}), 500
+
+    def generate():
+        catalogue = get_catalogue(esq, index_name)
+        for event, payload in stream_fish_candidates(provider, provider_clients[provider], pic_base64):
+            if event == "candidate":
+                catalogue.enrich([payload])
+            elif event == "result":
+                catalogue.enrich(payload.get("results"))
+            yield json.dumps({"event": event, "data": payload}, ensure_ascii=False) + "\n"
+
+    # Closing the response (client disconnect) closes the generator, which cancels the model stream
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                    headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
+
+def caption_and_identify_result(image_key, provider, pic_base64):
+    """Response body of /caption_and_identify, or None when the model gave no usable JSON."""
+    timings = {}
+    output = run_caption_identify(provider, pic_base64, image_key, emb, esq, index_name, provider_clients,
+                                  timings=timings)
+    ai_result = output["ai_result"]
+    if not ai_result:
+        return None
+    return {
+        "input_image": image_key,
+        "provider": provider,
+        "image_contains_fish": ai_result.get("image_contains_fish", True),
+        "rejection_reason": ai_result.get("rejection_reason"),
+        "caption": output["caption"],
+        "results": output["ranked"][:5],
+        "llm_results": output["llm_ranked"],
+        "knn_results": output["knn_ranked"],
+        "timings_ms": {stage: round(sum(v) * 1000, 1) for stage, v in timings.items()},
+    }
+
+@app.route("/caption_and_identify", methods=["POST"])
+def caption_and_identify():
+    """
+    Input: JSON {"image": "user-upload/filename.jpg", "provider": "groq"|"gemini" (optional)},
+           or the image itself as multipart "image" file / raw body (see request_image)
+    One vision call returns a physical-description caption and the top candidates,
+    the caption is embedded for a kNN search and both scores are fused.
+    """
+    image_key, image_bytes, data = request_image()
+    try:
+        if not image_key:
+            return jsonify({"error": "No 'image' key or image file provided"}), 400
+        provider = data.get("provider") or ("gemini" if USE_GEMINI else "groq")
+        if provider not in CAPTION_PROVIDERS:
+            return jsonify({"error": f"provider must be one of {list(CAPTION_PROVIDERS)}"}), 400
+
+        try:
+            pic_base64 = load_image_payload(image_key, image_bytes, provider_encoding(provider))
+        except Exception as cos_error:
+            rejected = image_rejected_response(cos_error)
+            if rejected:
+                return rejected
+            app.logger.error(f"COS Error: {cos_error}")
+            return jsonify({"error": f"Failed to fetch image: {str(cos_error)}"}), 500
+
+        result = caption_and_identify_result(image_key, provider, pic_base64)
+        if not result:
+            app.logger.error("AI returned None or failed to parse JSON")
+            return jsonify({"error": "AI could not identify fish"}), 500
+        return jsonify(result), 200
+
+    except Exception as e:
+        traceback.print_exc()
+        app.logger.error(f"Unhandled Error: {str(e)}")
+        return jsonify(fallback_response("caption_and_identify", str(e))), 500
+
+# --- Background jobs ---
+# Each handler takes the stored payload ({"image": ..., "provider": ...}) and returns
+# the same JSON as the synchronous route; raising marks the attempt as failed (retried).
+
+def job_image_captioning(payload):
+    return {"caption": get_fish_description_from_watsonxai(fetch_image(payload["image"]))}
+
+def job_image_identification(payload):
+    pic_base64 = fetch_image(payload["image"], provider_encoding(payload["provider"]))
+    if payload["provider"] == "gemini":
+        json_result = get_json_generated_image_details_gemini(client, pic_base64)
+    else:
+        json_result = get_json_generated_image_details_groq(groq_client, pic_base64)
+    if not json_result:
+        raise RuntimeError("AI could not identify fish (Returned None)")
+    return json_result
+
+def job_search_possible_fish(payload):
+    provider = payload["provider"]
+    ai_result = identify_image_candidates(provider, fetch_image_shared(payload["image"], provider_encoding(provider)))
+    if not ai_result:
+        raise RuntimeError("AI could not identify fish")
+    return ai_result
+
+def job_caption_and_identify(payload):
+    provider = payload["provider"]
+    result = caption_and_identify_result(payload["image"], provider, fetch_image(payload["image"], provider_encoding(provider)))
+    if not result:
+        raise RuntimeError("AI could not identify fish")
+    return result
+
+job_queue.register("image_captioning", job_image_captioning)
+job_queue.register("image_identification", job_image_identification)
+job_queue.register("search_possible_fish", job_search_possible_fish)
+job_queue.register("caption_and_identify", job_caption_and_identify)
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Input: JSON {"type": "image_captioning"|"image_identification"|"search_possible_fish"|"caption_and_identify",
+                 "image": "user-upload/filename.jpg", "provider": "groq"|"gemini" (optional),
+                 "webhook_url": "https://..." (optional)}
+    Output: 202 {"job_id": ..., "status": "queued", "status_url": "/jobs/<job_id>"}
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Invalid JSON body"}), 400
+    job_type = data.get("type", "")
+    if job_type not in job_queue.handlers:
+        return jsonify({"error": f"type must be one of {sorted(job_queue.handlers)}"}), 400
+    image_key = data.get("image", "")
+    if not image_key:
+        return jsonify({"error": "No 'image' key provided in JSON"}), 400
+    # Resolved now so a later /changeModel does not change queued jobs
+    provider = data.get("provider") or ("gemini" if USE_GEMINI else "groq")
+    if provider not in CAPTION_PROVIDERS:
+        return jsonify({"error": f"provider must be one of {list(CAPTION_PROVIDERS)}"}), 400
+    webhook_url = data.get("webhook_url")
+    if webhook_url and not job_queue.webhook_allowed(webhook_url):
+        return jsonify({"error": "webhook_url must be an http(s) URL on a host in JOB_WEBHOOK_ALLOWED_HOSTS"}), 400
+
+    job_id = job_queue.submit(job_type, {"image": image_key, "provider": provider}, webhook_url=webhook_url)
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    return jsonify(job), 200
+
 @app.route("/changeModel", methods=["GET"])
 def change_use_gemini():
     global USE_GEMINI
@@ -412,5 +753,10 @@ def change_use_gemini():
 def is_gemini():
     global USE_GEMINI
     return jsonify({"USE_GEMINI": USE_GEMINI}), 200
+# Development server only; production runs `gunicorn -c gunicorn_conf.py api_services:app`
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    debug = os.getenv("FLASK_DEBUG", "0") == "1"
+    # With the reloader only the child process (WERKZEUG_RUN_MAIN) serves requests
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_workers()
+    app.run(host='0.0.0.0', port=int(os.getenv("PORT", "8080")), debug=debug)
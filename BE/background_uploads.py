@@ -0,0 +1,80 @@
+"""
+Background persistence of directly uploaded images to IBM COS.
+
+Images posted as multipart/form-data or a raw body are identified from the
+request bytes; saving them to `fish-image-bucket` (so the key in the response
+can be used later) happens on a small thread pool, off the response path.
+"""
+import mimetypes
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+UPLOAD_BUCKET = os.getenv("UPLOAD_BUCKET", "fish-image-bucket")
+UPLOAD_KEY_PREFIX = os.getenv("UPLOAD_KEY_PREFIX", "user-upload/")
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", "2"))
+
+
+def upload_key(filename: Optional[str] = None, content_type: Optional[str] = None,
+               prefix: str = UPLOAD_KEY_PREFIX) -> str:
+    """
+    COS key for an uploaded image: a random name under `prefix` with the
+    extension of the file name or content type. Keys are always generated here,
+    never taken from the client, so an upload cannot replace an existing object.
+    """
+    ext = os.path.splitext(filename or "")[1].lower()
+    if not re.fullmatch(r"\.[a-z0-9]{1,5}", ext):
+        ext = ""
+        if content_type:
+            ext = mimetypes.guess_extension(content_type.split(";")[0].strip()) or ""
+    return f"{prefix}{uuid.uuid4().hex}{ext}"
+
+
+class BackgroundUploader:
+    """put_object on a thread pool; failures are retried and counted, never raised to the caller."""
+
+    def __init__(self, cos_client_fn: Callable[[], Any], bucket: str = UPLOAD_BUCKET,
+                 workers: int = UPLOAD_WORKERS, retries: int = UPLOAD_RETRIES):
+        self.cos_client_fn = cos_client_fn
+        self.bucket = bucket
+        self.retries = retries
+        self.stats_counters = {"submitted": 0, "uploaded": 0, "failed": 0, "bytes": 0}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cos-upload")
+
+    def submit(self, key: str, data: bytes, content_type: Optional[str] = None):
+        with self._lock:
+            self.stats_counters["submitted"] += 1
+            self._pending += 1
+        return self._executor.submit(self._upload, key, data, content_type)
+
+    def _upload(self, key: str, data: bytes, content_type: Optional[str]) -> bool:
+        extra = {"ContentType": content_type} if content_type else {}
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.cos_client_fn().put_object(Bucket=self.bucket, Key=key, Body=data, **extra)
+                    with self._lock:
+                        self.stats_counters["uploaded"] += 1
+                        self.stats_counters["bytes"] += len(data)
+                    return True
+                except Exception as e:
+                    print(f"✗ Background upload of {key} failed (attempt {attempt + 1}): {e}")
+            with self._lock:
+                self.stats_counters["failed"] += 1
+            return False
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats_counters, "pending": self._pending}
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,366 @@
+"""
+Token-budgeted chat history for /generation.
+
+The client sends the whole conversation with every request. The last
+CHAT_RECENT_TURNS turns go to the model verbatim; older turns are replaced by a
+rolling summary that is written off the response path. After each answer, the
+turns that will fall out of the verbatim window on the next request are folded
+into the previous summary on a background thread. Summaries are keyed by a hash
+chain over the messages, so the next request finds one for its history without
+the client sending anything new. Until a summary is ready, older turns are
+added newest first while they fit. Paragraphs repeated from a newer message
+(the species blocks an answer quotes again) are dropped from older ones, and
+the whole prompt is kept under CHAT_PROMPT_TOKEN_BUDGET.
+
+    python chat_history.py benchmark --turns 20     # prompt tokens/latency, last-10 vs managed
+"""
+import argparse
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+CHAT_HISTORY_MANAGER = os.getenv("CHAT_HISTORY_MANAGER", "1") == "1"
+CHAT_PROMPT_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", "6000"))
+CHAT_RECENT_TURNS = int(os.getenv("CHAT_RECENT_TURNS", "2"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "400"))
+CHAT_SUMMARY_CACHE_SIZE = int(os.getenv("CHAT_SUMMARY_CACHE_SIZE", "5000"))
+LEGACY_HISTORY_MESSAGES = 10
+MESSAGE_OVERHEAD_TOKENS = 4
+MIN_DEDUP_PARAGRAPH_CHARS = 80
+
+Message = Dict[str, Any]
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate without the model's tokenizer: ~4 characters per token for Latin
+    script, ~2 for Thai and other non-ASCII text. stats() reports how it
+    compares with the prompt_tokens the model returns.
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for c in text if c < "\x80")
+    return int(ascii_chars / 4 + (len(text) - ascii_chars) / 2) + 1
+
+
+def message_tokens(message: Message) -> int:
+    return count_tokens(str(message.get("content") or "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens - 1:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…"
+
+
+def prefix_hashes(messages: Sequence[Message]) -> List[str]:
+    """hashes[i] identifies messages[:i]; each hash chains the previous one."""
+    hashes = [hashlib.sha256(b"chat").hexdigest()]
+    for message in messages:
+        digest = hashlib.sha256(hashes[-1].encode("utf-8"))
+        digest.update(str(message.get("role")).encode("utf-8") + b"\x00")
+        digest.update(str(message.get("content") or "").strip().encode("utf-8"))
+        hashes.append(digest.hexdigest())
+    return hashes
+
+
+def clean_history(chat_history: Optional[Sequence[Message]]) -> List[Message]:
+    """Keeps user/assistant messages with content and drops immediate repeats (double submits)."""
+    history = []
+    for message in chat_history or []:
+        if not isinstance(message, dict) or message.get("role") not in ("user", "assistant"):
+            continue
+        content = str(message.get("content") or "").strip()
+        if not content or (history and history[-1]["role"] == message["role"] and history[-1]["content"] == content):
+            continue
+        history.append({"role": message["role"], "content": content})
+    return history
+
+
+def dedupe_paragraphs(messages: Sequence[Message]) -> List[Message]:
+    """Drops long paragraphs from a message when a newer message repeats them."""
+    seen = set()
+    result = []
+    for message in reversed(messages):
+        kept = []
+        for paragraph in message["content"].split("\n\n"):
+            key = " ".join(paragraph.split()).lower()
+            if len(key) >= MIN_DEDUP_PARAGRAPH_CHARS:
+                if key in seen:
+                    continue
+                seen.add(key)
+            kept.append(paragraph)
+        result.append({**message, "content": "\n\n".join(kept) or "(repeated above)"})
+    return result[::-1]
+
+
+def legacy_messages(system_prompt: str, user_prompt: str, chat_history: Optional[Sequence[Message]]) -> List[Message]:
+    """What /generation sent before the manager: the last 10 raw messages."""
+    return ([{"role": "system", "content": system_prompt}] + list(chat_history or [])[-LEGACY_HISTORY_MESSAGES:]
+            + [{"role": "user", "content": user_prompt}])
+
+
+class ChatHistoryManager:
+    """Builds budgeted chat prompts and keeps the rolling summaries (in memory, per process)."""
+
+    def __init__(self, summarize_fn: Optional[Callable[[str, List[Message]], str]] = None,
+                 budget: int = CHAT_PROMPT_TOKEN_BUDGET, recent_turns: int = CHAT_RECENT_TURNS,
+                 summary_max_tokens: int = CHAT_SUMMARY_MAX_TOKENS, max_summaries: int = CHAT_SUMMARY_CACHE_SIZE):
+        self.summarize_fn = summarize_fn
+        self.budget = budget
+        self.recent_messages = 2 * recent_turns
+        self.summary_max_tokens = summary_max_tokens
+        self.max_summaries = max_summaries
+        self.stats_counters = {"requests": 0, "summary_hits": 0, "summaries_made": 0, "summary_failures": 0,
+                               "dropped_messages": 0, "prompt_tokens_estimate": 0, "legacy_prompt_tokens_estimate": 0,
+                               "model_prompt_tokens": 0, "model_prompt_tokens_estimate": 0}
+        self._summary_s = 0.0
+        self._summaries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary")
+
+    def _latest_summary(self, hashes: Sequence[str], limit: int) -> Tuple[str, int]:
+        """(summary, messages covered) for the longest summarized prefix of at most `limit` messages."""
+        with self._lock:
+            for i in range(limit, 0, -1):
+                entry = self._summaries.get(hashes[i])
+                if entry is not None:
+                    self._summaries.move_to_end(hashes[i])
+                    return entry
+        return "", 0
+
+    def build_messages(self, system_prompt: str, user_prompt: str,
+                       chat_history: Optional[Sequence[Message]]) -> Tuple[List[Message], Dict[str, Any]]:
+        """Chat messages for the model and a summary of what was kept, summarized and dropped."""
+        legacy_tokens = sum(message_tokens(m) for m in legacy_messages(system_prompt, user_prompt, chat_history))
+        history = clean_history(chat_history)
+        split = max(0, len(history) - self.recent_messages)
+        summary, covered = self._latest_summary(prefix_hashes(history), split)
+        candidates = dedupe_paragraphs(history[covered:])
+        older, recent = candidates[:split - covered], candidates[split - covered:]
+
+        available = self.budget - count_tokens(system_prompt) - count_tokens(user_prompt) - 2 * MESSAGE_OVERHEAD_TOKENS
+        kept_recent = []
+        for message in reversed(recent):
+            cost = message_tokens(message)
+            if cost > available:
+                if available > 50:
+                    kept_recent.append({**message, "content": truncate_to_tokens(
+                        message["content"], available - MESSAGE_OVERHEAD_TOKENS)})
+                    available = 0
+                break
+            kept_recent.append(message)
+            available -= cost
+        if summary:
+            summary = truncate_to_tokens(summary, min(self.summary_max_tokens, max(0, available - 20)))
+            available -= count_tokens(summary) + 20
+        kept_older = []
+        if len(kept_recent) == len(recent):
+            for message in reversed(older):
+                cost = message_tokens(message)
+                if cost > available:
+                    break
+                kept_older.append(message)
+                available -= cost
+
+        if summary:
+            system_prompt = f"{system_prompt}\n\nSummary of the earlier conversation:\n{summary}"
+        messages = ([{"role": "system", "content": system_prompt}] + kept_older[::-1] + kept_recent[::-1]
+                    + [{"role": "user", "content": user_prompt}])
+        info = {
+            "history_messages": len(history),
+            "summarized_messages": covered,
+            "verbatim_messages": len(kept_older) + len(kept_recent),
+            "dropped_messages": len(history) - covered - len(kept_older) - len(kept_recent),
+            "prompt_tokens_estimate": sum(message_tokens(m) for m in messages),
+            "legacy_prompt_tokens_estimate": legacy_tokens,
+        }
+        with self._lock:
+            self.stats_counters["requests"] += 1
+            self.stats_counters["summary_hits"] += 1 if covered else 0
+            for key in ("dropped_messages", "prompt_tokens_estimate", "legacy_prompt_tokens_estimate"):
+                self.stats_counters[key] += info[key]
+        return messages, info
+
+    def record_model_usage(self, info: Dict[str, Any], response: Any):
+        """Compares the estimate with usage.prompt_tokens when the model reports it."""
+        usage = response.get("usage") if isinstance(response, dict) else None
+        if usage and usage.get("prompt_tokens"):
+            with self._lock:
+                self.stats_counters["model_prompt_tokens"] += usage["prompt_tokens"]
+                self.stats_counters["model_prompt_tokens_estimate"] += info["prompt_tokens_estimate"]
+
+    def after_response(self, chat_history: Optional[Sequence[Message]]):
+        """
+        Schedules the summary the next request will need: everything before its
+        verbatim window, i.e. this history plus the new question and answer minus
+        the last CHAT_RECENT_TURNS turns. Returns the future, or None.
+        """
+        if self.summarize_fn is None:
+            return None
+        history = clean_history(chat_history)
+        target = min(len(history), len(history) + 2 - self.recent_messages)
+        if target <= 0:
+            return None
+        hashes = prefix_hashes(history)
+        with self._lock:
+            if hashes[target] in self._summaries or hashes[target] in self._pending:
+                return None
+            self._pending.add(hashes[target])
+        previous, covered = self._latest_summary(hashes, target)
+        return self._executor.submit(self._summarize, hashes[target], previous, history[covered:target], target)
+
+    def _summarize(self, key: str, previous: str, messages: List[Message], covered: int):
+        start = time.perf_counter()
+        try:
+            summary = truncate_to_tokens(self.summarize_fn(previous, messages).strip(), self.summary_max_tokens)
+            with self._lock:
+                self._summaries[key] = (summary, covered)
+                while len(self._summaries) > self.max_summaries:
+                    self._summaries.popitem(last=False)
+                self.stats_counters["summaries_made"] += 1
+                self._summary_s += time.perf_counter() - start
+            return summary
+        except Exception as e:
+            print(f"✗ Chat history summary failed: {e}")
+            with self._lock:
+                self.stats_counters["summary_failures"] += 1
+            return None
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def drain(self):
+        """Waits for the summaries scheduled so far (tests, benchmark)."""
+        self._executor.submit(lambda: None).result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self.stats_counters)
+            requests, made = c["requests"], c["summaries_made"]
+            return {
+                **c,
+                "summaries_cached": len(self._summaries),
+                "summaries_pending": len(self._pending),
+                "avg_prompt_tokens_estimate": round(c["prompt_tokens_estimate"] / requests, 1) if requests else None,
+                "avg_legacy_prompt_tokens_estimate": round(c["legacy_prompt_tokens_estimate"] / requests, 1)
+                if requests else None,
+                "avg_summary_s": round(self._summary_s / made, 3) if made else None,
+                "estimate_ratio": round(c["model_prompt_tokens"] / c["model_prompt_tokens_estimate"], 3)
+                if c["model_prompt_tokens_estimate"] else None,
+            }
+
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a user and a marine biology assistant about fish. "
+    "Update the summary with the new messages. Keep the fish species discussed (common, Thai and scientific names), "
+    "the facts the assistant gave, the user's questions and preferences and anything still open. "
+    "Leave out greetings and repeated reference data. Write plain text in the language of the conversation, "
+    "at most {max_words} words."
+)
+
+
+def summary_messages(previous_summary: str, messages: Sequence[Message], max_tokens: int = CHAT_SUMMARY_MAX_TOKENS):
+    """Prompt for folding `messages` into `previous_summary`."""
+    transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(max_words=int(max_tokens * 0.6))},
+        {"role": "user", "content": f"Current summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"},
+    ]
+
+
+# -------------------------------------------------------------------- benchmark
+
+BENCHMARK_QUESTIONS = [
+    "What does this fish eat?", "How big does it get?", "Can I keep it in a home aquarium?",
+    "Is it dangerous to humans?", "Where in Thailand can I see it?", "How long does it live?",
+    "How does it defend itself?", "Is it the same as the species with black spots?", "ปลาชนิดนี้กินได้ไหม",
+    "What depth does it live at?",
+]
+
+
+def synthetic_answer(record: Dict[str, str], question: str) -> str:
+    """A Markdown answer in the style of /generation that quotes the species record again."""
+    return (f"## {record['fish_name']} ({record['scientific_name']})\n\n"
+            f"Regarding *{question}*:\n\n{record['general_description']}\n\n"
+            f"**Physical description:** {record['physical_description']}\n\n"
+            f"**Habitat:** {record['habitat']}\n\nLet me know if you want to compare it with a similar species!")
+
+
+def run_benchmark(turns: int, managed: bool, synthetic: bool, record: Dict[str, str]) -> List[Dict[str, Any]]:
+    import generation
+    context = "; ".join(f"{k}: {v}" for k, v in record.items())
+    calls = []
+    chat = generation.model.chat
+
+    def recording_chat(messages, **kwargs):
+        start = time.perf_counter()
+        response = chat(messages=messages, **kwargs)
+        usage = response.get("usage") or {}
+        calls.append({"estimate": sum(message_tokens(m) for m in messages),
+                      "prompt_tokens": usage.get("prompt_tokens"), "latency_s": time.perf_counter() - start})
+        return response
+
+    manager = ChatHistoryManager(generation.summarize_history) if managed else None
+    rows, history = [], []
+    previous_model, previous_manager = generation.model.chat, generation.history_manager
+    generation.model.chat, generation.history_manager = recording_chat, manager
+    try:
+        for turn in range(turns):
+            question = BENCHMARK_QUESTIONS[turn % len(BENCHMARK_QUESTIONS)]
+            calls.clear()
+            answer = generation.get_generated_response_with_context(question, context, history)
+            call = calls[0]
+            rows.append({"turn": turn + 1, "history_messages": len(history), "prompt_tokens_estimate": call["estimate"],
+                         "prompt_tokens": call["prompt_tokens"], "latency_s": round(call["latency_s"], 3)})
+            history = history + [{"role": "user", "content": question},
+                                 {"role": "assistant", "content": synthetic_answer(record, question) if synthetic
+                                  else answer}]
+            if manager:
+                manager.drain()  # the user reads the answer while the summary is written
+    finally:
+        generation.model.chat, generation.history_manager = previous_model, previous_manager
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("benchmark",))
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--species", default="White-spotted puffer")
+    parser.add_argument("--synthetic-answers", action="store_true",
+                        help="store long Markdown answers in the history instead of the model's (for the fakes)")
+    args = parser.parse_args()
+
+    from fake_providers import load_species
+    records = {r["fish_name"]: r for r in load_species()}
+    record = records.get(args.species) or next(iter(records.values()))
+    results = {mode: run_benchmark(args.turns, mode == "managed", args.synthetic_answers, record)
+               for mode in ("legacy", "managed")}
+
+    print(f"{'turn':>4} {'history':>8} | {'legacy est':>10} {'tokens':>7} {'latency s':>9} | "
+          f"{'managed est':>11} {'tokens':>7} {'latency s':>9}")
+    for legacy, managed in zip(results["legacy"], results["managed"]):
+        print(f"{legacy['turn']:>4} {legacy['history_messages']:>8} | {legacy['prompt_tokens_estimate']:>10} "
+              f"{legacy['prompt_tokens'] or '-':>7} {legacy['latency_s']:>9.2f} | {managed['prompt_tokens_estimate']:>11} "
+              f"{managed['prompt_tokens'] or '-':>7} {managed['latency_s']:>9.2f}")
+    for mode, rows in results.items():
+        late = rows[len(rows) // 2:]
+        print(f"{mode}: mean estimated prompt tokens over the second half {sum(r['prompt_tokens_estimate'] for r in late) / len(late):.0f}, "
+              f"mean latency {sum(r['latency_s'] for r in late) / len(late):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,13 @@
-from transformers import AutoTokenizer, AutoModel
+import os
+from huggingface_hub import snapshot_download
 
-model_id = "Snowflake/snowflake-arctic-embed-l-v2.0"
-# Download and cache the model and tokenizer
-tokenizer = AutoTokenizer.from_pretrained(model_id)
-model = AutoModel.from_pretrained(model_id)
+model_id = os.getenv("EMBEDDING_MODEL_NAME", "Snowflake/snowflake-arctic-embed-l-v2.0")
+# Safetensors weights, tokenizer and sentence-transformers configs only; the
+# ONNX and pytorch_model.bin copies would double the image and are never loaded
+snapshot_download(model_id, ignore_patterns=["*.bin", "*.onnx", "*.onnx_data", "onnx/*", "openvino/*",
+                                             "*.h5", "*.msgpack", "*.ot"])
+
+# Image embedding model for the optional kNN fast path (image_knn.py)
+if os.getenv("IMAGE_KNN_FAST_PATH", "0") == "1":
+    from image_knn import ImageEmbedder
+    ImageEmbedder()._load()
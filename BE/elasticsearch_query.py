@@ -104,6 +104,29 @@ class ElasticsearchQuery:
         except Exception as e:
             print(f"✗ Embedding search error: {e}")
     
+    def search_all(self, index_name, size=1000, exclude_fields=None):
+        """Return every document (up to size), optionally without large fields such as embeddings"""
+        try:
+            body = {"query": {"match_all": {}}, "size": size}
+            if exclude_fields:
+                body["_source"] = {"excludes": list(exclude_fields)}
+            response = self.es.search(index=index_name, body=body)
+            docs = [hit['_source'] for hit in response['hits']['hits']]
+            print(f"📄 Loaded {len(docs)} documents from {index_name}")
+            return docs
+        except Exception as e:
+            print(f"✗ Search error: {e}")
+    
+    def index_version(self, index_name):
+        """Cheap change marker for an index: (doc count, indexed ops, deleted ops)"""
+        try:
+            stats = self.es.indices.stats(index=index_name, metric="docs,indexing")
+            primaries = stats['_all']['primaries']
+            return (primaries['docs']['count'], primaries['indexing']['index_total'],
+                    primaries['indexing']['delete_total'])
+        except Exception as e:
+            print(f"✗ Index stats error: {e}")
+    
     def count_docs(self, index_name, query=None):
         """Count documents matching query"""
         try:
@@ -0,0 +1,182 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "/tmp/embedding_cache.sqlite3")
+DEFAULT_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+DEFAULT_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float16")
+
+
+def normalize_text(text: str) -> str:
+    """Whitespace/unicode normalisation so trivially different strings share a cache entry."""
+    return " ".join(unicodedata.normalize("NFC", str(text)).split())
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache stored as compact float16/float32 blobs in SQLite.
+
+    Entries are keyed by (model name, dimension, sha256 of the normalised text) so
+    switching the embedding model can never return stale vectors. The least
+    recently used rows are evicted once `max_entries` is exceeded. The same file
+    can be shared by the ingestion job and the BE query path.
+    """
+
+    def __init__(self, model_name: str, dim: int, path: str = DEFAULT_CACHE_PATH,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, dtype: str = DEFAULT_DTYPE):
+        if dtype not in ("float16", "float32"):
+            raise ValueError("dtype must be 'float16' or 'float32'")
+        self.model_name = model_name
+        self.dim = dim
+        self.path = path
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model_name TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                text_hash TEXT NOT NULL,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model_name, dim, text_hash)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+        conn.commit()
+        return conn
+
+    def after_fork(self):
+        """Reopens the connection in a forked child; SQLite connections must not cross fork()."""
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Returns {text_hash: vector} for every text that is already cached."""
+        hashes = list({self.text_hash(t) for t in texts})
+        found = {}
+        with self._lock:
+            # SQLite limits the number of bound parameters, so look up in chunks
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, dtype, vector FROM embeddings "
+                    f"WHERE model_name = ? AND dim = ? AND text_hash IN ({placeholders})",
+                    [self.model_name, self.dim, *chunk],
+                ).fetchall()
+                for text_hash, dtype, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.dtype(dtype).newbyteorder("<")).astype(np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model_name = ? AND dim = ? AND text_hash = ?",
+                    [(now, self.model_name, self.dim, h) for h in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            arr = np.asarray(vector, dtype=self.dtype)
+            if arr.shape != (self.dim,):
+                print(f"⚠️ Not caching embedding with shape {arr.shape}, expected ({self.dim},)")
+                continue
+            rows.append((self.model_name, self.dim, self.text_hash(text), self.dtype.name, arr.tobytes(), now))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model_name, dim, text_hash, dtype, vector, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += overflow
+
+    def embed_with_cache(self, texts: Sequence[str], compute_fn) -> List[np.ndarray]:
+        """
+        Returns one vector per input text. Only the cache misses (deduplicated) are
+        passed to `compute_fn` in a single call; `compute_fn(list_of_texts)` must
+        return one vector per text in the same order.
+        """
+        texts = [str(t) for t in texts]
+        cached = self.get_many(texts)
+        hashes = [self.text_hash(t) for t in texts]
+
+        missing = {}
+        for text, h in zip(texts, hashes):
+            if h not in cached and h not in missing:
+                missing[h] = text
+
+        with self._lock:
+            self.hits += sum(1 for h in hashes if h in cached)
+            self.misses += sum(1 for h in hashes if h not in cached)
+
+        if missing:
+            miss_texts = list(missing.values())
+            computed = compute_fn(miss_texts)
+            self.put_many(miss_texts, computed)
+            for h, vector in zip(missing.keys(), computed):
+                cached[h] = np.asarray(vector, dtype=np.float32)
+
+        return [cached[h] for h in hashes]
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "model_name": self.model_name,
+                "dim": self.dim,
+                "dtype": self.dtype.name,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,8 +1,11 @@
 import os
+import time
 import requests
+import numpy as np
 from typing import List, Union
-from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
+from embedding_cache import EmbeddingCache
+from embedding_wire_format import WIRE_FORMATS, decode_embedding_response
 
 load_dotenv()
 
@@ -10,17 +13,37 @@ load_dotenv()
 cache_directory = "/tmp/huggingface_models" # You can choose a sub-directory in /tmp
 
 # Ensure the directory exists
-import os
 os.makedirs(cache_directory, exist_ok=True)
 
 
 
+def load_local_model(model_name: str):
+    """
+    SentenceTransformer for the local embedding type. Imported here so the
+    remote-only image (without requirements-local-model.txt) never loads torch.
+    Weights come from safetensors (no pickle, no .bin copy in the image), and
+    low_cpu_mem_usage skips the random initialisation the weights overwrite.
+    transformers still copies the tensors out of the file, so the weights are
+    not memory-mapped at runtime.
+    """
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        raise ImportError("embedding_type='sentence_transformer' needs the local model packages: "
+                          "pip install -r requirements-local-model.txt") from e
+    start = time.perf_counter()
+    model = SentenceTransformer(model_name, model_kwargs={"use_safetensors": True, "low_cpu_mem_usage": True})
+    print(f"✓ Loaded {model_name} in {time.perf_counter() - start:.1f}s")
+    return model
+
+
 class EmbeddingService:
-    def __init__(self, embedding_type: str = "watsonx", model_name: str = None):
+    def __init__(self, embedding_type: str = "watsonx", model_name: str = None, use_cache: bool = None):
         self.embedding_type = embedding_type.lower()
+        self.model_name = model_name or os.getenv("EMBEDDING_MODEL_NAME", 'Snowflake/snowflake-arctic-embed-l-v2.0')
         print(f"Using embedding type: {self.embedding_type}")
         if self.embedding_type == "sentence_transformer":
-            self.model = SentenceTransformer(model_name or 'Snowflake/snowflake-arctic-embed-l-v2.0')
+            self.model = load_local_model(self.model_name)
         elif self.embedding_type == "watsonx":
             load_dotenv()
             self.emb_url = os.getenv("EMBEDDING_SERVICE_URL")
@@ -29,19 +52,48 @@ class EmbeddingService:
         else:
             raise ValueError("embedding_type must be 'sentence_transformer' or 'watsonx'")
 
+        self.request_batch_size = int(os.getenv("EMBEDDING_REQUEST_BATCH_SIZE", "32"))
+        wire_format = os.getenv("EMBEDDING_WIRE_FORMAT", "json").lower()
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"EMBEDDING_WIRE_FORMAT must be one of {list(WIRE_FORMATS)}")
+        self.accept = WIRE_FORMATS[wire_format]
+        if use_cache is None:
+            use_cache = os.getenv("EMBEDDING_CACHE_ENABLED", "1") == "1"
+        self.cache = EmbeddingCache(self.model_name, int(os.getenv("EMBEDDING_DIM", "1024"))) if use_cache else None
+
+    def _compute(self, sentences: List[str]):
+        """Embeds a list of sentences without touching the cache."""
+        if self.embedding_type == "sentence_transformer":
+            return list(self.model.encode(sentences))
+        # The embedding service accepts a batch and returns one [sentence, vector] pair per input
+        embeddings = []
+        for start in range(0, len(sentences), self.request_batch_size):
+            batch = sentences[start:start + self.request_batch_size]
+            response = requests.post(self.emb_url, json={"sentence": batch}, headers={"Accept": self.accept})
+            response.raise_for_status()
+            embeddings.extend(decode_embedding_response(response))
+        return embeddings
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache else {"enabled": False}
+
     def embed_text(self, sentences: Union[str, List[str]]):
         single_input = isinstance(sentences, str)
         print(f"Embedding input: {sentences}")
         if single_input:
             sentences = [sentences]
+        sentences = list(sentences)
+
+        if self.cache is not None:
+            embeddings = self.cache.embed_with_cache(sentences, self._compute)
+        else:
+            embeddings = self._compute(sentences)
 
         if self.embedding_type == "sentence_transformer":
-            embeddings = self.model.encode(sentences)
+            embeddings = np.vstack(embeddings)
             return embeddings
-        else:  # watsonx
-            embeddings = []
-            for sentence in sentences:
-                response = requests.post(self.emb_url, json={"sentence": [sentence]})
-                embeddings.append(response.json()["predictions"][0]["values"][0][1])
+        # Stays a float32 array: the Elasticsearch client serializes ndarrays in the
+        # query body itself, so no list of Python floats is built per request
+        embeddings = np.asarray(embeddings, dtype=np.float32)
 
         return embeddings[0] if single_input else embeddings
@@ -0,0 +1,39 @@
+"""
+Client side of the /extract_text response formats (see
+snowflake-embedding/wire_format.py). Shared by BE/embedding_service.py and
+INGESTION/embedding_service.py.
+"""
+import io
+
+import numpy as np
+
+# Response formats understood by the embedding service
+WIRE_FORMATS = {
+    "json": "application/json",
+    "float32": "application/x-float32",
+    "float16": "application/x-float16",
+    "npy": "application/x-npy",
+}
+BINARY_DTYPES = {
+    "application/x-float32": np.dtype("<f4"),
+    "application/x-float16": np.dtype("<f2"),
+}
+
+
+def decode_embedding_response(response):
+    """
+    Returns an (n, dim) array from an /extract_text response. Binary bodies are
+    viewed in place with np.frombuffer (no per-float parsing); JSON is still
+    accepted so older embedding servers keep working. Any other content type
+    raises ValueError.
+    """
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type == "application/x-npy":
+        return np.load(io.BytesIO(response.content), allow_pickle=False)
+    if content_type in BINARY_DTYPES:
+        matrix = np.frombuffer(response.content, dtype=BINARY_DTYPES[content_type])
+        rows, dim = (int(x) for x in response.headers["X-Embedding-Shape"].split(","))
+        return matrix.reshape(rows, dim)
+    if content_type not in ("application/json", ""):
+        raise ValueError(f"Unsupported embedding response content type: {content_type!r}")
+    return np.asarray([value[1] for value in response.json()["predictions"][0]["values"]], dtype=np.float32)
@@ -0,0 +1,335 @@
+"""
+Offline-capable accuracy and latency evaluation for the identification pipelines.
+
+Walks a labelled image set, either a local folder laid out as <root>/<Species>/<image>
+or the COS layout <prefix><Species>/<image> (e.g. fish-image/Argus-grouper/argus-grouper-001.png),
+runs any combination of pipelines and writes:
+
+    <output>/results.csv            one row per (image, pipeline), same columns as fish_identification_batch_results.csv
+    <output>/confusion_<name>.csv   expected species x predicted top-1 species
+    <output>/summary.json           top-1/top-5 accuracy and per-stage latency percentiles
+    <output>/candidates.csv         per-candidate LLM/kNN features of the fused pipelines, for `reranker.py fit`
+
+Provider responses are stored under --record-dir. Run once with --mode record (or auto),
+then re-score or re-rank with --mode replay: no COS, LLM, embedding or ES calls are made.
+
+    python evaluation_harness.py --cos-prefix fish-image/ --pipelines caption_knn,groq,hybrid --mode auto
+    python evaluation_harness.py --cos-prefix fish-image/ --pipelines hybrid --mode replay
+    python evaluation_harness.py --images-dir ../EXTRACTION/DATA/labelled --pipelines gemini
+    python evaluation_harness.py --cos-prefix fish-image/ --pipelines image_knn,image_knn_fast,groq --image-index image_knn_index.npz
+"""
+import argparse
+import base64
+import csv
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+from pipelines import IMAGE_PIPELINES, LLM_PROVIDERS, PIPELINES, run_pipeline
+from provider_recorder import ProviderRecorder, RecordingNotFound
+from reranker import CANDIDATE_COLUMNS, candidate_rows
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+BUCKET_NAME = 'fish-image-bucket'
+INDEX_NAME = 'fish_index_v4'
+PERCENTILES = (50, 90, 95, 99)
+
+
+def normalize_species(name):
+    return re.sub(r"\s+", " ", re.sub(r"[-_]+", " ", name or "")).strip().lower()
+
+
+def species_from_folder(folder):
+    return re.sub(r"[-_]+", " ", folder).strip()
+
+
+def local_dataset(images_dir):
+    """[(image_id, expected_species)] for <images_dir>/<Species>/<image>."""
+    items = []
+    for root, _, files in os.walk(images_dir):
+        for filename in sorted(files):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(root, filename)
+            relative = os.path.relpath(path, images_dir)
+            parts = relative.split(os.sep)
+            if len(parts) < 2:
+                continue  # unlabelled image in the root folder
+            items.append((relative.replace(os.sep, "/"), species_from_folder(parts[0])))
+    return sorted(items)
+
+
+def make_cos_client():
+    import ibm_boto3
+    from ibm_botocore.client import Config
+    return ibm_boto3.client(
+        's3',
+        ibm_api_key_id=os.environ.get('IBM_COS_API_KEY'),
+        ibm_service_instance_id=os.environ.get('IBM_COS_RESOURCE_INSTANCE_ID'),
+        config=Config(signature_version='oauth'),
+        endpoint_url=os.environ.get('IBM_COS_ENDPOINT')
+    )
+
+
+def cos_dataset(prefix, recorder, cos_factory):
+    """[(object_key, expected_species)] for <prefix><Species>/<image>; the listing itself is recorded."""
+    def list_keys():
+        cos = cos_factory()
+        keys = []
+        for page in cos.get_paginator("list_objects_v2").paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+        return keys
+
+    keys = recorder.call("cos_list", [BUCKET_NAME, prefix], list_keys)
+    items = []
+    for key in keys:
+        parts = key[len(prefix):].split("/")
+        if len(parts) >= 2 and key.lower().endswith(IMAGE_EXTENSIONS):
+            items.append((key, species_from_folder(parts[0])))
+    return sorted(items)
+
+
+def build_clients(pipelines, hybrid_provider):
+    providers = {p for p in pipelines if p in LLM_PROVIDERS}
+    if {"hybrid", "caption_identify", "image_knn_fast"} & set(pipelines):
+        providers.add(hybrid_provider)
+    clients = {}
+    if "groq" in providers:
+        from groq import Groq
+        clients["groq"] = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+    if "gemini" in providers:
+        from google import genai
+        clients["gemini"] = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+    if "watsonx" in providers:
+        clients["watsonx"] = {
+            "api_key": os.getenv("WATSONX_APIKEY"),
+            "iam_url": os.getenv("IAM_IBM_CLOUD_URL"),
+            "project_id": os.getenv("PROJECT_ID"),
+            "chat_url": os.getenv("IBM_WATSONX_AI_INFERENCE_URL"),
+        }
+    return clients
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    arr = np.asarray(values)
+    stats = {f"p{p}": round(float(np.percentile(arr, p)), 4) for p in PERCENTILES}
+    stats["mean"] = round(float(arr.mean()), 4)
+    stats["count"] = int(arr.size)
+    return stats
+
+
+def format_top5(ranked):
+    return "; ".join(f"R{i}: {c['fish_name']} ({c['score']:.4f})" for i, c in enumerate(ranked[:5], start=1))
+
+
+def evaluate(dataset, pipelines, load_image, recorder, emb=None, esq=None, clients=None,
+             index_name=INDEX_NAME, hybrid_provider="groq", workers=4):
+    """Runs every pipeline on every image. Returns (rows, latencies per pipeline per stage)."""
+    clients = clients or {}
+    latencies = {name: defaultdict(list) for name in pipelines}
+
+    def run_one(item):
+        image_id, expected = item
+        pic_string = load_image(image_id)
+        rows = []
+        for name in pipelines:
+            timings = {}
+            start = time.perf_counter()
+            error = None
+            try:
+                output = run_pipeline(name, pic_string, image_id, emb, esq, index_name, clients,
+                                      recorder=recorder, timings=timings, hybrid_provider=hybrid_provider)
+            except RecordingNotFound as e:
+                output, error = {"ranked": []}, f"not recorded: {e}"
+            except Exception as e:
+                output, error = {"ranked": []}, str(e)
+            timings["total_wall"] = [time.perf_counter() - start]
+            # Provider stages report the recorded latency on replay, so their sum is the "live" total
+            timings["total_provider"] = [sum(sum(v) for k, v in timings.items() if not k.startswith("total"))]
+            ranked = output.get("ranked") or []
+            top5 = [normalize_species(c["fish_name"]) for c in ranked[:5]]
+            rows.append({
+                "pipeline": name,
+                "S3 Image Path": image_id,
+                "Expected Species (Folder Name)": expected,
+                "AI Generated Caption": (output.get("caption") or "")[:100].replace("\n", " "),
+                "Top Candidate": ranked[0]["fish_name"] if ranked else "",
+                "Top Candidate Score": round(ranked[0]["score"], 4) if ranked else "",
+                "Expected Species Is Top 1": bool(top5) and top5[0] == normalize_species(expected),
+                "Expected Species In Top 5 Candidates": normalize_species(expected) in top5,
+                "All Top 5 Candidates": format_top5(ranked),
+                "error": error or "",
+                "_timings": timings,
+                "_fast_path": output.get("fast_path"),
+                "_candidates": candidate_rows(name, image_id, expected, output["llm_ranked"], output["knn_ranked"])
+                               if "llm_ranked" in output else [],
+            })
+        return rows
+
+    all_rows = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, rows in enumerate(pool.map(run_one, dataset), start=1):
+            all_rows.extend(rows)
+            if i % 10 == 0 or i == len(dataset):
+                print(f"Evaluated {i}/{len(dataset)} images")
+    for row in all_rows:
+        for stage, values in row.pop("_timings").items():
+            latencies[row["pipeline"]][stage].extend(values)
+    return all_rows, latencies
+
+
+def summarize(rows, latencies, pipelines):
+    summary = {}
+    for name in pipelines:
+        pipeline_rows = [r for r in rows if r["pipeline"] == name]
+        scored = [r for r in pipeline_rows if not r["error"]]
+        n = len(scored)
+        summary[name] = {
+            "images": len(pipeline_rows),
+            "errors": len(pipeline_rows) - n,
+            "top1_accuracy": round(sum(r["Expected Species Is Top 1"] for r in scored) / n, 4) if n else None,
+            "top5_accuracy": round(sum(r["Expected Species In Top 5 Candidates"] for r in scored) / n, 4) if n else None,
+            "latency_s": {stage: percentiles(values) for stage, values in latencies[name].items()},
+        }
+        routed = [r for r in scored if r["_fast_path"] is not None]
+        if routed:
+            # Share of images answered by the image kNN alone, and how often those answers were right
+            fast = [r for r in routed if r["_fast_path"]]
+            summary[name]["fast_path_rate"] = round(len(fast) / len(routed), 4)
+            summary[name]["fast_path_top1_accuracy"] = (
+                round(sum(r["Expected Species Is Top 1"] for r in fast) / len(fast), 4) if fast else None)
+    return summary
+
+
+def confusion_matrix(rows, pipeline):
+    pipeline_rows = [r for r in rows if r["pipeline"] == pipeline and not r["error"]]
+    expected_labels = sorted({r["Expected Species (Folder Name)"] for r in pipeline_rows})
+    predicted_labels = sorted({r["Top Candidate"] or "<none>" for r in pipeline_rows})
+    counts = defaultdict(int)
+    for r in pipeline_rows:
+        counts[(r["Expected Species (Folder Name)"], r["Top Candidate"] or "<none>")] += 1
+    return expected_labels, predicted_labels, counts
+
+
+def write_outputs(output_dir, rows, summary, pipelines):
+    os.makedirs(output_dir, exist_ok=True)
+    fieldnames = [k for k in rows[0].keys() if not k.startswith("_")] if rows else []
+    with open(os.path.join(output_dir, "results.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    candidates = [c for r in rows for c in r.get("_candidates", [])]
+    if candidates:
+        with open(os.path.join(output_dir, "candidates.csv"), "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(CANDIDATE_COLUMNS))
+            writer.writeheader()
+            writer.writerows(candidates)
+
+    for name in pipelines:
+        expected_labels, predicted_labels, counts = confusion_matrix(rows, name)
+        with open(os.path.join(output_dir, f"confusion_{name}.csv"), "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["expected \\ predicted"] + predicted_labels)
+            for expected in expected_labels:
+                writer.writerow([expected] + [counts[(expected, p)] for p in predicted_labels])
+
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+
+
+def print_summary(summary, recorder):
+    print(f"\nProvider calls: {recorder.stats}")
+    for name, s in summary.items():
+        print(f"\n== {name}: {s['images']} images, {s['errors']} errors, "
+              f"top-1 {s['top1_accuracy']}, top-5 {s['top5_accuracy']}")
+        if "fast_path_rate" in s:
+            print(f"   fast path {s['fast_path_rate']} of images, top-1 {s['fast_path_top1_accuracy']} on those")
+        for stage, stats in sorted(s["latency_s"].items()):
+            print(f"   {stage:<16} " + "  ".join(f"{k}={v}" for k, v in stats.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images-dir", help="local folder laid out as <Species>/<image>")
+    source.add_argument("--cos-prefix", help="COS prefix laid out as <prefix><Species>/<image>, e.g. fish-image/")
+    parser.add_argument("--pipelines", default="caption_knn,groq,hybrid",
+                        help="comma separated subset of: " + ",".join(PIPELINES))
+    parser.add_argument("--hybrid-provider", default="groq", choices=LLM_PROVIDERS,
+                        help="LLM used by the hybrid, caption_identify and image_knn_fast pipelines")
+    parser.add_argument("--image-index", default=None,
+                        help="image kNN index for the image_knn pipelines (default IMAGE_KNN_INDEX_PATH)")
+    parser.add_argument("--mode", default="auto", choices=("off", "record", "replay", "auto"))
+    parser.add_argument("--record-dir", default="eval_recordings")
+    parser.add_argument("--output-dir", default="eval_output")
+    parser.add_argument("--index", default=INDEX_NAME)
+    parser.add_argument("--limit", type=int, default=None, help="only evaluate the first N images")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    load_dotenv()
+
+    pipelines = [p.strip() for p in args.pipelines.split(",") if p.strip()]
+    unknown = set(pipelines) - set(PIPELINES)
+    if unknown:
+        parser.error(f"unknown pipelines: {sorted(unknown)}")
+    recorder = ProviderRecorder(args.record_dir if args.mode != "off" else None, mode=args.mode)
+    offline = args.mode == "replay"
+
+    cos_holder = {}
+
+    def cos():
+        if "client" not in cos_holder:
+            cos_holder["client"] = make_cos_client()
+        return cos_holder["client"]
+
+    if args.images_dir:
+        dataset = local_dataset(args.images_dir)
+
+        def load_image(image_id):
+            with open(os.path.join(args.images_dir, image_id), "rb") as f:
+                return base64.b64encode(f.read()).decode("utf-8")
+    else:
+        dataset = cos_dataset(args.cos_prefix, recorder, cos)
+
+        def load_image(image_id):
+            body = cos().get_object(Bucket=BUCKET_NAME, Key=image_id)['Body'].read()
+            return base64.b64encode(body).decode("utf-8")
+
+    if offline:
+        # Replay never calls a provider, so the image bytes are not needed either
+        load_image = lambda image_id: ""
+    if args.limit:
+        dataset = dataset[:args.limit]
+    print(f"{len(dataset)} labelled images, pipelines {pipelines}, recorder mode {args.mode}")
+
+    emb = esq = None
+    if not offline and {"caption_knn", "hybrid", "caption_identify"} & set(pipelines):
+        from elasticsearch_query import ElasticsearchQuery
+        from embedding_service import EmbeddingService
+        esq = ElasticsearchQuery(os.environ["es_endpoint"], os.environ["es_username"], os.environ["es_password"])
+        emb = EmbeddingService('watsonx')
+    clients = {} if offline else build_clients(pipelines, args.hybrid_provider)
+    if set(IMAGE_PIPELINES) & set(pipelines):
+        # Needed on replay too: only the embedding is recorded, the index search runs locally
+        from image_knn import IMAGE_KNN_INDEX_PATH, ImageKNNClassifier, ImageKNNIndex
+        clients["image_knn"] = ImageKNNClassifier(ImageKNNIndex.load(args.image_index or IMAGE_KNN_INDEX_PATH))
+
+    rows, latencies = evaluate(dataset, pipelines, load_image, recorder, emb=emb, esq=esq, clients=clients,
+                               index_name=args.index, hybrid_provider=args.hybrid_provider, workers=args.workers)
+    summary = summarize(rows, latencies, pipelines)
+    write_outputs(args.output_dir, rows, summary, pipelines)
+    print_summary(summary, recorder)
+    print(f"\nResults written to {args.output_dir}/")
+
+
+if __name__ == "__main__":
+    main()
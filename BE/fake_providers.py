@@ -0,0 +1,556 @@
+# fake_providers.py
+# Local stand-ins for every external dependency of the BE, so the API can be
+# load tested and benchmarked on a laptop or in CI:
+#
+#   FakeCOSClient              ibm_boto3 S3 client backed by a local directory
+#   InMemoryElasticsearchQuery ElasticsearchQuery-compatible brute-force kNN
+#   HashEmbeddingService       deterministic feature-hashing embedder
+#   FakeGroqClient             groq.Groq chat.completions with schema-valid JSON
+#   FakeGeminiClient           genai.Client models.generate_content
+#   FakeChatModel              ibm_watsonx_ai ModelInference.chat
+#
+# Enabled in api_services.py / generation.py with FISH_FAKE_BACKENDS=1.
+# Every provider sleeps according to a latency distribution and fails with a
+# configurable error rate:
+#
+#   FAKE_LATENCY_<PROVIDER>=lognormal:<median_ms>:<sigma> | uniform:<lo_ms>:<hi_ms> | fixed:<ms>
+#   FAKE_ERROR_RATE_<PROVIDER>=0.02
+#   FAKE_CANNED_RESPONSES=canned.json   {"groq": {...}, "gemini": {...}, "caption": "..."}
+#
+# where <PROVIDER> is COS, ES, EMBEDDING, GROQ, GEMINI, WATSONX.
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from species_catalogue import load_species_csv
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
+
+DEFAULT_SPECIES_CSV = os.path.join(REPO_DIR, "EXTRACTION", "DATA", "fish-description-files",
+                                   "Marine_Fish_Species_Formatted_updated.csv")
+FALLBACK_SPECIES_CSV = os.path.join(BASE_DIR, "Marine_Fish_Possible_Output.csv")
+DEFAULT_COS_DIR = os.path.join(REPO_DIR, "EXTRACTION", "DATA")
+
+# Defaults roughly follow what production shows for each dependency
+DEFAULT_LATENCY = {
+    "cos": "lognormal:40:0.4",
+    "es": "lognormal:25:0.3",
+    "embedding": "lognormal:60:0.3",
+    "groq": "lognormal:2500:0.4",
+    "gemini": "lognormal:4000:0.4",
+    "watsonx": "lognormal:6000:0.4",
+}
+
+
+class FakeProviderError(Exception):
+    """Injected failure, raised with probability FAKE_ERROR_RATE_<PROVIDER>."""
+
+
+class LatencyModel:
+    """Samples a delay per call from a fixed, uniform or log-normal distribution and injects errors."""
+
+    def __init__(self, provider: str, spec: Optional[str] = None, error_rate: Optional[float] = None, seed=None):
+        self.provider = provider
+        spec = spec or os.getenv(f"FAKE_LATENCY_{provider.upper()}", DEFAULT_LATENCY.get(provider, "fixed:0"))
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        self.error_rate = error_rate if error_rate is not None else float(os.getenv(f"FAKE_ERROR_RATE_{provider.upper()}", "0"))
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_ms(self) -> float:
+        with self._lock:
+            if self.kind == "fixed":
+                return self.params[0]
+            if self.kind == "uniform":
+                return self._rng.uniform(self.params[0], self.params[1])
+            if self.kind == "lognormal":
+                median, sigma = self.params
+                return median * math.exp(self._rng.gauss(0.0, sigma))
+            raise ValueError(f"Unknown latency distribution '{self.kind}' for {self.provider}")
+
+    def wait(self):
+        time.sleep(self.sample_ms() / 1000.0)
+        with self._lock:
+            failed = self._rng.random() < self.error_rate
+        if failed:
+            raise FakeProviderError(f"injected {self.provider} failure")
+
+
+def _stable_index(data: str, modulo: int) -> int:
+    return int(hashlib.sha256(data.encode("utf-8", "ignore")).hexdigest(), 16) % modulo
+
+
+def load_species(csv_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Reads the species catalogue into ES-style documents (without embeddings)."""
+    csv_path = csv_path or os.getenv("FAKE_SPECIES_CSV") or (
+        DEFAULT_SPECIES_CSV if os.path.exists(DEFAULT_SPECIES_CSV) else FALLBACK_SPECIES_CSV)
+    return load_species_csv(csv_path)
+
+
+# --------------------------------------------------------------------------- COS
+
+class FakeNoSuchKey(Exception):
+    """Mirrors botocore's NoSuchKey for missing objects."""
+
+
+class _FakeStreamingBody:
+    """Subset of botocore StreamingBody used by the BE, reading lazily from a file or bytes."""
+
+    def __init__(self, data, length: Optional[int] = None):
+        self._stream = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+        self._remaining = length
+
+    def read(self, amt=None):
+        if self._remaining is not None:
+            amt = self._remaining if amt is None else min(amt, self._remaining)
+        data = self._stream.read() if amt is None else self._stream.read(amt)
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return data
+
+    def iter_chunks(self, chunk_size=1024 * 64):
+        while True:
+            chunk = self._stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._stream.close()
+
+
+class FakeCOSClient:
+    """
+    Directory-backed stand-in for the ibm_boto3 S3 client. Buckets are ignored,
+    keys are paths relative to `root` (FAKE_COS_DIR, default EXTRACTION/DATA).
+    """
+
+    def __init__(self, root: Optional[str] = None, latency: Optional[LatencyModel] = None):
+        self.root = os.path.abspath(root or os.getenv("FAKE_COS_DIR", DEFAULT_COS_DIR))
+        self.latency = latency or LatencyModel("cos")
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise FakeNoSuchKey(key)
+        return path
+
+    def _metadata(self, key, path):
+        stat = os.stat(path)
+        return {
+            "ContentLength": stat.st_size,
+            "ContentType": _guess_content_type(key),
+            "ETag": f'"{hashlib.md5(f"{key}:{stat.st_size}:{stat.st_mtime}".encode()).hexdigest()}"',
+            "LastModified": stat.st_mtime,
+        }
+
+    def head_object(self, Bucket, Key):
+        self.latency.wait()
+        path = self._path(Key)
+        if not os.path.isfile(path):
+            raise FakeNoSuchKey(Key)
+        return self._metadata(Key, path)
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.latency.wait()
+        path = self._path(Key)
+        if not os.path.isfile(path):
+            raise FakeNoSuchKey(Key)
+        response = self._metadata(Key, path)
+        size = length = response["ContentLength"]
+        f = open(path, "rb")
+        if Range:
+            match = re.match(r"bytes=(\d+)-(\d*)", Range)
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+            f.seek(start)
+            length = max(end - start + 1, 0)
+            response["ContentRange"] = f"bytes {start}-{start + length - 1}/{size}"
+            response["ContentLength"] = length
+        # Streamed from disk like botocore's StreamingBody, so memory benchmarks are not skewed
+        response["Body"] = _FakeStreamingBody(f, length)
+        return response
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.latency.wait()
+        path = self._path(Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = Body.read() if hasattr(Body, "read") else Body
+        with open(path, "wb") as f:
+            f.write(data)
+        return {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        self.latency.wait()
+        contents = []
+        for dirpath, _, files in os.walk(self.root):
+            for filename in files:
+                key = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, "/")
+                if key.startswith(Prefix):
+                    meta = self._metadata(key, os.path.join(dirpath, filename))
+                    contents.append({"Key": key, "Size": meta["ContentLength"], "ETag": meta["ETag"]})
+        return {"Contents": sorted(contents, key=lambda c: c["Key"]), "IsTruncated": False}
+
+    def get_paginator(self, operation_name):
+        client = self
+
+        class _Paginator:
+            def paginate(self, **kwargs):
+                yield client.list_objects_v2(**kwargs)
+
+        return _Paginator()
+
+
+def _guess_content_type(key: str) -> str:
+    ext = os.path.splitext(key)[1].lower()
+    return {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}.get(
+        ext, "application/octet-stream")
+
+
+# --------------------------------------------------------------------- embedding
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+class HashEmbeddingService:
+    """
+    Deterministic stand-in for EmbeddingService: signed feature hashing of word
+    unigrams and bigrams, L2 normalised. Texts sharing words get similar vectors,
+    which is enough for the kNN to return plausible neighbours.
+    """
+
+    def __init__(self, dim: int = 1024, latency: Optional[LatencyModel] = None):
+        self.dim = dim
+        self.embedding_type = "fake"
+        self.model_name = "fake-hash-embedding"
+        self.latency = latency or LatencyModel("embedding")
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        tokens = [t.lower() for t in _TOKEN.findall(str(text))]
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_text(self, sentences):
+        self.latency.wait()
+        single_input = isinstance(sentences, str)
+        if single_input:
+            sentences = [sentences]
+        embeddings = np.array([self._vector(s) for s in sentences], dtype=np.float32).reshape(-1, self.dim)
+        return embeddings[0] if single_input else embeddings
+
+    def cache_stats(self):
+        return {"enabled": False, "fake": True}
+
+
+# -------------------------------------------------------------------- search
+
+class InMemoryElasticsearchQuery:
+    """Brute-force cosine kNN over the species catalogue with the ElasticsearchQuery interface."""
+
+    def __init__(self, embedder: HashEmbeddingService, docs: Optional[List[Dict[str, Any]]] = None,
+                 latency: Optional[LatencyModel] = None):
+        self.latency = latency or LatencyModel("es")
+        self.docs = docs if docs is not None else load_species()
+        self.vectors = {}
+        for field in ("physical_description", "general_description"):
+            matrix = np.asarray(embedder.embed_text([d.get(field) or "" for d in self.docs])
+                                if self.docs else np.zeros((0, embedder.dim)), dtype=np.float32)
+            self.vectors[f"{field}_embedding"] = matrix
+        self.index_version_counter = 1
+
+    def list_all_index(self, creator="user"):
+        return ["fake_fish_index"]
+
+    def search_embedding(self, index_name, embedding_field, query_vector, size=10):
+        self.latency.wait()
+        matrix = self.vectors[embedding_field]
+        query = np.asarray(query_vector, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        cosine = matrix @ query / np.where(norms == 0, 1.0, norms)
+        top = np.argsort(-cosine)[:size]
+        return {"hits": {"total": {"value": len(top)}, "hits": [
+            # ES reports cosine similarity as (1 + cos) / 2
+            {"_id": str(i), "_score": float((1 + cosine[i]) / 2), "_source": self.docs[i]} for i in top
+        ]}}
+
+    def search_text(self, index_name, field, text, size=10):
+        self.latency.wait()
+        query = set(t.lower() for t in _TOKEN.findall(text))
+        scored = []
+        for doc in self.docs:
+            overlap = len(query & set(t.lower() for t in _TOKEN.findall(str(doc.get(field) or ""))))
+            if overlap:
+                scored.append((overlap, doc))
+        scored.sort(key=lambda x: -x[0])
+        return [doc for _, doc in scored[:size]]
+
+    def search_exact(self, index_name, field, value, size=10):
+        self.latency.wait()
+        return [doc for doc in self.docs if doc.get(field) == value][:size]
+
+    def search_all(self, index_name, size=1000, exclude_fields=None):
+        self.latency.wait()
+        return list(self.docs[:size])
+
+    def count_docs(self, index_name, query=None):
+        return len(self.docs)
+
+    def index_version(self, index_name):
+        return (len(self.docs), self.index_version_counter)
+
+
+# ---------------------------------------------------------------------- vision
+
+def _canned_responses() -> Dict[str, Any]:
+    path = os.getenv("FAKE_CANNED_RESPONSES")
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FakeVisionModel:
+    """Produces schema-valid identification JSON, deterministic per image."""
+
+    def __init__(self, provider: str, docs: List[Dict[str, Any]], latency: Optional[LatencyModel] = None,
+                 canned: Optional[Dict[str, Any]] = None):
+        self.provider = provider
+        self.docs = docs
+        self.latency = latency or LatencyModel(provider)
+        self.canned = canned if canned is not None else _canned_responses()
+
+    def _ranked_docs(self, image_key: str, n=5):
+        start = _stable_index(image_key, len(self.docs))
+        return [self.docs[(start + i * 7) % len(self.docs)] for i in range(n)]
+
+    def candidates(self, image_key: str, with_caption: bool = False) -> Dict[str, Any]:
+        if self.provider in self.canned:
+            return self.canned[self.provider]
+        scores = [0.86, 0.41, 0.22, 0.12, 0.05]
+        ranked = self._ranked_docs(image_key)
+        payload = {"image_contains_fish": True}
+        if with_caption:
+            payload["caption"] = ranked[0].get("physical_description", "")
+        payload["rejection_reason"] = None
+        payload["results"] = [
+            {"fish_name": doc["fish_name"], "score": score,
+             "score_reason": f"Body shape and colouration match: {(doc.get('physical_description') or '')[:80]}"}
+            for doc, score in zip(ranked, scores)
+        ]
+        return payload
+
+    def details(self, image_key: str) -> Dict[str, Any]:
+        doc = self._ranked_docs(image_key, 1)[0]
+        return {
+            "image_contains_fish": True,
+            "fish_details": {
+                "fish_name": doc["fish_name"],
+                "scientific_name": doc.get("scientific_name", ""),
+                "order_name": doc.get("order_name", ""),
+                "physical_description": doc.get("physical_description", ""),
+                "habitat": doc.get("habitat", ""),
+            },
+        }
+
+    def respond(self, system_prompt: str, image_key: str) -> str:
+        self.latency.wait()
+        system_prompt = system_prompt or ""
+        if "fish_details" in system_prompt:
+            payload = self.details(image_key)
+        else:
+            payload = self.candidates(image_key, with_caption='"caption"' in system_prompt)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def caption_for(doc: Dict[str, Any]) -> str:
+    """Markdown caption in the shape get_fish_description_from_watsonxai returns."""
+    parts = [p.strip() for p in (doc.get("physical_description") or "").split(";") if p.strip()]
+    bullets = "\n".join(f"* **{p.split(':')[0].strip().title()}:** {p.split(':', 1)[-1].strip()}" for p in parts)
+    return f"## Image Description\n\nThe image depicts a fish swimming near coral reefs.\n\n### Key Features:\n\n{bullets}"
+
+
+def _image_key_from_messages(messages) -> str:
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "image_url":
+                    url = part["image_url"]["url"]
+                    return url[-4096:]  # the tail of the base64 data is distinctive enough
+    return ""
+
+
+def _message_text(messages) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(p.get("text", "") for p in content if p.get("type") == "text")
+    return "\n".join(parts)
+
+
+class FakeGroqClient:
+    """
+    Implements groq.Groq().chat.completions.create for the calls the BE makes.
+    Mimics automatic prefix caching: a system prompt seen before is reported as
+    cached prompt tokens.
+    """
+
+    def __init__(self, vision: FakeVisionModel):
+        self.vision = vision
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self._seen_prefixes = set()
+        self._lock = threading.Lock()
+
+    def _usage(self, system_prompt: str, prompt_text: str, completion: str):
+        with self._lock:
+            cached = system_prompt in self._seen_prefixes
+            self._seen_prefixes.add(system_prompt)
+        prompt_tokens = len(prompt_text) // 4
+        cached_tokens = len(system_prompt) // 4 if cached else 0
+        return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(completion) // 4,
+                               total_tokens=prompt_tokens + len(completion) // 4,
+                               prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens))
+
+    def _create(self, messages, model=None, stream=False, **kwargs):
+        system_prompt = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        prompt_text = _message_text(messages)
+        content = self.vision.respond(prompt_text, _image_key_from_messages(messages))
+        usage = self._usage(system_prompt, prompt_text, content)
+        if stream:
+            return _fake_stream(content, usage)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")],
+            usage=usage,
+        )
+
+
+def _fake_stream(content: str, usage=None, chunk_chars: int = 24):
+    for start in range(0, len(content), chunk_chars):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[start:start + chunk_chars]),
+                                                       finish_reason=None)], usage=None)
+    # Like Groq, the last chunk carries the usage and finish_reason
+    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=""), finish_reason="stop")],
+                          usage=usage, x_groq=SimpleNamespace(usage=usage))
+
+
+class FakeGeminiClient:
+    """
+    Implements genai.Client().models.generate_content / generate_content_stream
+    and caches.create (explicit context caching, reported as cached tokens).
+    """
+
+    def __init__(self, vision: FakeVisionModel):
+        self.vision = vision
+        self.models = SimpleNamespace(generate_content=self._generate, generate_content_stream=self._generate_stream)
+        self.caches = SimpleNamespace(create=self._create_cache)
+        self._cached_contents: Dict[str, str] = {}
+
+    def _create_cache(self, model=None, config=None):
+        name = f"cachedContents/fake-{len(self._cached_contents) + 1}"
+        self._cached_contents[name] = str(getattr(config, "system_instruction", "") or "")
+        return SimpleNamespace(name=name, model=model)
+
+    def _image_key(self, contents):
+        for part in contents or []:
+            data = getattr(getattr(part, "inline_data", None), "data", None)
+            if data:
+                return hashlib.sha256(data).hexdigest()
+        return ""
+
+    def _generate(self, model=None, contents=None, config=None):
+        cache_name = getattr(config, "cached_content", None)
+        if cache_name and cache_name not in self._cached_contents:
+            raise FakeProviderError(f"cached content {cache_name} not found")
+        cached_prompt = self._cached_contents.get(cache_name, "") if cache_name else ""
+        system_prompt = cached_prompt or str(getattr(config, "system_instruction", "") or "")
+        texts = " ".join(part for part in contents or [] if isinstance(part, str))
+        # The details prompt only names fish_details in its response schema
+        prompt_and_schema = f"{system_prompt} {texts} {getattr(config, 'response_schema', '')}"
+        text = self.vision.respond(prompt_and_schema, self._image_key(contents))
+        return SimpleNamespace(text=text, usage_metadata=SimpleNamespace(
+            prompt_token_count=(len(system_prompt) + len(texts)) // 4, candidates_token_count=len(text) // 4,
+            cached_content_token_count=len(cached_prompt) // 4))
+
+    def _generate_stream(self, model=None, contents=None, config=None):
+        response = self._generate(model, contents, config)
+        for chunk in _fake_stream(response.text):
+            if chunk.choices[0].delta.content:
+                yield SimpleNamespace(text=chunk.choices[0].delta.content, usage_metadata=response.usage_metadata)
+
+
+class FakeChatModel:
+    """Implements ibm_watsonx_ai ModelInference.chat for /generation."""
+
+    def __init__(self, latency: Optional[LatencyModel] = None):
+        self.latency = latency or LatencyModel("watsonx")
+
+    def chat(self, messages, **kwargs):
+        self.latency.wait()
+        question = messages[-1]["content"] if messages else ""
+        answer = f"**Fake answer** to a prompt of {len(str(messages))} characters: {str(question)[:120]}"
+        return {"choices": [{"message": {"role": "assistant", "content": answer}}],
+                "usage": {"prompt_tokens": len(str(messages)) // 4, "completion_tokens": len(answer) // 4}}
+
+
+# ----------------------------------------------------------------------- wiring
+
+class FakeBackends:
+    """All fakes wired together, sharing one species catalogue."""
+
+    def __init__(self):
+        self.docs = load_species()
+        self.embedding = HashEmbeddingService()
+        self.es = InMemoryElasticsearchQuery(HashEmbeddingService(latency=LatencyModel("embedding", "fixed:0")), self.docs)
+        self.cos = FakeCOSClient()
+        self.groq = FakeGroqClient(FakeVisionModel("groq", self.docs))
+        self.gemini = FakeGeminiClient(FakeVisionModel("gemini", self.docs))
+        self.chat_model = FakeChatModel()
+        self._caption_vision = FakeVisionModel("watsonx", self.docs)
+
+    def caption(self, pic_string: str) -> str:
+        """Stand-in for watsonx_captioning.get_fish_description_from_watsonxai."""
+        self._caption_vision.latency.wait()
+        canned = self._caption_vision.canned.get("caption")
+        return canned or caption_for(self._caption_vision._ranked_docs(pic_string[-4096:], 1)[0])
+
+    def watsonx_token(self, api_key=None, iam_url=None) -> str:
+        return "fake-token"
+
+
+_backends = None
+_backends_lock = threading.Lock()
+
+
+def fake_backends_enabled() -> bool:
+    return os.getenv("FISH_FAKE_BACKENDS", "0") == "1"
+
+
+def get_fake_backends() -> FakeBackends:
+    global _backends
+    with _backends_lock:
+        if _backends is None:
+            _backends = FakeBackends()
+            print(f"⚠️ Using fake backends ({len(_backends.docs)} species, COS dir {_backends.cos.root})")
+        return _backends
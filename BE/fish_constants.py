@@ -93,4 +93,17 @@ Schema:
         }}
     ]
 }}
-"""
\ No newline at end of file
+"""
+
+# --- Caption instructions for /caption_and_identify ---
+# Sent in the user turn after the unchanged SYSTEM_CONTENT_SINGLE prefix, so both
+# identification variants share the provider's prompt cache, and one vision call
+# also yields a description that can be embedded for the kNN.
+CAPTION_INSTRUCTIONS = """
+Additional output field:
+Add a "caption" string to the JSON, placed directly after "image_contains_fish" and before "results".
+The caption is one paragraph describing ONLY the visible physical features of the fish in the image
+(body shape; coloration and pattern; fins and tail; distinctive marks), written in the same style as
+the BASE PHYSICAL DESCRIPTIONS and WITHOUT naming any species.
+If image_contains_fish is false, "caption" must be null.
+"""
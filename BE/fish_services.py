@@ -1,14 +1,237 @@
 # fish_service.py
 import base64
+import functools
 import json
+import os
 import re
+import threading
+import time
 from groq import Groq
 import requests
 import http.client
-from typing import Dict, Any, Optional
-from fish_constants import SYSTEM_CONTENT_SINGLE, MODEL_ID
+from typing import Dict, Any, Iterator, Optional, Tuple, Union
+from fish_constants import SYSTEM_CONTENT_SINGLE, CAPTION_INSTRUCTIONS, MODEL_ID
 from google import genai
 from google.genai import types
+from google.genai.errors import APIError
+from provider_usage import record_gemini_usage, record_groq_usage, record_usage
+from streaming_json import IncrementalJSONParser
+
+GEMINI_MODEL = "gemini-2.5-flash"
+GROQ_MODEL_ID = "meta-llama/llama-4-maverick-17b-128e-instruct"
+
+# Explicit Gemini context caching of the species prompt (GEMINI_CONTEXT_CACHE=0 sends it inline)
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+GEMINI_CACHE_TTL_S = int(os.getenv("GEMINI_CACHE_TTL_S", "3600"))
+
+# ---------------------------------------------------------
+# Static prompt layout (built once at import)
+# ---------------------------------------------------------
+# Every provider gets the species prompt as a byte-identical prefix (system
+# message or cached context). The request-specific parts, instruction text
+# then image, always come after it so provider prefix caches hit on every call.
+
+# Important: For JSON mode to work, the word "JSON" must appear in the system prompt
+GROQ_SYSTEM_CONTENT = "You are a fish identification expert. Output strictly in JSON format. " + SYSTEM_CONTENT_SINGLE
+IDENTIFY_TEXT = "Identify the fish. Return JSON with Top 5 candidates."
+CAPTION_IDENTIFY_TEXT = ("Describe and identify the fish. Return JSON with the caption and Top 5 candidates.\n"
+                         + CAPTION_INSTRUCTIONS)
+GEMINI_IDENTIFY_TEXT = 'Analyze the image. Return JSON according to the schema.'
+
+
+def _candidates_schema(with_caption: bool) -> types.Schema:
+    # Schema สำหรับปลาแต่ละตัวใน list 'results'
+    candidate_schema = types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "fish_name": types.Schema(
+                type=types.Type.STRING, 
+                description="Must be exactly one from the allowed species list."
+            ),
+            "score": types.Schema(
+                type=types.Type.NUMBER, 
+                description="Confidence score between 0.0 and 1.0"
+            ),
+            "score_reason": types.Schema(
+                type=types.Type.STRING, 
+                description="Brief explanation of visual features matching the description."
+            )
+        },
+        required=["fish_name", "score", "score_reason"]
+    )
+
+    # Schema หลักของ JSON Response
+    properties = {
+        "image_contains_fish": types.Schema(
+            type=types.Type.BOOLEAN, 
+            description="True only if valid, raw/fresh fish is detected."
+        ),
+        "rejection_reason": types.Schema(
+            type=types.Type.STRING, 
+            description="Reason if image_contains_fish is false, otherwise null.",
+            nullable=True # อนุญาตให้เป็น null ได้
+        ),
+        "results": types.Schema(
+            type=types.Type.ARRAY,
+            items=candidate_schema,
+            description="List of top 5 candidates. Empty if image_contains_fish is false."
+        )
+    }
+    ordering = ["image_contains_fish", "rejection_reason", "results"]
+    if with_caption:
+        properties["caption"] = types.Schema(
+            type=types.Type.STRING,
+            description="Physical description of the visible fish, without naming the species. Null if no fish.",
+            nullable=True
+        )
+        ordering = ["image_contains_fish", "caption", "rejection_reason", "results"]
+    return types.Schema(
+        type=types.Type.OBJECT,
+        properties=properties,
+        property_ordering=ordering,
+        required=["image_contains_fish", "results"] # rejection_reason is optional in JSON if null
+    )
+
+
+CANDIDATES_SCHEMA = _candidates_schema(with_caption=False)
+CAPTION_CANDIDATES_SCHEMA = _candidates_schema(with_caption=True)
+_SCHEMAS = {"candidates": CANDIDATES_SCHEMA, "caption_candidates": CAPTION_CANDIDATES_SCHEMA, None: None}
+
+
+class GeminiContextCache:
+    """
+    Explicit Gemini context cache holding a static system instruction. Created on
+    first use and recreated shortly before its TTL runs out; requests refer to it
+    by name instead of resending the prompt.
+    """
+
+    def __init__(self, system_instruction: str, model: str = GEMINI_MODEL, ttl_s: int = GEMINI_CACHE_TTL_S,
+                 display_name: str = "fish-species-prompt"):
+        self.system_instruction = system_instruction
+        self.model = model
+        self.ttl_s = ttl_s
+        self.display_name = display_name
+        self._name = None
+        self._client_id = None
+        self._expires_at = 0.0
+        self._retry_after = 0.0
+        self._lock = threading.Lock()
+
+    def handle(self, client) -> Optional[str]:
+        """Cache name to pass as cached_content, or None to send the prompt inline."""
+        if not GEMINI_CONTEXT_CACHE:
+            return None
+        with self._lock:
+            now = time.time()
+            if self._name and self._client_id == id(client) and now < self._expires_at - 60:
+                return self._name
+            if now < self._retry_after:
+                return None
+            try:
+                cache = client.caches.create(
+                    model=self.model,
+                    config=types.CreateCachedContentConfig(
+                        display_name=self.display_name,
+                        system_instruction=self.system_instruction,
+                        ttl=f"{self.ttl_s}s",
+                    ),
+                )
+            except Exception as e:
+                # e.g. prompt below the model's minimum cacheable size, or caching not enabled for the key
+                print(f"Gemini context cache unavailable, sending the prompt inline: {e}")
+                self._name, self._retry_after = None, now + 300
+                return None
+            self._name, self._client_id, self._expires_at = cache.name, id(client), now + self.ttl_s
+            print(f"Gemini context cache created: {cache.name} (ttl {self.ttl_s}s)")
+            return self._name
+
+    def invalidate(self):
+        with self._lock:
+            self._name = None
+
+
+SPECIES_PROMPT_CACHE = GeminiContextCache(SYSTEM_CONTENT_SINGLE)
+
+
+@functools.lru_cache(maxsize=32)
+def gemini_species_config(cache_name: Optional[str], schema_name: Optional[str], temperature: float,
+                          max_output_tokens: int) -> types.GenerateContentConfig:
+    """Generation config for the species prompt, by cache handle (or inline prompt when None)."""
+    config = dict(
+        response_mime_type="application/json",
+        temperature=temperature,
+        max_output_tokens=max_output_tokens,
+    )
+    if _SCHEMAS[schema_name] is not None:
+        config["response_schema"] = _SCHEMAS[schema_name]
+    if cache_name:
+        config["cached_content"] = cache_name
+    else:
+        config["system_instruction"] = SYSTEM_CONTENT_SINGLE
+    return types.GenerateContentConfig(**config)
+
+
+def _primed_stream(first, iterator):
+    """Re-yields an already started stream; closing it closes the underlying stream."""
+    try:
+        if first is not None:
+            yield first
+        yield from iterator
+    finally:
+        close = getattr(iterator, "close", None)
+        if close:
+            close()
+
+
+def is_cached_content_error(error: Exception) -> bool:
+    """True when Gemini rejected the cached_content handle (expired, deleted or not ours), not the request."""
+    if not isinstance(error, APIError):
+        return False
+    message = f"{getattr(error, 'message', '') or ''} {error}".lower()
+    return error.code in (403, 404) or "cachedcontent" in message or "cached content" in message
+
+
+def generate_with_species_prompt(client: genai.Client, contents, schema_name: Optional[str] = None,
+                                 temperature: float = 0.1, max_output_tokens: int = 4096, stream: bool = False):
+    """
+    generate_content with the species prompt taken from the context cache when
+    available. A rejected cache handle (expired or deleted server side) is dropped
+    and the request is retried once with the prompt inline. Other errors (rate
+    limits, timeouts, bad images) are raised as they are, so a throttled
+    provider does not get a second full request.
+    """
+    generate = client.models.generate_content_stream if stream else client.models.generate_content
+
+    def call(cache_name):
+        response = generate(model=GEMINI_MODEL, contents=contents,
+                            config=gemini_species_config(cache_name, schema_name, temperature, max_output_tokens))
+        if stream:
+            # The streaming request is only sent on the first next(), so start it here
+            # for a rejected cache handle to surface (and be retried) in this function
+            response = iter(response)
+            return _primed_stream(next(response, None), response)
+        return response
+
+    cache_name = SPECIES_PROMPT_CACHE.handle(client)
+    start = time.perf_counter()
+    try:
+        response = call(cache_name)
+    except Exception as e:
+        if cache_name is None or not is_cached_content_error(e):
+            raise
+        print(f"Gemini cached content {cache_name} failed ({e}), retrying with the inline prompt")
+        SPECIES_PROMPT_CACHE.invalidate()
+        start = time.perf_counter()
+        response = call(None)
+    if not stream:
+        record_gemini_usage(response, time.perf_counter() - start)
+    return response
+
+def image_bytes_of(pic: Union[str, bytes]) -> bytes:
+    """Gemini takes raw bytes; accept those as is (image_loader "bytes") or decode a base64 string."""
+    if isinstance(pic, (bytes, bytearray)):
+        return pic
+    return base64.b64decode(pic)
 
 def get_watsonx_token(api_key: str, iam_url: str) -> Optional[str]:
     try:
@@ -45,7 +268,7 @@ def identify_fish_candidates(pic_string: str, access_token: str, project_id: str
             {
                 "role": "user", 
                 "content": [
-                    {"type": "text", "text": "Identify the fish. Return JSON with Top 5 candidates."},
+                    {"type": "text", "text": IDENTIFY_TEXT},
                     {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{pic_string}"}}
                 ]
             }
@@ -65,9 +288,13 @@ def identify_fish_candidates(pic_string: str, access_token: str, project_id: str
     }
     
     try:
+        start = time.perf_counter()
         response = requests.post(chat_url, headers=headers, json=body, timeout=60)
         response.raise_for_status() 
         data = response.json()
+        usage = data.get('usage') or {}
+        record_usage("watsonx", usage.get('prompt_tokens'), 0, usage.get('completion_tokens'),
+                     time.perf_counter() - start)
         
         if 'choices' in data and len(data['choices']) > 0:
             ai_response = data['choices'][0]['message']['content']
@@ -83,34 +310,27 @@ def identify_fish_candidates(pic_string: str, access_token: str, project_id: str
         print(f"AI Request Error: {e}")
         return None
 
-def identify_fish_candidates_gemini(client: genai.Client, pic_string: str) -> Optional[Dict[str, Any]]:
+def identify_fish_candidates_gemini(client: genai.Client, pic_string: Union[str, bytes]) -> Optional[Dict[str, Any]]:
     try:
-        # Decode base64 เป็น bytes
+        # Decode base64 เป็น bytes (raw bytes are used as is)
         try:
-            image_bytes = base64.b64decode(pic_string)
+            image_bytes = image_bytes_of(pic_string)
         except Exception as e:
             print(f"Error decoding base64: {e}")
             return None
 
-        # Config Gemini
-        config = types.GenerateContentConfig(
-            response_mime_type="application/json",
-            temperature=0.1,
-            system_instruction=SYSTEM_CONTENT_SINGLE, # ใช้ Prompt ตัวเดียวกัน
-            max_output_tokens=4096
-        )
-
-        # Call API
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
+        # Call API (species prompt from the context cache, ใช้ Prompt ตัวเดียวกัน)
+        response = generate_with_species_prompt(
+            client,
             contents=[
+                'Identify the fish in this image',
                 types.Part.from_bytes(
                   data=image_bytes,
                   mime_type="image/jpeg"
                 ),
-                'Identify the fish in this image'
             ],
-            config=config
+            temperature=0.1,
+            max_output_tokens=4096
         )
         
         if response.text:
@@ -121,91 +341,41 @@ def identify_fish_candidates_gemini(client: genai.Client, pic_string: str) -> Op
         print(f"Gemini Error: {e}")
         return None
 
-def identify_fish_candidates_gemini2(client: genai.Client, pic_string: str) -> Optional[Dict[str, Any]]:
+def identify_fish_candidates_gemini2(client: genai.Client, pic_string: Union[str, bytes], with_caption: bool = False) -> Optional[Dict[str, Any]]:
     """
-    Analyzes a base64 encoded image to identify fish species using Gemini.
+    Analyzes a base64 encoded image (or its raw bytes) to identify fish species using Gemini.
     Enforces strict JSON output via Schema.
+    with_caption=True also asks for a physical-description "caption" in the same call.
     """
     
-    # ---------------------------------------------------------
-    # 1. Define Schemas (Strict Output Control)
-    # ---------------------------------------------------------
-    
-    # Schema สำหรับปลาแต่ละตัวใน list 'results'
-    candidate_schema = types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "fish_name": types.Schema(
-                type=types.Type.STRING, 
-                description="Must be exactly one from the allowed species list."
-            ),
-            "score": types.Schema(
-                type=types.Type.NUMBER, 
-                description="Confidence score between 0.0 and 1.0"
-            ),
-            "score_reason": types.Schema(
-                type=types.Type.STRING, 
-                description="Brief explanation of visual features matching the description."
-            )
-        },
-        required=["fish_name", "score", "score_reason"]
-    )
-
-    # Schema หลักของ JSON Response
-    main_schema = types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "image_contains_fish": types.Schema(
-                type=types.Type.BOOLEAN, 
-                description="True only if valid, raw/fresh fish is detected."
-            ),
-            "rejection_reason": types.Schema(
-                type=types.Type.STRING, 
-                description="Reason if image_contains_fish is false, otherwise null.",
-                nullable=True # อนุญาตให้เป็น null ได้
-            ),
-            "results": types.Schema(
-                type=types.Type.ARRAY,
-                items=candidate_schema,
-                description="List of top 5 candidates. Empty if image_contains_fish is false."
-            )
-        },
-        required=["image_contains_fish", "results"] # rejection_reason is optional in JSON if null
-    )
+    # Schemas (Strict Output Control) are built once at import: CANDIDATES_SCHEMA / CAPTION_CANDIDATES_SCHEMA
 
     # ---------------------------------------------------------
     # 2. Logic & Execution
     # ---------------------------------------------------------
     try:
-        # Decode Image
+        # Decode Image (raw bytes skip the base64 round trip)
         try:
-            image_bytes = base64.b64decode(pic_string)
+            image_bytes = image_bytes_of(pic_string)
         except Exception as e:
             print(f"Error decoding base64: {e}")
             return None
 
-        # Config Gemini
-        # หมายเหตุ: SYSTEM_CONTENT_SINGLE ต้องเป็น f-string ที่ render ค่าตัวแปรมาครบแล้ว
-        config = types.GenerateContentConfig(
-            response_mime_type="application/json",
-            response_schema=main_schema, # 👈 หัวใจสำคัญ: บังคับโครงสร้าง
-            temperature=0.1,             # ต่ำเพื่อให้ AI แม่นยำเรื่องชื่อและข้อมูล
-            system_instruction=SYSTEM_CONTENT_SINGLE, 
-            max_output_tokens=4096
-        )
-
         # Call API
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
+        # The species prompt is the cached/system prefix, the caption instructions go in the user turn
+        response = generate_with_species_prompt(
+            client,
             contents=[
+                # ย้ำ Prompt สั้นๆ อีกครั้งเพื่อให้ AI เริ่มทำงาน
+                CAPTION_IDENTIFY_TEXT if with_caption else GEMINI_IDENTIFY_TEXT,
                 types.Part.from_bytes(
                     data=image_bytes,
                     mime_type="image/webp"
                 ),
-                # ย้ำ Prompt สั้นๆ อีกครั้งเพื่อให้ AI เริ่มทำงาน
-                'Analyze the image. Return JSON according to the schema.'
             ],
-            config=config
+            schema_name="caption_candidates" if with_caption else "candidates",
+            temperature=0.1,             # ต่ำเพื่อให้ AI แม่นยำเรื่องชื่อและข้อมูล
+            max_output_tokens=4096
         )
         
         # Parse Response
@@ -233,41 +403,45 @@ def identify_fish_candidates_gemini2(client: genai.Client, pic_string: str) -> O
         print(f"Gemini Error: {e}")
         return None
 
-def identify_fish_candidates_groq(client: Groq, pic_string: str) -> Optional[Dict[str, Any]]:
+def groq_identify_messages(pic_string: str, with_caption: bool = False):
+    return [
+        {
+            "role": "system",
+            # Static prefix, identical for every request (see GROQ_SYSTEM_CONTENT)
+            "content": GROQ_SYSTEM_CONTENT
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text", 
+                    "text": CAPTION_IDENTIFY_TEXT if with_caption else IDENTIFY_TEXT
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        # Groq accepts data URLs for base64 images
+                        "url": f"data:image/jpeg;base64,{pic_string}"
+                    },
+                },
+            ],
+        },
+    ]
+
+def identify_fish_candidates_groq(client: Groq, pic_string: str, with_caption: bool = False) -> Optional[Dict[str, Any]]:
     """
     Identifies fish from a base64 string using Groq's Llama 4. maverick Vision model.
+    with_caption=True also asks for a physical-description "caption" in the same call.
     """
     try:
         # Define the model. Groq supports Llama 3.2 Vision models.
         # Options: "llama-3.2-11b-vision-preview" or "llama-3.2-90b-vision-preview"
         # model_id = "llama-3.2-11b-vision-preview"
-        groq_model_id = "meta-llama/llama-4-maverick-17b-128e-instruct"
+        groq_model_id = GROQ_MODEL_ID
+        start = time.perf_counter()
 
         chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    # Important: For JSON mode to work, the word "JSON" must appear in the system prompt
-                    "content": "You are a fish identification expert. Output strictly in JSON format. " 
-                               + SYSTEM_CONTENT_SINGLE  # Replace with your actual variable
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text", 
-                            "text": "Identify the fish. Return JSON with Top 5 candidates."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                # Groq accepts data URLs for base64 images
-                                "url": f"data:image/jpeg;base64,{pic_string}"
-                            },
-                        },
-                    ],
-                },
-            ],
+            messages=groq_identify_messages(pic_string, with_caption),
             model=groq_model_id,
             temperature=0,
             max_tokens=4096,
@@ -277,6 +451,8 @@ def identify_fish_candidates_groq(client: Groq, pic_string: str) -> Optional[Dic
             response_format={"type": "json_object"}, 
         )
 
+        record_groq_usage(chat_completion, time.perf_counter() - start)
+
         # Extract content
         ai_response = chat_completion.choices[0].message.content
         
@@ -285,4 +461,122 @@ def identify_fish_candidates_groq(client: Groq, pic_string: str) -> Optional[Dic
 
     except Exception as e:
         print(f"Groq API Request Error: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+# ---------------------------------------------------------
+# Streaming identification (early exit on rejection)
+# ---------------------------------------------------------
+
+def _groq_text_stream(client: Groq, pic_string: str, with_caption: bool) -> Iterator[str]:
+    # Groq does not stream in JSON mode (response_format), so this relies on the
+    # JSON-only system prompt; the parser skips any fences around the object.
+    start = time.perf_counter()
+    stream = client.chat.completions.create(
+        messages=groq_identify_messages(pic_string, with_caption),
+        model=GROQ_MODEL_ID,
+        temperature=0,
+        max_tokens=4096,
+        top_p=1,
+        stream=True,
+    )
+    usage_chunk = None
+    try:
+        for chunk in stream:
+            # The last chunk carries the usage (in x_groq for Groq, in usage for OpenAI-style APIs)
+            usage_chunk = getattr(chunk, "x_groq", None) or (chunk if getattr(chunk, "usage", None) else usage_chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+        record_groq_usage(usage_chunk, time.perf_counter() - start, provider="groq_stream")
+
+
+def _gemini_text_stream(client: genai.Client, pic_string: Union[str, bytes], with_caption: bool) -> Iterator[str]:
+    start = time.perf_counter()
+    stream = generate_with_species_prompt(
+        client,
+        contents=[
+            CAPTION_IDENTIFY_TEXT if with_caption else GEMINI_IDENTIFY_TEXT,
+            types.Part.from_bytes(data=image_bytes_of(pic_string), mime_type="image/webp"),
+        ],
+        schema_name="caption_candidates" if with_caption else "candidates",
+        temperature=0.1,
+        max_output_tokens=4096,
+        stream=True,
+    )
+    last_chunk = None
+    try:
+        for chunk in stream:
+            last_chunk = chunk
+            if chunk.text:
+                yield chunk.text
+    finally:
+        stream.close()
+        record_gemini_usage(last_chunk, time.perf_counter() - start, provider="gemini_stream")
+
+
+_TEXT_STREAMS = {"groq": _groq_text_stream, "gemini": _gemini_text_stream}
+STREAM_PROVIDERS = tuple(_TEXT_STREAMS)
+
+
+def _rejection(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """The "rejected" payload, the same whether generation was cancelled or the object completed."""
+    return {"image_contains_fish": False, "rejection_reason": fields.get("rejection_reason"), "results": []}
+
+
+def stream_fish_candidates(provider: str, client, pic_string: str,
+                           with_caption: bool = False) -> Iterator[Tuple[str, Any]]:
+    """
+    Streaming identification with "groq" or "gemini". Yields (event, data) as the
+    JSON is generated:
+      ("caption", str)        with_caption only, once the caption is complete
+      ("candidate", dict)     each entry of "results" as soon as it is complete
+      ("result", dict)        the full JSON, same shape as identify_fish_candidates_*
+      ("rejected", dict)      image_contains_fish is false: {image_contains_fish,
+                              rejection_reason, results: []}; generation is cancelled
+                              once the rejection_reason (if it comes next) is read
+      ("error", str)
+    Closing the generator early (e.g. client disconnect) also cancels generation.
+    """
+    parser = IncrementalJSONParser()
+    text_stream = _TEXT_STREAMS[provider](client, pic_string, with_caption)
+    rejected = False
+    try:
+        for text in text_stream:
+            for event in parser.feed(text):
+                kind, key = event[0], event[1]
+                if kind == "done":
+                    yield ("rejected", _rejection(event[1])) if rejected else ("result", event[1])
+                    return
+                if kind == "field" and key == "image_contains_fish" and event[2] is False:
+                    rejected = True
+                elif kind == "field" and key == "caption" and event[2] and not rejected:
+                    yield ("caption", event[2])
+                elif kind == "item" and key == "results" and not rejected:
+                    yield ("candidate", event[3])
+                if rejected and ("rejection_reason" in parser.fields
+                                 or (kind == "key" and key != "rejection_reason")):
+                    yield ("rejected", _rejection(parser.fields))
+                    return
+        parser.close()
+        print(f"{provider} stream ended before the JSON object was complete: {parser.buffer[-200:]!r}")
+        yield ("error", "incomplete JSON from model")
+    except Exception as e:
+        print(f"{provider} streaming error: {e}")
+        yield ("error", str(e))
+    finally:
+        text_stream.close()
+
+
+def identify_fish_candidates_streaming(provider: str, client, pic_string: str,
+                                       with_caption: bool = False) -> Optional[Dict[str, Any]]:
+    """Same result as the blocking identify functions, but returns early on a rejection."""
+    for event, data in stream_fish_candidates(provider, client, pic_string, with_caption):
+        if event in ("result", "rejected"):
+            return data
+        if event == "error":
+            return None
+    return None
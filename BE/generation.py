@@ -25,26 +25,102 @@ parameters = {
 project_id = os.getenv("PROJECT_ID")
 space_id = os.getenv("SPACE_ID")
 
-model = ModelInference(
-    model_id=model_id,
-    params=parameters,
-    credentials=credentials,
-    project_id=project_id,
-    space_id=space_id
-)
-# --- End Initialization ---
-
 from embedding_service import EmbeddingService
 from elasticsearch_query import ElasticsearchQuery
-from function import return_top_n_fish
+from fish_results import return_top_n_fish
+from fake_providers import fake_backends_enabled, get_fake_backends
+from chat_history import CHAT_HISTORY_MANAGER, CHAT_SUMMARY_MAX_TOKENS, ChatHistoryManager, legacy_messages, summary_messages
+from retrieval_router import CLASSIFIER_PROMPT, RETRIEVAL_ROUTER, RETRIEVAL_ROUTER_MODEL, RetrievalRouter
+from species_catalogue import get_catalogue
 
-# Initialize embedding and elasticsearch services
-es_endpoint = os.environ["es_endpoint"]
-es_username = os.environ["es_username"]
-es_password = os.environ["es_password"]
 index_name = 'fish_index_v4'
-esq = ElasticsearchQuery(es_endpoint, es_username, es_password)
-emb = EmbeddingService('watsonx')
+if fake_backends_enabled():
+    # Local stand-ins for load testing, see fake_providers.py
+    fakes = get_fake_backends()
+    model = fakes.chat_model
+    router_model = fakes.chat_model if RETRIEVAL_ROUTER_MODEL else None
+    esq = fakes.es
+    emb = fakes.embedding
+else:
+    model = ModelInference(
+        model_id=model_id,
+        params=parameters,
+        credentials=credentials,
+        project_id=project_id,
+        space_id=space_id
+    )
+    # Optional small model for the follow-up questions the router's heuristics cannot place
+    router_model = ModelInference(
+        model_id=RETRIEVAL_ROUTER_MODEL,
+        params={"max_tokens": 3, "temperature": 0},
+        credentials=credentials,
+        project_id=project_id,
+        space_id=space_id
+    ) if RETRIEVAL_ROUTER_MODEL else None
+
+    # Initialize embedding and elasticsearch services
+    es_endpoint = os.environ["es_endpoint"]
+    es_username = os.environ["es_username"]
+    es_password = os.environ["es_password"]
+    esq = ElasticsearchQuery(es_endpoint, es_username, es_password)
+    emb = EmbeddingService('watsonx')
+# --- End Initialization ---
+
+def summarize_history(previous_summary, messages):
+    """Folds older chat messages into the rolling summary (runs on the chat_history background thread)."""
+    response = model.chat(messages=summary_messages(previous_summary, messages),
+                          params={"max_tokens": CHAT_SUMMARY_MAX_TOKENS})
+    return response["choices"][0]["message"]["content"]
+
+# Older turns are summarized in the background and the prompt kept under CHAT_PROMPT_TOKEN_BUDGET (chat_history.py)
+history_manager = ChatHistoryManager(summarize_history) if CHAT_HISTORY_MANAGER else None
+
+def classify_question(question, recent_messages):
+    transcript = "\n".join(f"{m['role']}: {m['content'][:300]}" for m in recent_messages)
+    response = router_model.chat(messages=[
+        {"role": "system", "content": CLASSIFIER_PROMPT},
+        {"role": "user", "content": f"{transcript}\nuser: {question}"},
+    ])
+    return response["choices"][0]["message"]["content"]
+
+# Follow-ups reuse the previous references or a rewritten query instead of embedding the raw question
+retrieval_router = RetrievalRouter(lambda: get_catalogue(esq, index_name),
+                                   classify_question if router_model else None) if RETRIEVAL_ROUTER else None
+
+def retrieve_references(query):
+    """Top 5 fish for `query` from the physical and general description kNN searches."""
+    caption_embedding = emb.embed_text(query)
+    physical_hits = esq.search_embedding(index_name=index_name, embedding_field='physical_description_embedding', query_vector=caption_embedding, size=5)
+    general_hits = esq.search_embedding(index_name=index_name, embedding_field='general_description_embedding', query_vector=caption_embedding, size=5)
+    top_n_fish_physical = return_top_n_fish(physical_hits, n=5)
+    top_n_fish_general = return_top_n_fish(general_hits, n=5)
+    return top_n_fish_physical, top_n_fish_general
+
+def route_references(question, chat_history):
+    """(physical, general) reference fish for the question, retrieved only when the router asks for it."""
+    if retrieval_router is None:
+        return retrieve_references(question)
+    decision = retrieval_router.route(question, chat_history)
+    if decision.action in ("retrieve", "rewrite"):
+        references = retrieve_references(decision.query)
+    else:
+        references = decision.references
+    retrieval_router.remember(chat_history, question, references)
+    return references or ([], [])
+
+def build_chat_messages(system_prompt, user_prompt, chat_history):
+    if history_manager is None:
+        return legacy_messages(system_prompt, user_prompt, chat_history), None
+    messages, info = history_manager.build_messages(system_prompt, user_prompt, chat_history)
+    print(f"Chat prompt ~{info['prompt_tokens_estimate']} tokens (last 10 messages would be "
+          f"~{info['legacy_prompt_tokens_estimate']}), {info['summarized_messages']} messages summarized, "
+          f"{info['dropped_messages']} dropped")
+    return messages, info
+
+def after_chat_response(chat_history, info, response):
+    if history_manager is not None and info is not None:
+        history_manager.record_model_usage(info, response)
+        history_manager.after_response(chat_history)
 
 def get_generated_response(question: str, chat_history: list = None):
     """
@@ -54,12 +130,8 @@ def get_generated_response(question: str, chat_history: list = None):
     if chat_history is None:
         chat_history = []
 
-    # Always generate reference using embedding search (use online embedding service)
-    caption_embedding = emb.embed_text(question)
-    physical_hits = esq.search_embedding(index_name=index_name, embedding_field='physical_description_embedding', query_vector=caption_embedding, size=5)
-    general_hits = esq.search_embedding(index_name=index_name, embedding_field='general_description_embedding', query_vector=caption_embedding, size=5)
-    top_n_fish_physical = return_top_n_fish(physical_hits, n=5)
-    top_n_fish_general = return_top_n_fish(physical_hits, n=5)
+    # Reference fish from embedding search; follow-ups reuse the previous turn's (retrieval_router.py)
+    top_n_fish_physical, top_n_fish_general = route_references(question, chat_history)
     physical_reference = "\n".join([
         f"Fish Name: {fish.get('fish_name', 'Unknown')}\n"
         f"Thai Name: {fish.get('thai_fish_name', '')}\n"
@@ -115,16 +187,13 @@ def get_generated_response(question: str, chat_history: list = None):
     )
 
     # Build chat messages with history
-    chat_messages = [{"role": "system", "content": system_prompt}]
-    if chat_history:
-        recent_history = chat_history[-10:] if len(chat_history) > 10 else chat_history
-        chat_messages.extend(recent_history)
-    chat_messages.append({"role": "user", "content": user_prompt})
+    chat_messages, history_info = build_chat_messages(system_prompt, user_prompt, chat_history)
 
     response = model.chat(messages=chat_messages)
     print("Raw model response:", response)
 
     if response and "choices" in response and len(response["choices"]) > 0:
+        after_chat_response(chat_history, history_info, response)
         return response["choices"][0]["message"].get("content", "Error: Could not extract generated text.")
     else:
         return "Error: Invalid response from model."
@@ -164,17 +233,14 @@ def get_generated_response_with_context(question: str, context: str, chat_histor
     )
 
     # Build chat messages with history
-    chat_messages = [{"role": "system", "content": system_prompt}]
-    if chat_history:
-        recent_history = chat_history[-10:] if len(chat_history) > 10 else chat_history
-        chat_messages.extend(recent_history)
-    chat_messages.append({"role": "user", "content": user_prompt})
+    chat_messages, history_info = build_chat_messages(system_prompt, user_prompt, chat_history)
 
     try:
         response = model.chat(messages=chat_messages)
         print("Raw model response:", response)
 
         if response and "choices" in response and len(response["choices"]) > 0:
+            after_chat_response(chat_history, history_info, response)
             return response["choices"][0]["message"].get("content", "Error: Could not extract generated text.")
         else:
             return "Error: Invalid response from model."
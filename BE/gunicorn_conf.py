@@ -0,0 +1,89 @@
+"""
+Gunicorn settings for the BE API (production entry point, see the Dockerfile):
+
+    gunicorn -c gunicorn_conf.py api_services:app
+
+Most of a request is spent waiting on COS, Elasticsearch and the LLM providers,
+so each worker process runs a pool of threads (gthread). Workers default to one
+per CPU (the GIL keeps a process on one core) and never fewer than two, so a
+worker being recycled is not the only one accepting. Threads per worker are
+sized so one core stays busy while the others wait: 1 / (1 - GUNICORN_IO_RATIO).
+The app is imported once in the master (preload) and forked, so the species
+catalogue, image kNN index and model weights are shared copy-on-write.
+"""
+import math
+import os
+
+
+def cpu_count():
+    """CPUs this process may run on (respects taskset/cpuset, unlike os.cpu_count)."""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def derive_concurrency(cpus, io_ratio, max_threads=64, min_workers=2):
+    """
+    (workers, threads) for `cpus` cores when `io_ratio` of a request's wall time
+    is spent waiting on I/O. io_ratio=0 gives one thread per worker.
+    """
+    if not 0 <= io_ratio < 1:
+        raise ValueError("GUNICORN_IO_RATIO must be in [0, 1)")
+    threads = math.ceil(1 / (1 - io_ratio) - 1e-9)
+    return max(min_workers, cpus), max(1, min(max_threads, threads))
+
+
+# /search waits ~100 ms on ES and the embedding service for a few ms of Python;
+# the vision routes wait seconds on the LLM providers
+IO_RATIO = float(os.getenv("GUNICORN_IO_RATIO", "0.98"))
+_workers, _threads = derive_concurrency(cpu_count(), IO_RATIO, int(os.getenv("GUNICORN_MAX_THREADS", "64")))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY") or _workers)
+threads = int(os.getenv("GUNICORN_THREADS") or _threads)
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Recycle workers now and then to bound slow leaks; the jitter keeps them from restarting together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+# Vision calls and the NDJSON stream can take tens of seconds; a worker silent for longer is killed
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+# SIGTERM: stop accepting, let in-flight requests finish for this long, then exit
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+# Longer than the load balancer's idle timeout, so the proxy never reuses a socket gunicorn just closed
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
+
+# Heartbeat files on tmpfs; a container's overlay filesystem can stall the worker heartbeat
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+
+
+def on_starting(server):
+    print(f"✓ gunicorn: {workers} workers x {threads} threads (io_ratio={IO_RATIO}, preload={preload_app}, "
+          f"max_requests={max_requests}±{max_requests_jitter}, keepalive={keepalive}s)")
+
+
+def post_fork(server, worker):
+    import sys
+    app_module = sys.modules.get("api_services")
+    if app_module is not None:
+        app_module.after_fork()
+
+
+def post_worker_init(worker):
+    # Queued jobs resume as soon as the worker is up, not on its first request
+    import sys
+    app_module = sys.modules.get("api_services")
+    if app_module is not None:
+        app_module.start_background_workers()
+
+
+def worker_exit(server, worker):
+    import sys
+    app_module = sys.modules.get("api_services")
+    if app_module is not None:
+        app_module.shutdown()
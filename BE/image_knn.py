@@ -0,0 +1,404 @@
+"""
+Local image-embedding kNN pre-classifier for the vision LLM.
+
+A small CLIP/SigLIP checkpoint embeds the uploaded photo on CPU. The embedding
+is compared with the reference photos under fish_images/<Species>/, and each
+species is scored by its most similar reference photo. When the margin between
+the best and the second-best species is at least the calibrated threshold, that
+species is returned without an LLM call. Uncertain images still go to the LLM.
+
+The threshold comes from leave-one-out over the reference photos: each photo is
+classified against all the others, and the threshold is the lowest margin at
+which top-1 precision still reaches the target.
+
+    python image_knn.py build --images-dir ../EXTRACTION/DATA/fish_images --output image_knn_index.npz
+    python image_knn.py calibrate --index image_knn_index.npz --target-precision 0.97
+    python evaluation_harness.py --images-dir <labelled> --pipelines image_knn,image_knn_fast,groq
+
+The reference vectors for the COS fish_images/ layout are built incrementally
+by INGESTION/image_vector_ingestion.py. It writes either this .npz file or a
+per-image Elasticsearch index (IMAGE_KNN_BACKEND=es). In both cases the hits
+are grouped per species by their best (max) or average (mean) similarity,
+set with IMAGE_KNN_AGGREGATION.
+
+transformers/torch are imported only when an image is embedded, so replayed
+evaluations and a disabled fast path do not need them.
+"""
+import argparse
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+IMAGE_KNN_FAST_PATH = os.getenv("IMAGE_KNN_FAST_PATH", "0") == "1"
+IMAGE_EMBEDDING_MODEL = os.getenv("IMAGE_EMBEDDING_MODEL", "openai/clip-vit-base-patch32")
+IMAGE_KNN_INDEX_PATH = os.getenv("IMAGE_KNN_INDEX_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "image_knn_index.npz")
+# Overrides the calibrated margin stored in the index
+IMAGE_KNN_MARGIN = os.getenv("IMAGE_KNN_MARGIN")
+# Below this cosine similarity the best match is not trusted at all (non-fish photos, unknown species)
+IMAGE_KNN_MIN_SIMILARITY = float(os.getenv("IMAGE_KNN_MIN_SIMILARITY", "0.75"))
+IMAGE_KNN_TORCH_THREADS = int(os.getenv("IMAGE_KNN_TORCH_THREADS", "0"))
+AGGREGATIONS = ("max", "mean")
+IMAGE_KNN_AGGREGATION = os.getenv("IMAGE_KNN_AGGREGATION", "max")
+IMAGE_KNN_BACKEND = os.getenv("IMAGE_KNN_BACKEND", "npz")
+IMAGE_KNN_ES_INDEX = os.getenv("IMAGE_KNN_ES_INDEX", "fish_image_index_v1")
+# Image hits fetched from Elasticsearch before grouping them per species
+IMAGE_KNN_ES_K = int(os.getenv("IMAGE_KNN_ES_K", "30"))
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+HF_CACHE_DIR = "/tmp/huggingface_models"
+
+
+class ImageEmbedder:
+    """L2-normalised image embeddings from a Hugging Face CLIP/SigLIP checkpoint, loaded on first use."""
+
+    def __init__(self, model_name: str = IMAGE_EMBEDDING_MODEL, batch_size: int = 16):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = None
+        self._processor = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                import torch
+                from transformers import AutoImageProcessor, AutoModel
+                if IMAGE_KNN_TORCH_THREADS:
+                    torch.set_num_threads(IMAGE_KNN_TORCH_THREADS)
+                start = time.perf_counter()
+                self._processor = AutoImageProcessor.from_pretrained(self.model_name, cache_dir=HF_CACHE_DIR)
+                self._model = AutoModel.from_pretrained(self.model_name, cache_dir=HF_CACHE_DIR, use_safetensors=True,
+                                                        low_cpu_mem_usage=True).eval()
+                print(f"Loaded image embedding model {self.model_name} in {time.perf_counter() - start:.1f}s")
+        return self._model, self._processor
+
+    def embed(self, images: Sequence[bytes]) -> np.ndarray:
+        """(n, dim) float32 unit vectors for encoded images (JPEG/PNG/WebP bytes)."""
+        import torch
+        from PIL import Image
+        model, processor = self._load()
+        vectors = []
+        for start in range(0, len(images), self.batch_size):
+            batch = [Image.open(io.BytesIO(data)).convert("RGB") for data in images[start:start + self.batch_size]]
+            with torch.inference_mode():
+                pixels = processor(images=batch, return_tensors="pt")["pixel_values"]
+                vectors.append(model.get_image_features(pixel_values=pixels).float().numpy())
+        matrix = np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        return (matrix / np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)).astype(np.float32)
+
+
+def _check_aggregation(aggregation: str) -> str:
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"aggregation must be one of {AGGREGATIONS}")
+    return aggregation
+
+
+def ranked_species(scores: Dict[str, float], size: int) -> Tuple[List[Dict[str, Any]], float]:
+    """([{"fish_name", "score"}] best first, margin between the top two species)."""
+    ranked = [{"fish_name": name, "score": float(score)}
+              for name, score in sorted(scores.items(), key=lambda item: -item[1])[:max(size, 2)]]
+    margin = ranked[0]["score"] - ranked[1]["score"] if len(ranked) > 1 else ranked[0]["score"] if ranked else 0.0
+    return ranked[:size], float(margin)
+
+
+def group_hits(hits: Sequence[Tuple[str, float]], aggregation: str = IMAGE_KNN_AGGREGATION) -> Dict[str, float]:
+    """{species: max or mean similarity} over per-image (species, similarity) hits."""
+    grouped: Dict[str, List[float]] = {}
+    for species, score in hits:
+        grouped.setdefault(species, []).append(score)
+    reduce = max if _check_aggregation(aggregation) == "max" else (lambda values: sum(values) / len(values))
+    return {species: reduce(values) for species, values in grouped.items()}
+
+
+class ImageKNNIndex:
+    """
+    Reference vectors sorted by species, so per-species scores are one
+    np.maximum.reduceat (or np.add.reduceat for the mean) over the similarity row.
+    """
+
+    def __init__(self, vectors: np.ndarray, labels: Sequence[str], keys: Optional[Sequence[str]] = None,
+                 model_name: str = IMAGE_EMBEDDING_MODEL, margin_threshold: Optional[float] = None,
+                 aggregation: str = IMAGE_KNN_AGGREGATION):
+        order = np.argsort(np.asarray(labels, dtype=object), kind="stable")
+        self.vectors = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32)[order])
+        self.labels = [labels[i] for i in order]
+        self.keys = [keys[i] for i in order] if keys is not None else [""] * len(self.labels)
+        self.model_name = model_name
+        self.margin_threshold = margin_threshold
+        self.aggregation = _check_aggregation(aggregation)
+        self.species, self.starts = [], []
+        for i, label in enumerate(self.labels):
+            if not self.species or self.species[-1] != label:
+                self.species.append(label)
+                self.starts.append(i)
+        self.starts = np.asarray(self.starts, dtype=np.int64)
+        self.counts = np.diff(np.append(self.starts, len(self.labels)))
+        self.species_of_row = np.repeat(np.arange(len(self.species)), self.counts)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def species_scores(self, similarities: np.ndarray) -> np.ndarray:
+        """Max or mean similarity per species for a (n,) or (m, n) similarity array."""
+        if self.aggregation == "max":
+            return np.maximum.reduceat(similarities, self.starts, axis=-1)
+        return np.add.reduceat(similarities, self.starts, axis=-1) / self.counts
+
+    def rank(self, vector: np.ndarray, size: int = 5) -> Tuple[List[Dict[str, Any]], float]:
+        """([{"fish_name", "score"}] best first, margin between the top two species)."""
+        scores = self.species_scores(self.vectors @ np.asarray(vector, dtype=np.float32))
+        top = np.argsort(-scores)[:max(size, 2)]
+        return ranked_species({self.species[i]: scores[i] for i in top}, size)
+
+    def leave_one_out(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(margin, top similarity, correct) for every reference photo classified against all the others."""
+        similarities = self.vectors @ self.vectors.T
+        rows = np.arange(len(self.labels))
+        if self.aggregation == "max":
+            np.fill_diagonal(similarities, -np.inf)
+            scores = self.species_scores(similarities)
+        else:
+            np.fill_diagonal(similarities, 0.0)
+            others = np.broadcast_to(self.counts, (len(rows), len(self.species))).copy()
+            others[rows, self.species_of_row] -= 1
+            sums = np.add.reduceat(similarities, self.starts, axis=-1)
+            scores = np.where(others > 0, sums / np.maximum(others, 1), -np.inf)
+        top2 = -np.sort(-scores, axis=1)[:, :2]
+        if top2.shape[1] < 2:
+            top2 = np.column_stack([top2[:, 0], np.zeros(len(top2))])
+        # A species whose only photo is held out has no score; count it as 0 like an absent runner-up in rank()
+        top2 = np.where(np.isfinite(top2), top2, 0.0)
+        correct = (np.argmax(scores, axis=1) == self.species_of_row) & np.isfinite(scores.max(axis=1))
+        return top2[:, 0] - top2[:, 1], top2[:, 0], correct
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": "npz", "model": self.model_name, "references": len(self),
+                "species": len(self.species), "aggregation": self.aggregation}
+
+    def save(self, path: str):
+        np.savez(path, vectors=self.vectors, labels=np.asarray(self.labels), keys=np.asarray(self.keys),
+                 model_name=np.asarray(self.model_name),
+                 margin_threshold=np.asarray(np.nan if self.margin_threshold is None else self.margin_threshold))
+
+    @classmethod
+    def load(cls, path: str) -> "ImageKNNIndex":
+        with np.load(path, allow_pickle=False) as data:
+            threshold = float(data["margin_threshold"])
+            return cls(data["vectors"], [str(x) for x in data["labels"]], [str(x) for x in data["keys"]],
+                       str(data["model_name"]), None if np.isnan(threshold) else threshold)
+
+
+class ElasticsearchImageIndex:
+    """
+    rank() over the per-image Elasticsearch index written by
+    INGESTION/image_vector_ingestion.py. The top `k` image hits are grouped per
+    species. The model name and calibrated margin are read from the index _meta.
+    """
+
+    def __init__(self, esq, index_name: str = IMAGE_KNN_ES_INDEX, k: int = IMAGE_KNN_ES_K,
+                 aggregation: str = IMAGE_KNN_AGGREGATION):
+        self.esq = esq
+        self.index_name = index_name
+        self.k = k
+        self.aggregation = _check_aggregation(aggregation)
+        meta = {}
+        try:
+            meta = esq.es.indices.get_mapping(index=index_name)[index_name]["mappings"].get("_meta", {})
+        except Exception as e:
+            print(f"✗ Could not read _meta of {index_name}: {e}")
+        self.model_name = meta.get("model_name", IMAGE_EMBEDDING_MODEL)
+        self.margin_threshold = meta.get("margin_threshold")
+        self.references = meta.get("references")
+        self.species_count = meta.get("species")
+
+    def rank(self, vector: np.ndarray, size: int = 5) -> Tuple[List[Dict[str, Any]], float]:
+        response = self.esq.search_embedding(index_name=self.index_name, embedding_field="image_embedding",
+                                             query_vector=[float(x) for x in vector], size=self.k)
+        # ES reports cosine similarity as (1 + cos) / 2
+        hits = [(hit["_source"]["fish_name"], 2.0 * hit["_score"] - 1.0)
+                for hit in (response or {}).get("hits", {}).get("hits", [])]
+        return ranked_species(group_hits(hits, self.aggregation), size)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": "es", "index": self.index_name, "model": self.model_name,
+                "references": self.references, "species": self.species_count, "aggregation": self.aggregation}
+
+
+def calibrate_margin(margins: np.ndarray, correct: np.ndarray, target_precision: float) -> Tuple[float, float, float]:
+    """
+    (threshold, precision, coverage): the lowest margin whose fast-path set
+    (margin >= threshold) is still at least target_precision correct. Returns
+    an infinite threshold, which disables the fast path, when no margin reaches it.
+    """
+    order = np.argsort(-margins, kind="stable")
+    hits = np.cumsum(correct[order])
+    precision = hits / np.arange(1, len(order) + 1)
+    ok = np.nonzero(precision >= target_precision)[0]
+    if not len(ok):
+        return float("inf"), 0.0, 0.0
+    k = ok[-1]
+    return float(margins[order][k]), float(precision[k]), float((k + 1) / len(order))
+
+
+class ImageKNNClassifier:
+    def __init__(self, index: ImageKNNIndex, embedder: Optional[ImageEmbedder] = None,
+                 margin_threshold: Optional[float] = None, min_similarity: float = IMAGE_KNN_MIN_SIMILARITY):
+        self.index = index
+        self.embedder = embedder or ImageEmbedder(index.model_name)
+        if margin_threshold is None:
+            margin_threshold = float(IMAGE_KNN_MARGIN) if IMAGE_KNN_MARGIN else index.margin_threshold
+        # An uncalibrated index never takes the fast path
+        self.margin_threshold = float("inf") if margin_threshold is None else margin_threshold
+        self.min_similarity = min_similarity
+        self.stats_counters = {"requests": 0, "fast_path": 0, "errors": 0, "embed_s_total": 0.0}
+        self._lock = threading.Lock()
+
+    def embed(self, image_bytes: bytes) -> List[float]:
+        start = time.perf_counter()
+        vector = self.embedder.embed([image_bytes])[0]
+        with self._lock:
+            self.stats_counters["embed_s_total"] += time.perf_counter() - start
+        return vector.tolist()
+
+    def decide(self, vector: Sequence[float], size: int = 5) -> Dict[str, Any]:
+        """{"ranked", "margin", "confident"} for an already computed embedding."""
+        ranked, margin = self.index.rank(np.asarray(vector, dtype=np.float32), size)
+        confident = bool(ranked) and margin >= self.margin_threshold and ranked[0]["score"] >= self.min_similarity
+        with self._lock:
+            self.stats_counters["requests"] += 1
+            self.stats_counters["fast_path"] += confident
+        return {"ranked": ranked, "margin": margin, "confident": confident}
+
+    def classify(self, image_bytes: bytes, size: int = 5) -> Optional[Dict[str, Any]]:
+        """decide() on the image, or None when it could not be embedded (the caller falls back to the LLM)."""
+        try:
+            vector = self.embed(image_bytes)
+        except Exception as e:
+            print(f"✗ Image embedding failed: {e}")
+            with self._lock:
+                self.stats_counters["errors"] += 1
+            return None
+        return self.decide(vector, size)
+
+    @staticmethod
+    def as_identification(decision: Dict[str, Any]) -> Dict[str, Any]:
+        """The decision in the shape of the LLM identification JSON used by /search_possible_fish."""
+        return {
+            "image_contains_fish": True,
+            "rejection_reason": None,
+            "results": [{"fish_name": c["fish_name"], "score": round(c["score"], 4),
+                         "score_reason": f"Reference photo similarity (margin {decision['margin']:.3f})"}
+                        for c in decision["ranked"]],
+            "source": "image_knn",
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats_counters)
+        embedded = stats["requests"] + stats["errors"]
+        stats["fast_path_rate"] = round(stats["fast_path"] / stats["requests"], 4) if stats["requests"] else None
+        stats["embed_ms_avg"] = round(1000 * stats["embed_s_total"] / embedded, 1) if embedded else None
+        stats.update(self.index.describe())
+        stats.update(margin_threshold=self.margin_threshold, min_similarity=self.min_similarity)
+        return stats
+
+
+_default_classifier = None
+_default_lock = threading.Lock()
+
+
+def get_image_classifier(esq=None, path: str = IMAGE_KNN_INDEX_PATH) -> Optional[ImageKNNClassifier]:
+    """
+    Process-wide classifier when IMAGE_KNN_FAST_PATH=1, else None. Uses the
+    .npz index, or the Elasticsearch index through `esq` with IMAGE_KNN_BACKEND=es.
+    """
+    global _default_classifier
+    if not IMAGE_KNN_FAST_PATH:
+        return None
+    with _default_lock:
+        if _default_classifier is None:
+            if IMAGE_KNN_BACKEND == "es":
+                _default_classifier = ImageKNNClassifier(ElasticsearchImageIndex(esq))
+            elif not os.path.exists(path):
+                print(f"✗ IMAGE_KNN_FAST_PATH is set but {path} does not exist; image kNN disabled")
+                return None
+            else:
+                _default_classifier = ImageKNNClassifier(ImageKNNIndex.load(path))
+        return _default_classifier
+
+
+# ---------------------------------------------------------------------- build / calibrate
+
+def _species_from_folder(folder: str) -> str:
+    return " ".join(folder.replace("_", "-").split("-")).strip()
+
+
+def local_references(images_dir: str) -> List[Tuple[str, str, Callable[[], bytes]]]:
+    """[(key, species, read)] for <images_dir>/<Species>/<image>."""
+    items = []
+    for species_dir in sorted(os.listdir(images_dir)):
+        folder = os.path.join(images_dir, species_dir)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(folder, name)
+                items.append((f"{species_dir}/{name}", _species_from_folder(species_dir),
+                              lambda path=path: open(path, "rb").read()))
+    return items
+
+
+def build_index(references, embedder: ImageEmbedder, workers: int = 8) -> ImageKNNIndex:
+    """Reads the reference photos on a thread pool and embeds them in batches."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        images = list(pool.map(lambda item: item[2](), references))
+    start = time.perf_counter()
+    vectors = embedder.embed(images)
+    print(f"Embedded {len(images)} reference photos in {time.perf_counter() - start:.1f}s")
+    return ImageKNNIndex(vectors, [r[1] for r in references], [r[0] for r in references], embedder.model_name)
+
+
+def calibrate(index: ImageKNNIndex, target_precision: float) -> Dict[str, Any]:
+    margins, top_similarity, correct = index.leave_one_out()
+    threshold, precision, coverage = calibrate_margin(margins, correct, target_precision)
+    index.margin_threshold = threshold if np.isfinite(threshold) else None
+    return {"references": len(index), "species": len(index.species),
+            "leave_one_out_top1": round(float(correct.mean()), 4) if len(correct) else None,
+            "margin_threshold": threshold, "fast_path_precision": round(precision, 4),
+            "fast_path_coverage": round(coverage, 4),
+            "top_similarity_p5_correct": round(float(np.percentile(top_similarity[correct], 5)), 4)
+            if correct.any() else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="embed local reference photos into an .npz index "
+                                         "(INGESTION/image_vector_ingestion.py does this for COS)")
+    build.add_argument("--images-dir", required=True, help="local folder laid out as <Species>/<image>")
+    build.add_argument("--output", default=IMAGE_KNN_INDEX_PATH)
+    build.add_argument("--model", default=IMAGE_EMBEDDING_MODEL)
+    build.add_argument("--target-precision", type=float, default=0.97)
+    cal = sub.add_parser("calibrate", help="re-derive the margin threshold of an index")
+    cal.add_argument("--index", default=IMAGE_KNN_INDEX_PATH)
+    cal.add_argument("--target-precision", type=float, default=0.97)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = build_index(local_references(args.images_dir), ImageEmbedder(args.model))
+        path = args.output
+    else:
+        index = ImageKNNIndex.load(args.index)
+        path = args.index
+    report = calibrate(index, args.target_precision)
+    index.save(path)
+    print(f"Wrote {path}: {report}")
+
+
+if __name__ == "__main__":
+    main()
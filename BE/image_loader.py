@@ -0,0 +1,328 @@
+"""
+Streaming, size-capped image loading from IBM COS.
+
+`get_object(...)['Body'].read()` followed by `base64.b64encode(...).decode()`
+holds the raw object, the base64 bytes and the base64 str at once. Instead:
+
+1. A ranged GET of the first IMAGE_SNIFF_BYTES returns the total object size
+   (ContentRange) and the header bytes. The size is checked against
+   MAX_IMAGE_BYTES and the format/dimensions are sniffed before the body is
+   downloaded, so oversized or non-image objects cost a few KB.
+2. The rest of the object is streamed in IMAGE_CHUNK_BYTES chunks, either into
+   an incremental base64 encoder (Groq/watsonx data URLs) or kept as raw bytes
+   for providers that take bytes (Gemini types.Part.from_bytes).
+
+With IMAGE_LOADER_TRACEMALLOC=1 the peak traced allocation of every load is
+recorded in stats() (approximate when loads overlap).
+
+    python image_loader.py benchmark path/to/image.jpg
+compares the peak memory of the old read-then-encode path with the streaming one.
+"""
+import argparse
+import base64
+import io
+import os
+import re
+import struct
+import threading
+import tracemalloc
+from typing import Any, Dict, Optional
+
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(15 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(60_000_000)))
+IMAGE_SNIFF_BYTES = int(os.getenv("IMAGE_SNIFF_BYTES", "16384"))
+# A multiple of 3, so every chunk but the last base64-encodes without padding
+IMAGE_CHUNK_BYTES = int(os.getenv("IMAGE_CHUNK_BYTES", str(3 * 85 * 1024)))
+IMAGE_LOADER_TRACEMALLOC = os.getenv("IMAGE_LOADER_TRACEMALLOC", "0") == "1"
+
+MIME_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+ENCODINGS = ("base64", "bytes")
+
+# JPEG start-of-frame markers carry the dimensions (C4, C8 and CC are not SOF)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageRejected(ValueError):
+    """The object is not an acceptable image; `status` is the HTTP status to answer with."""
+    status = 400
+
+
+class ImageTooLarge(ImageRejected):
+    status = 413
+
+
+class UnsupportedImage(ImageRejected):
+    status = 415
+
+
+def _jpeg_size(head: bytes):
+    i = 2
+    while i + 9 <= len(head):
+        if head[i] != 0xFF:
+            return None
+        marker = head[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in _JPEG_SOF:
+            height, width = struct.unpack(">HH", head[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack(">H", head[i + 2:i + 4])[0]
+    return None
+
+
+def _webp_size(head: bytes):
+    chunk = head[12:16]
+    if chunk == b"VP8 " and len(head) >= 30:
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(head) >= 25:
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(head) >= 30:
+        return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    return None
+
+
+def sniff_image(head: bytes) -> Dict[str, Any]:
+    """{"format", "mime_type", "width", "height"} from the first bytes of an image (dimensions may be None)."""
+    size = None
+    if head.startswith(b"\xff\xd8\xff"):
+        fmt, size = "jpeg", _jpeg_size(head)
+    elif head.startswith(b"\x89PNG\r\n\x1a\n"):
+        fmt = "png"
+        if len(head) >= 24:
+            size = struct.unpack(">II", head[16:24])
+    elif head[:6] in (b"GIF87a", b"GIF89a"):
+        fmt = "gif"
+        if len(head) >= 10:
+            size = struct.unpack("<HH", head[6:10])
+    elif head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        fmt, size = "webp", _webp_size(head)
+    else:
+        raise UnsupportedImage("Unsupported image format (expected JPEG, PNG, WebP or GIF)")
+    width, height = size if size else (None, None)
+    return {"format": fmt, "mime_type": MIME_TYPES[fmt], "width": width, "height": height}
+
+
+class Base64Encoder:
+    """Incremental base64: feed raw chunks, get one str at the end without keeping the raw bytes."""
+
+    def __init__(self, expected_size: Optional[int] = None):
+        self._out = bytearray(4 * ((expected_size + 2) // 3)) if expected_size else bytearray()
+        self._view_size = len(self._out)
+        self._pos = 0
+        self._carry = b""
+
+    def _write(self, encoded: bytes):
+        end = self._pos + len(encoded)
+        if end <= self._view_size:
+            self._out[self._pos:end] = encoded
+        else:
+            del self._out[self._pos:]
+            self._out += encoded
+            self._view_size = len(self._out)
+        self._pos = end
+
+    def update(self, chunk: bytes):
+        data = self._carry + chunk if self._carry else chunk
+        usable = len(data) - len(data) % 3
+        self._write(base64.b64encode(memoryview(data)[:usable]))
+        self._carry = bytes(data[usable:])
+
+    def finish(self) -> str:
+        if self._carry:
+            self._write(base64.b64encode(self._carry))
+            self._carry = b""
+        del self._out[self._pos:]
+        return self._out.decode("ascii")
+
+
+def _iter_body(body, chunk_size: int):
+    iter_chunks = getattr(body, "iter_chunks", None)
+    if iter_chunks is not None:
+        yield from iter_chunks(chunk_size)
+        return
+    while True:
+        chunk = body.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class LoadedImage:
+    """Image payload (`data`: base64 str or raw bytes) plus what was sniffed from its header."""
+
+    __slots__ = ("key", "size", "info", "data", "encoding")
+
+    def __init__(self, key, size, info, data, encoding):
+        self.key, self.size, self.info, self.data, self.encoding = key, size, info, data, encoding
+
+    @property
+    def mime_type(self) -> str:
+        return self.info["mime_type"]
+
+
+class ImageLoader:
+    def __init__(self, max_bytes: int = MAX_IMAGE_BYTES, max_pixels: int = MAX_IMAGE_PIXELS,
+                 sniff_bytes: int = IMAGE_SNIFF_BYTES, chunk_bytes: int = IMAGE_CHUNK_BYTES,
+                 trace_memory: bool = IMAGE_LOADER_TRACEMALLOC):
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.sniff_bytes = sniff_bytes
+        self.chunk_bytes = chunk_bytes
+        self.trace_memory = trace_memory
+        self.stats_counters = {"loads": 0, "bytes": 0, "rejected_too_large": 0, "rejected_unsupported": 0,
+                               "peak_bytes_max": 0, "peak_bytes_total": 0}
+        self._lock = threading.Lock()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    # ------------------------------------------------------------------ checks
+
+    def _check(self, size: Optional[int], info: Optional[Dict[str, Any]] = None):
+        try:
+            if size is not None and size > self.max_bytes:
+                raise ImageTooLarge(f"Image is {size} bytes, the limit is {self.max_bytes}")
+            if info and info["width"] and info["height"] and info["width"] * info["height"] > self.max_pixels:
+                raise ImageTooLarge(f"Image is {info['width']}x{info['height']} pixels, the limit is {self.max_pixels}")
+        except ImageTooLarge:
+            self._count("rejected_too_large")
+            raise
+
+    def _sniff(self, head: bytes) -> Dict[str, Any]:
+        try:
+            return sniff_image(head)
+        except UnsupportedImage:
+            self._count("rejected_unsupported")
+            raise
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self.stats_counters[name] += value
+
+    # ------------------------------------------------------------------ loading
+
+    def _traced(self, load):
+        if not self.trace_memory:
+            return load()
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        image = load()
+        peak = max(tracemalloc.get_traced_memory()[1] - baseline, 0)
+        with self._lock:
+            self.stats_counters["peak_bytes_max"] = max(self.stats_counters["peak_bytes_max"], peak)
+            self.stats_counters["peak_bytes_total"] += peak
+        return image
+
+    def load_cos(self, cos, bucket: str, key: str, encoding: str = "base64") -> LoadedImage:
+        """Size check and format sniff from a ranged GET, then the remaining bytes streamed into `encoding`."""
+        if encoding not in ENCODINGS:
+            raise ValueError(f"encoding must be one of {ENCODINGS}")
+        return self._traced(lambda: self._load_cos(cos, bucket, key, encoding))
+
+    def _load_cos(self, cos, bucket, key, encoding):
+        first = cos.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{self.sniff_bytes - 1}")
+        head = first["Body"].read()
+        match = re.match(r"bytes \d+-\d+/(\d+)", first.get("ContentRange") or "")
+        if match:
+            size = int(match.group(1))
+        elif len(head) < self.sniff_bytes:
+            size = len(head)  # the whole object fit in the ranged read
+        else:
+            size = cos.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self._check(size)
+        info = self._sniff(head)
+        self._check(None, info)
+
+        if encoding == "base64":
+            sink = Base64Encoder(size)
+            write = sink.update
+        else:
+            sink = io.BytesIO()
+            write = sink.write
+        write(head)
+        received = len(head)
+        if received < size:
+            rest = cos.get_object(Bucket=bucket, Key=key, Range=f"bytes={received}-")["Body"]
+            try:
+                for chunk in _iter_body(rest, self.chunk_bytes):
+                    received += len(chunk)
+                    if received > self.max_bytes:  # the object grew, or ContentRange lied
+                        self._count("rejected_too_large")
+                        raise ImageTooLarge(f"Image exceeds the limit of {self.max_bytes} bytes")
+                    write(chunk)
+            finally:
+                close = getattr(rest, "close", None)
+                if close:
+                    close()
+        data = sink.finish() if encoding == "base64" else sink.getvalue()
+        self._count("loads")
+        self._count("bytes", received)
+        return LoadedImage(key, received, info, data, encoding)
+
+    def load_bytes(self, image_bytes: bytes, key: Optional[str] = None, encoding: str = "base64") -> LoadedImage:
+        """Same checks for an image that is already in memory (direct uploads)."""
+        if encoding not in ENCODINGS:
+            raise ValueError(f"encoding must be one of {ENCODINGS}")
+        self._check(len(image_bytes))
+        info = self._sniff(bytes(image_bytes[:self.sniff_bytes]))
+        self._check(None, info)
+        data = base64.b64encode(image_bytes).decode("ascii") if encoding == "base64" else bytes(image_bytes)
+        self._count("loads")
+        self._count("bytes", len(image_bytes))
+        return LoadedImage(key, len(image_bytes), info, data, encoding)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats_counters)
+        stats["max_bytes"] = self.max_bytes
+        stats["peak_bytes_avg"] = (round(stats["peak_bytes_total"] / stats["loads"])
+                                   if self.trace_memory and stats["loads"] else None)
+        return stats
+
+
+# ---------------------------------------------------------------------- benchmark
+
+def _peak(fn) -> int:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    del result
+    tracemalloc.stop()
+    return peak
+
+
+def benchmark(path: str, repeat: int = 3):
+    from fake_providers import FakeCOSClient, LatencyModel
+
+    cos = FakeCOSClient(root=os.path.dirname(os.path.abspath(path)), latency=LatencyModel("cos", "fixed:0", 0.0))
+    key = os.path.basename(path)
+    loader = ImageLoader(max_bytes=max(MAX_IMAGE_BYTES, os.path.getsize(path)), trace_memory=False)
+
+    def old_path():
+        image_bytes = cos.get_object(Bucket="bench", Key=key)["Body"].read()
+        return base64.b64encode(image_bytes).decode("utf-8")
+
+    cases = {
+        "read + b64encode (before)": old_path,
+        "streamed base64": lambda: loader.load_cos(cos, "bench", key, "base64").data,
+        "streamed raw bytes (Gemini)": lambda: loader.load_cos(cos, "bench", key, "bytes").data,
+    }
+    size = os.path.getsize(path)
+    print(f"{key}: {size / 1e6:.2f} MB")
+    for name, fn in cases.items():
+        peak = min(_peak(fn) for _ in range(repeat))
+        print(f"  {name:<30} peak {peak / 1e6:7.2f} MB  ({peak / size:.2f}x object size)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Image loader tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("benchmark", help="Peak memory of loading one image, before vs. streaming")
+    bench.add_argument("path")
+    bench.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.path, args.repeat)
@@ -0,0 +1,359 @@
+"""
+Durable background jobs for the slow vision endpoints.
+
+POST /jobs stores the request in a local SQLite queue and returns a job id
+straight away; a bounded pool of worker threads runs the registered handler
+(the same code the synchronous endpoints use) and stores the result, which
+clients poll with GET /jobs/<id> or receive on an optional webhook.
+
+Jobs are claimed with a lease (JOB_LEASE_S) that a heartbeat renews while the
+handler runs. A job whose worker died (crash, redeploy) is picked up again once
+its lease expires, up to JOB_MAX_ATTEMPTS attempts. Failed attempts are retried
+after an exponential backoff (JOB_RETRY_BASE_S, doubling up to JOB_RETRY_MAX_S).
+Several processes may share one database file; SQLite's write lock makes
+claiming atomic across them.
+
+Webhooks are only sent to hosts in JOB_WEBHOOK_ALLOWED_HOSTS (comma separated,
+"*.example.com" matches subdomains); with none configured, webhooks are refused.
+"""
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Sequence
+from urllib.parse import urlsplit
+
+import requests
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "/tmp/fish_jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_S = float(os.getenv("JOB_RETRY_BASE_S", "5"))
+JOB_RETRY_MAX_S = float(os.getenv("JOB_RETRY_MAX_S", "300"))
+JOB_POLL_S = float(os.getenv("JOB_POLL_S", "1.0"))
+JOB_RETENTION_S = float(os.getenv("JOB_RETENTION_S", str(24 * 3600)))
+JOB_WEBHOOK_RETRIES = int(os.getenv("JOB_WEBHOOK_RETRIES", "3"))
+JOB_WEBHOOK_TIMEOUT_S = float(os.getenv("JOB_WEBHOOK_TIMEOUT_S", "10"))
+# Optional shared secret; webhook bodies are then signed in X-Fish-Signature (hex HMAC-SHA256)
+JOB_WEBHOOK_SECRET = os.getenv("JOB_WEBHOOK_SECRET", "")
+JOB_WEBHOOK_ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",")
+                             if h.strip()]
+
+STATUSES = ("queued", "running", "done", "failed")
+
+
+class JobQueue:
+    """SQLite-backed job queue with an in-process worker pool."""
+
+    def __init__(self, path: str = JOB_DB_PATH, workers: int = JOB_WORKERS, lease_s: float = JOB_LEASE_S,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, poll_s: float = JOB_POLL_S,
+                 retry_base_s: float = JOB_RETRY_BASE_S, retry_max_s: float = JOB_RETRY_MAX_S,
+                 webhook_hosts: Sequence[str] = JOB_WEBHOOK_ALLOWED_HOSTS):
+        self.path = path
+        self.workers = workers
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self.poll_s = poll_s
+        self.retry_base_s = retry_base_s
+        self.retry_max_s = retry_max_s
+        self.webhook_hosts = [h.lower() for h in webhook_hosts]
+        self.handlers: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {}
+        self.busy = 0
+        self.stats_counters = {"submitted": 0, "completed": 0, "failed": 0, "retried": 0, "lease_renewals": 0,
+                               "webhooks_sent": 0, "webhooks_failed": 0}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._workers_pid = None
+        self._webhooks = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode; claims use explicit BEGIN IMMEDIATE transactions
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                webhook_url TEXT,
+                webhook_status TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                lease_until REAL,
+                not_before REAL
+            )
+            """
+        )
+        # Databases created before retry backoff have no not_before column
+        if "not_before" not in [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]:
+            conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+        return conn
+
+    def after_fork(self):
+        """
+        Gives a forked child (gunicorn worker with preload_app) its own SQLite
+        connection; a connection inherited across fork must not be used.
+        """
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._conn = self._connect()
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats_counters[name] += 1
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Dict[str, Any]]):
+        """handler(payload) -> JSON-serialisable result; raising marks the attempt as failed."""
+        self.handlers[kind] = handler
+
+    def webhook_allowed(self, url: str) -> bool:
+        """True for an http(s) URL whose host is in the allowlist (exact, or "*.domain" for subdomains)."""
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        if parts.scheme not in ("http", "https") or not host:
+            return False
+        return any(host == allowed or (allowed.startswith("*.") and host.endswith(allowed[1:]))
+                   for allowed in self.webhook_hosts)
+
+    # ------------------------------------------------------------------ producer
+
+    def submit(self, kind: str, payload: Dict[str, Any], webhook_url: Optional[str] = None) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job type '{kind}', expected one of {sorted(self.handlers)}")
+        if webhook_url and not self.webhook_allowed(webhook_url):
+            raise ValueError("webhook_url host is not in JOB_WEBHOOK_ALLOWED_HOSTS")
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, webhook_url, created_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), webhook_url, time.time()),
+            )
+            self.stats_counters["submitted"] += 1
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, status, attempts, result, error, webhook_status, created_at, started_at, finished_at "
+                "FROM jobs WHERE id = ?", (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("job_id", "type", "status", "attempts", "result", "error", "webhook_status",
+                        "created_at", "started_at", "finished_at"), row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    # ------------------------------------------------------------------ workers
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Leases the oldest runnable job (queued and past its backoff, or running with an expired lease)."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'worker lost (lease expired)', finished_at = ?, "
+                    "lease_until = NULL WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, now, self.max_attempts),
+                )
+                row = self._conn.execute(
+                    "SELECT id, kind, payload, attempts FROM jobs "
+                    "WHERE (status = 'queued' AND (not_before IS NULL OR not_before <= ?)) "
+                    "OR (status = 'running' AND lease_until < ?) "
+                    "ORDER BY created_at LIMIT 1", (now, now),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, lease_until = ? "
+                        "WHERE id = ?", (now, now + self.lease_s, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+
+    def _finish(self, job_id: str, status: str, result=None, error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL WHERE id = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(),
+                 job_id),
+            )
+
+    def _heartbeat(self, job_id: str, stop: threading.Event):
+        """Renews the lease every third of lease_s so a long handler is not claimed a second time."""
+        while not stop.wait(max(self.lease_s / 3.0, 0.05)):
+            with self._lock:
+                self._conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+                                   (time.time() + self.lease_s, job_id))
+                self.stats_counters["lease_renewals"] += 1
+
+    def retry_delay(self, attempts: int) -> float:
+        return min(self.retry_max_s, self.retry_base_s * (2 ** (attempts - 1)))
+
+    def run_one(self) -> bool:
+        """Claims and runs a single job. Returns False when the queue is empty."""
+        job = self.claim()
+        if job is None:
+            return False
+        with self._lock:
+            self.busy += 1
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job["id"], stop), name=f"job-lease-{job['id'][:8]}",
+                         daemon=True).start()
+        try:
+            result = self.handlers[job["kind"]](job["payload"])
+            stop.set()
+            self._finish(job["id"], "done", result=result)
+            self._count("completed")
+        except Exception as e:
+            stop.set()
+            print(f"✗ Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed: {e}")
+            if job["attempts"] < self.max_attempts:
+                delay = self.retry_delay(job["attempts"])
+                with self._lock:
+                    self._conn.execute("UPDATE jobs SET status = 'queued', error = ?, lease_until = NULL, "
+                                       "not_before = ? WHERE id = ?", (str(e), time.time() + delay, job["id"]))
+                self._count("retried")
+                return True
+            self._finish(job["id"], "failed", error=str(e))
+            self._count("failed")
+        finally:
+            stop.set()
+            with self._lock:
+                self.busy -= 1
+        self._notify(job["id"])
+        return True
+
+    def _worker_loop(self):
+        while True:
+            try:
+                if self.run_one():
+                    continue
+            except Exception as e:
+                print(f"✗ Job worker error: {e}")
+            self._wakeup.wait(self.poll_s)
+            self._wakeup.clear()
+
+    def ensure_workers(self):
+        """Starts the worker threads once per process (safe to call on every request)."""
+        if self.workers <= 0 or self._workers_pid == os.getpid():
+            return
+        with self._lock:
+            if self._workers_pid == os.getpid():
+                return
+            self._workers_pid = os.getpid()
+            self.busy = 0
+            self._webhooks = ThreadPoolExecutor(max_workers=2, thread_name_prefix="job-webhook")
+        for i in range(self.workers):
+            threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True).start()
+        threading.Thread(target=self._cleanup_loop, name="job-cleanup", daemon=True).start()
+        print(f"🧵 Job workers started: {self.workers} (pid {os.getpid()})")
+
+    def _cleanup_loop(self):
+        while True:
+            time.sleep(600)
+            self.purge_finished()
+
+    def purge_finished(self, older_than_s: float = JOB_RETENTION_S) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                                        (time.time() - older_than_s,))
+        return cursor.rowcount
+
+    # ------------------------------------------------------------------ webhooks
+
+    def _notify(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT webhook_url FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row and row[0]:
+            if self._webhooks is not None:
+                self._webhooks.submit(self.send_webhook, job_id, row[0])
+            else:
+                self.send_webhook(job_id, row[0])
+
+    def send_webhook(self, job_id: str, url: str, retries: int = JOB_WEBHOOK_RETRIES) -> bool:
+        """POSTs the job (as GET /jobs/<id> returns it) with exponential backoff between attempts."""
+        if not self.webhook_allowed(url):
+            print(f"✗ Webhook for job {job_id} refused, host not in JOB_WEBHOOK_ALLOWED_HOSTS")
+            self._count("webhooks_failed")
+            return False
+        body = json.dumps(self.get(job_id), ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if JOB_WEBHOOK_SECRET:
+            headers["X-Fish-Signature"] = hmac.new(JOB_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        status = "failed"
+        for attempt in range(retries + 1):
+            try:
+                # No redirects: an allowed host must not bounce the request to an internal one
+                response = requests.post(url, data=body, headers=headers, timeout=JOB_WEBHOOK_TIMEOUT_S,
+                                         allow_redirects=False)
+                if response.status_code < 300:
+                    status = "delivered"
+                    break
+                print(f"Webhook for job {job_id} returned {response.status_code}")
+            except Exception as e:
+                print(f"Webhook for job {job_id} failed: {e}")
+            if attempt < retries:
+                time.sleep(2 ** attempt)
+        self._count("webhooks_sent" if status == "delivered" else "webhooks_failed")
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET webhook_status = ? WHERE id = ?", (status, job_id))
+        return status == "delivered"
+
+    # ------------------------------------------------------------------ metrics
+
+    def stats(self, window_s: float = 300.0) -> Dict[str, Any]:
+        """Queue depth, worker utilisation and recent wait/run times (inputs for autoscaling)."""
+        since = time.time() - window_s
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = self._conn.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            avg_wait, avg_run, finished = self._conn.execute(
+                "SELECT AVG(started_at - created_at), AVG(finished_at - started_at), COUNT(*) FROM jobs "
+                "WHERE status IN ('done', 'failed') AND finished_at >= ?", (since,),
+            ).fetchone()
+            busy = self.busy
+        workers = self.workers if self._workers_pid == os.getpid() else 0
+        return {
+            "queue_depth": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_queued_age_s": round(time.time() - oldest, 1) if oldest else 0.0,
+            "workers": workers,
+            "busy_workers": busy,
+            "worker_utilization": round(busy / workers, 3) if workers else None,
+            "avg_wait_s": round(avg_wait, 3) if avg_wait is not None else None,
+            "avg_run_s": round(avg_run, 3) if avg_run is not None else None,
+            "throughput_per_min": round(finished / (window_s / 60.0), 2),
+            **self.stats_counters,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
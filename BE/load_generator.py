@@ -0,0 +1,134 @@
+"""
+Closed-loop load generator for the BE API.
+
+Each of `--concurrency` threads sends requests back to back for `--duration`
+seconds. Throughput and p50/p90/p99 latency are reported per route and
+concurrency level, printed and written to `--output` as CSV. Start the API
+against the local fakes to measure the service itself rather than the providers:
+
+    FISH_FAKE_BACKENDS=1 FAKE_LATENCY_GROQ=lognormal:2500:0.4 python api_services.py
+    python load_generator.py --routes search,search_possible_fish --concurrency 1,4,16,64 --duration 20
+"""
+import argparse
+import csv
+import itertools
+import os
+import threading
+import time
+
+import numpy as np
+import requests
+
+DEFAULT_IMAGES = ["fish-random/fish-1.png", "fish-random/fish-2.jpg", "fish-random/fish-3.webp",
+                  "fish-random/fish-4.jpg", "fish-random/fish-4.png"]
+QUERIES = [
+    "orange fish with white stripes",
+    "flat fish lying on sand",
+    "long silver fish with sharp teeth",
+    "yellow box shaped fish with black spots",
+]
+SCIENTIFIC_NAMES = ["Amphiprion ocellaris", "Pterois volitans", "Rhincodon typus", "Ostracion cubicus"]
+
+# route -> (HTTP method, payload factory taking a request counter)
+ROUTES = {
+    "live": ("GET", None),
+    "search": ("POST", lambda i, images: {"text": QUERIES[i % len(QUERIES)]}),
+    "search_with_scientific_name": ("POST", lambda i, images: {"scientific_name": SCIENTIFIC_NAMES[i % len(SCIENTIFIC_NAMES)]}),
+    "image_captioning": ("POST", lambda i, images: {"image": images[i % len(images)]}),
+    "image_identification": ("POST", lambda i, images: {"image": images[i % len(images)]}),
+    "identify_and_search": ("POST", lambda i, images: {"image": images[i % len(images)]}),
+    "search_possible_fish": ("POST", lambda i, images: {"image": images[i % len(images)]}),
+    "generation": ("POST", lambda i, images: {"question": f"What does a {QUERIES[i % len(QUERIES)]} eat?",
+                                               "chat_history": []}),
+}
+
+
+def run_level(base_url, route, concurrency, duration, images, timeout):
+    """Runs one (route, concurrency) level and returns the per-request samples."""
+    method, payload_fn = ROUTES[route]
+    url = f"{base_url.rstrip('/')}/{route}"
+    samples = []  # (latency_s, ok)
+    lock = threading.Lock()
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < deadline:
+            i = next(counter)
+            start = time.perf_counter()
+            try:
+                if method == "GET":
+                    response = session.get(url, timeout=timeout)
+                else:
+                    response = session.post(url, json=payload_fn(i, images), timeout=timeout)
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            local.append((time.perf_counter() - start, ok))
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - started
+
+
+def summarize(route, concurrency, samples, elapsed):
+    latencies = np.array([s[0] for s in samples if s[1]]) * 1000
+    errors = sum(1 for s in samples if not s[1])
+    row = {
+        "route": route,
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+    for p in (50, 90, 99):
+        row[f"p{p}_ms"] = round(float(np.percentile(latencies, p)), 1) if len(latencies) else None
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=os.getenv("BE_BASE_URL", "http://localhost:8080"))
+    parser.add_argument("--routes", default="search,search_possible_fish",
+                        help=f"comma separated, any of {','.join(ROUTES)}")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per level")
+    parser.add_argument("--images", default=",".join(DEFAULT_IMAGES), help="COS keys used by the image routes")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", default="load_results.csv")
+    args = parser.parse_args()
+
+    routes = [r.strip() for r in args.routes.split(",") if r.strip()]
+    unknown = [r for r in routes if r not in ROUTES]
+    if unknown:
+        parser.error(f"unknown routes {unknown}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    images = [i.strip() for i in args.images.split(",") if i.strip()]
+
+    rows = []
+    print(f"{'route':<28} {'conc':>5} {'reqs':>6} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for route in routes:
+        for concurrency in levels:
+            samples, elapsed = run_level(args.base_url, route, concurrency, args.duration, images, args.timeout)
+            row = summarize(route, concurrency, samples, elapsed)
+            rows.append(row)
+            print(f"{route:<28} {concurrency:>5} {row['requests']:>6} {row['errors']:>5} {row['throughput_rps']:>8} "
+                  f"{row['p50_ms'] or '-':>9} {row['p90_ms'] or '-':>9} {row['p99_ms'] or '-':>9}")
+
+    with open(args.output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
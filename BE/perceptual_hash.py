@@ -0,0 +1,315 @@
+"""
+Perceptual hashing and a near-duplicate cache for identification results.
+
+The exact sha256 used by the single-flight groups only matches byte-identical
+uploads. The same photo forwarded through a messaging app comes back
+recompressed, resized or slightly cropped, and costs another vision-model call.
+Here each image is normalised (EXIF orientation, alpha flattened on white,
+grayscale, small fixed size) and reduced to a 64-bit dHash or pHash. Images
+whose hashes differ in at most `max_distance` bits are treated as the same
+photo. Previous results are looked up in a BK-tree, so a lookup does not scan
+every stored hash.
+
+Reuse is off by default (IMAGE_DEDUP_CACHE=1 turns it on). The benchmark below
+only measures generated variants of a few sample photos; the false-match rate
+on a real labelled set of distinct but similar fish photos is not known yet.
+
+    python perceptual_hash.py benchmark ../EXTRACTION/DATA/fish-random
+"""
+import argparse
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageOps
+
+IMAGE_DEDUP_CACHE = os.getenv("IMAGE_DEDUP_CACHE", "0") == "1"
+IMAGE_DEDUP_ALGORITHM = os.getenv("IMAGE_DEDUP_ALGORITHM", "phash")
+IMAGE_DEDUP_MAX_DISTANCE = int(os.getenv("IMAGE_DEDUP_MAX_DISTANCE", "6"))
+IMAGE_DEDUP_MAX_ENTRIES = int(os.getenv("IMAGE_DEDUP_MAX_ENTRIES", "10000"))
+IMAGE_DEDUP_TTL_S = float(os.getenv("IMAGE_DEDUP_TTL_S", str(24 * 3600)))
+
+
+def normalized_image(image_bytes: bytes, size: Tuple[int, int]) -> Image.Image:
+    """Grayscale image resized to `size`, independent of orientation tags, alpha and input resolution."""
+    image = Image.open(io.BytesIO(image_bytes))
+    # JPEG can decode at 1/2..1/8 scale directly, which is most of the hashing cost for large photos
+    image.draft("RGB", (size[0] * 4, size[1] * 4))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    return image.convert("L").resize(size, Image.LANCZOS)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(image_bytes: bytes, hash_size: int = 8) -> int:
+    """Difference hash: sign of the horizontal gradient on a (hash_size+1) x hash_size thumbnail."""
+    pixels = np.asarray(normalized_image(image_bytes, (hash_size + 1, hash_size)), dtype=np.int16)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+    matrix[0] *= 1 / np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def phash(image_bytes: bytes, hash_size: int = 8) -> int:
+    """DCT hash: low-frequency coefficients of a 32x32 thumbnail compared with their median."""
+    pixels = np.asarray(normalized_image(image_bytes, (32, 32)), dtype=np.float64)
+    dct = (_DCT_32 @ pixels @ _DCT_32.T)[:hash_size, :hash_size]
+    return _bits_to_int(dct > np.median(dct))
+
+
+HASHERS: Dict[str, Callable[[bytes], int]] = {"dhash": dhash, "phash": phash}
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance; values with equal hashes share a node."""
+
+    def __init__(self):
+        self.root: Optional[list] = None  # [hash, values, {distance: child}]
+        self.size = 0
+
+    def add(self, hash_value: int, value: Any):
+        self.size += 1
+        if self.root is None:
+            self.root = [hash_value, [value], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(hash_value, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, [value], {}]
+                return
+            node = child
+
+    def search(self, hash_value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """(distance, value) for every stored value within max_distance, nearest first."""
+        found = []
+        pending = [self.root] if self.root is not None else []
+        while pending:
+            node = pending.pop()
+            distance = hamming(hash_value, node[0])
+            if distance <= max_distance:
+                found.extend((distance, value) for value in node[1])
+            # Triangle inequality: only children at distance d from this node can be within range
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    pending.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class NearDuplicateCache:
+    """
+    Results keyed by perceptual hash, per namespace (the provider, so a Groq
+    answer is never served for a Gemini request). Oldest entries are evicted
+    past `max_entries` or `ttl_s`; evicted ids stay in the BK-tree until it is
+    rebuilt, and lookups skip them.
+    """
+
+    def __init__(self, algorithm: str = IMAGE_DEDUP_ALGORITHM, max_distance: int = IMAGE_DEDUP_MAX_DISTANCE,
+                 max_entries: int = IMAGE_DEDUP_MAX_ENTRIES, ttl_s: float = IMAGE_DEDUP_TTL_S):
+        if algorithm not in HASHERS:
+            raise ValueError(f"algorithm must be one of {sorted(HASHERS)}")
+        self.algorithm = algorithm
+        self.hasher = HASHERS[algorithm]
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.stats_counters = {"lookups": 0, "hits": 0, "exact_hits": 0, "misses": 0, "hash_errors": 0,
+                               "stored": 0, "evicted": 0, "hash_s_total": 0.0, "saved_s_total": 0.0}
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._trees: Dict[str, BKTree] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def hash_image(self, image_bytes: bytes) -> Optional[int]:
+        """Perceptual hash, or None when the image cannot be decoded (the caller then skips the cache)."""
+        start = time.perf_counter()
+        try:
+            return self.hasher(image_bytes)
+        except Exception as e:
+            print(f"✗ Perceptual hash failed: {e}")
+            with self._lock:
+                self.stats_counters["hash_errors"] += 1
+            return None
+        finally:
+            with self._lock:
+                self.stats_counters["hash_s_total"] += time.perf_counter() - start
+
+    def get(self, namespace: str, hash_value: int) -> Optional[Tuple[Any, int]]:
+        """(result, distance) of the nearest live entry within max_distance, else None."""
+        now = time.time()
+        with self._lock:
+            self.stats_counters["lookups"] += 1
+            self._expire(now)
+            tree = self._trees.get(namespace)
+            for distance, entry_id in (tree.search(hash_value, self.max_distance) if tree else []):
+                entry = self._entries.get(entry_id)
+                if entry is None:
+                    continue
+                self.stats_counters["hits"] += 1
+                self.stats_counters["exact_hits"] += distance == 0
+                self.stats_counters["saved_s_total"] += entry["cost_s"]
+                return entry["result"], distance
+            self.stats_counters["misses"] += 1
+            return None
+
+    def put(self, namespace: str, hash_value: int, result: Any, cost_s: float = 0.0):
+        """Stores `result`; cost_s (the model call's latency) is credited to saved_s_total on each hit."""
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {"namespace": namespace, "hash": hash_value, "result": result,
+                                       "cost_s": cost_s, "created": time.time()}
+            self._trees.setdefault(namespace, BKTree()).add(hash_value, entry_id)
+            self.stats_counters["stored"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats_counters["evicted"] += 1
+            self._maybe_rebuild()
+
+    def _expire(self, now: float):
+        while self._entries:
+            entry_id, entry = next(iter(self._entries.items()))
+            if now - entry["created"] <= self.ttl_s:
+                break
+            del self._entries[entry_id]
+            self.stats_counters["evicted"] += 1
+        self._maybe_rebuild()
+
+    def _maybe_rebuild(self):
+        indexed = sum(tree.size for tree in self._trees.values())
+        if indexed <= 2 * len(self._entries) + 64:
+            return
+        self._trees = {}
+        for entry_id, entry in self._entries.items():
+            self._trees.setdefault(entry["namespace"], BKTree()).add(entry["hash"], entry_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats_counters)
+            stats["entries"] = len(self._entries)
+        hashed = stats["lookups"] + stats["hash_errors"]
+        stats["hash_ms_avg"] = round(1000 * stats["hash_s_total"] / hashed, 2) if hashed else None
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else None
+        stats.update(algorithm=self.algorithm, max_distance=self.max_distance)
+        return stats
+
+
+# ---------------------------------------------------------------------- benchmark
+
+def _encode(image: Image.Image, fmt: str = "JPEG", **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    image.save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def _crop(image: Image.Image, fraction: float) -> Image.Image:
+    dx, dy = int(image.width * fraction / 2), int(image.height * fraction / 2)
+    return image.crop((dx, dy, image.width - dx, image.height - dy))
+
+
+# What messaging apps and screenshots typically do to a forwarded photo
+VARIANTS: Dict[str, Callable[[Image.Image], bytes]] = {
+    "jpeg_q85": lambda im: _encode(im, quality=85),
+    "jpeg_q40": lambda im: _encode(im, quality=40),
+    "resize_50": lambda im: _encode(im.resize((im.width // 2, im.height // 2)), quality=80),
+    "resize_25": lambda im: _encode(im.resize((max(im.width // 4, 16), max(im.height // 4, 16))), quality=80),
+    "crop_5": lambda im: _encode(_crop(im, 0.05), quality=85),
+    "crop_10": lambda im: _encode(_crop(im, 0.10), quality=85),
+    "brightness_110": lambda im: _encode(ImageEnhance.Brightness(im.convert("RGB")).enhance(1.1), quality=85),
+    "webp_q60": lambda im: _encode(im.convert("RGB"), "WEBP", quality=60),
+}
+
+
+def benchmark(directory: str, model_latency_s: float = 2.5):
+    """
+    Each original is stored once, then every variant of every image is looked up.
+    A hit on the variant's own original is a true positive, a hit on any other
+    image a false positive. Saved time assumes each hit avoids one model call of
+    model_latency_s (the fake Groq median by default).
+    """
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp", ".gif")))
+    originals = {os.path.basename(path): open(path, "rb").read() for path in paths}
+    queries = []
+    for name, data in originals.items():
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        for variant, make in VARIANTS.items():
+            queries.append((name, variant, make(image)))
+    print(f"{len(originals)} originals, {len(queries)} variant queries, {len(originals) * (len(originals) - 1) // 2} "
+          f"cross-image pairs")
+
+    for algorithm in sorted(HASHERS):
+        start = time.perf_counter()
+        original_hashes = {name: HASHERS[algorithm](data) for name, data in originals.items()}
+        query_hashes = [(name, variant, HASHERS[algorithm](data)) for name, variant, data in queries]
+        hash_ms = 1000 * (time.perf_counter() - start) / (len(originals) + len(queries))
+        cross = [hamming(original_hashes[a], original_hashes[b])
+                 for a in original_hashes for b in original_hashes if a < b]
+        print(f"\n{algorithm}: {hash_ms:.1f} ms per image, min distance between different originals "
+              f"{min(cross) if cross else '-'}")
+        print(f"{'max_dist':>8} {'recall':>7} {'precision':>9} {'hits':>5} {'false':>5} {'saved_s':>8}")
+        for max_distance in (2, 4, 6, 8, 10, 12):
+            cache = NearDuplicateCache(algorithm, max_distance, ttl_s=float("inf"))
+            for name, hash_value in original_hashes.items():
+                cache.put("bench", hash_value, name, cost_s=model_latency_s)
+            true_hits = false_hits = 0
+            for name, variant, hash_value in query_hashes:
+                found = cache.get("bench", hash_value)
+                if found is None:
+                    continue
+                true_hits += found[0] == name
+                false_hits += found[0] != name
+            hits = true_hits + false_hits
+            print(f"{max_distance:>8} {true_hits / len(query_hashes):>7.2f} "
+                  f"{(true_hits / hits if hits else 1.0):>9.2f} {hits:>5} {false_hits:>5} "
+                  f"{cache.stats()['saved_s_total']:>8.1f}")
+        missed = {}
+        for name, variant, hash_value in query_hashes:
+            distance = hamming(hash_value, original_hashes[name])
+            if distance > IMAGE_DEDUP_MAX_DISTANCE:
+                missed.setdefault(variant, []).append(distance)
+        if missed:
+            print(f"variants beyond {IMAGE_DEDUP_MAX_DISTANCE}: "
+                  + ", ".join(f"{variant} {sorted(d)}" for variant, d in sorted(missed.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("benchmark", help="Near-duplicate precision/recall over generated variants")
+    bench.add_argument("directory")
+    bench.add_argument("--model-latency-s", type=float, default=2.5)
+    args = parser.parse_args()
+    benchmark(args.directory, args.model_latency_s)
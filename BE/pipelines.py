@@ -0,0 +1,221 @@
+# pipelines.py
+# Identification pipelines that work on an already loaded image, shared by the
+# API routes and the offline evaluation harness.
+#
+# Every external call goes through a ProviderRecorder so evaluation runs can be
+# recorded once and re-scored offline, and every stage appends its latency to
+# an optional `timings` dict ({stage: [seconds, ...]}).
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from provider_recorder import ProviderRecorder
+from reranker import get_reranker
+from species_catalogue import get_catalogue
+
+LLM_PROVIDERS = ("groq", "gemini", "watsonx")
+# Providers that can return the caption and the candidates from one call
+CAPTION_PROVIDERS = ("groq", "gemini")
+# Reference-photo kNN alone, and as a fast path in front of the LLM (image_knn.py)
+IMAGE_PIPELINES = ("image_knn", "image_knn_fast")
+PIPELINES = ("caption_knn",) + LLM_PROVIDERS + ("hybrid", "caption_identify") + IMAGE_PIPELINES
+
+# Shared by the pipelines for stages that can overlap (kNN next to the catalogue load)
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("PIPELINE_WORKERS", "8")))
+
+# Bump when a prompt changes so recordings made with the old prompt are not replayed
+PROMPT_VERSION = "v1"
+
+_PASSTHROUGH = ProviderRecorder(mode="off")
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def rank_from_candidates(ai_result: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Turns an LLM identification JSON into [{"fish_name", "score", "reason"}] sorted by score."""
+    if not ai_result or not ai_result.get("image_contains_fish", True):
+        return []
+    ranked = []
+    for candidate in ai_result.get("results") or []:
+        name = candidate.get("fish_name")
+        if not name:
+            continue
+        try:
+            score = float(candidate.get("score", 0.0))
+        except (TypeError, ValueError):
+            score = 0.0
+        ranked.append({"fish_name": name, "score": score, "reason": candidate.get("score_reason")})
+    ranked.sort(key=lambda c: c["score"], reverse=True)
+    return ranked
+
+
+def rank_from_hits(hits, n=5) -> List[Dict[str, Any]]:
+    """Turns an Elasticsearch kNN response into [{"fish_name", "scientific_name", "score"}]."""
+    if not hits:
+        return []
+    ranked = []
+    for hit in hits['hits']['hits'][:n]:
+        source = hit['_source']
+        ranked.append({
+            "fish_name": source.get('fish_name'),
+            "thai_fish_name": source.get('thai_fish_name'),
+            "scientific_name": source.get('scientific_name'),
+            "order_name": source.get('order_name'),
+            "score": hit['_score'],
+        })
+    return ranked
+
+
+def caption_image(pic_string: str, image_id: str, recorder: ProviderRecorder = _PASSTHROUGH, timings=None) -> str:
+    def caption():
+        # Imported lazily so replayed runs work without the provider SDKs and credentials
+        from watsonx_captioning import get_fish_description_from_watsonxai
+        return get_fish_description_from_watsonxai(pic_string)
+
+    return recorder.call("watsonx_caption", [image_id, PROMPT_VERSION], caption, timings, stage="caption")
+
+
+def knn_search(text: str, emb, esq, index_name: str, recorder: ProviderRecorder = _PASSTHROUGH,
+               timings=None, size=5) -> List[Dict[str, Any]]:
+    """Embeds `text` and returns the top `size` species from the physical description index."""
+    vector = recorder.call("embedding", [text_key(text)],
+                           lambda: [float(x) for x in emb.embed_text(text)], timings, stage="embed")
+
+    def search():
+        hits = esq.search_embedding(index_name=index_name, embedding_field='physical_description_embedding',
+                                    query_vector=vector, size=size)
+        return rank_from_hits(hits, n=size)
+
+    return recorder.call("es_knn", [index_name, size, text_key(text)], search, timings, stage="knn")
+
+
+def run_caption_knn(pic_string: str, image_id: str, emb, esq, index_name: str,
+                    recorder: ProviderRecorder = _PASSTHROUGH, timings=None, size=5) -> Dict[str, Any]:
+    caption = caption_image(pic_string, image_id, recorder, timings)
+    if not caption:
+        return {"caption": None, "ranked": []}
+    return {"caption": caption, "ranked": knn_search(caption, emb, esq, index_name, recorder, timings, size)}
+
+
+def identify_candidates(provider: str, pic_string: str, image_id: str, clients: Dict[str, Any],
+                        recorder: ProviderRecorder = _PASSTHROUGH, timings=None) -> Optional[Dict[str, Any]]:
+    """
+    Runs the species-prompt identification with one provider. `clients` holds
+    "groq" (Groq client), "gemini" (genai.Client) and "watsonx" (dict with
+    api_key, iam_url, project_id, chat_url).
+    """
+    if provider not in LLM_PROVIDERS:
+        raise ValueError(f"Unknown provider '{provider}', expected one of {LLM_PROVIDERS}")
+
+    def fn():
+        import fish_services
+        if provider == "groq":
+            return fish_services.identify_fish_candidates_groq(clients["groq"], pic_string)
+        if provider == "gemini":
+            return fish_services.identify_fish_candidates_gemini2(clients["gemini"], pic_string)
+        settings = clients["watsonx"]
+        token = fish_services.get_watsonx_token(settings["api_key"], settings["iam_url"])
+        if not token:
+            return None
+        return fish_services.identify_fish_candidates(pic_string, token, settings["project_id"], settings["chat_url"])
+
+    return recorder.call(f"{provider}_candidates", [image_id, PROMPT_VERSION], fn, timings, stage=f"{provider}_llm")
+
+
+def identify_and_caption(provider: str, pic_string: str, image_id: str, clients: Dict[str, Any],
+                         recorder: ProviderRecorder = _PASSTHROUGH, timings=None) -> Optional[Dict[str, Any]]:
+    """One vision call returning {"image_contains_fish", "caption", "rejection_reason", "results"}."""
+    if provider not in CAPTION_PROVIDERS:
+        raise ValueError(f"Unknown provider '{provider}', expected one of {CAPTION_PROVIDERS}")
+
+    def fn():
+        import fish_services
+        if provider == "groq":
+            return fish_services.identify_fish_candidates_groq(clients["groq"], pic_string, with_caption=True)
+        return fish_services.identify_fish_candidates_gemini2(clients["gemini"], pic_string, with_caption=True)
+
+    return recorder.call(f"{provider}_caption_candidates", [image_id, PROMPT_VERSION], fn, timings,
+                         stage=f"{provider}_llm")
+
+
+def species_records(esq, index_name: str, recorder: ProviderRecorder = _PASSTHROUGH,
+                    timings=None) -> Dict[str, Dict[str, Any]]:
+    """All species records of the index (normalized English name -> record) from the in-memory catalogue."""
+    return recorder.call("es_catalogue", [index_name], lambda: get_catalogue(esq, index_name).by_key("english"),
+                         timings, stage="catalogue")
+
+
+def run_caption_identify(provider: str, pic_string: str, image_id: str, emb, esq, index_name: str,
+                         clients: Dict[str, Any], recorder: ProviderRecorder = _PASSTHROUGH, timings=None,
+                         size=5) -> Dict[str, Any]:
+    """
+    Single vision call for caption + candidates. The caption kNN then runs in a
+    worker thread while the species catalogue is read, and both signals are
+    fused into one ranked list by the reranker.
+    """
+    ai_result = identify_and_caption(provider, pic_string, image_id, clients, recorder, timings)
+    if not ai_result or not ai_result.get("image_contains_fish", True):
+        return {"ai_result": ai_result, "caption": None, "llm_ranked": [], "knn_ranked": [], "ranked": []}
+
+    caption = ai_result.get("caption")
+    llm_ranked = rank_from_candidates(ai_result)
+    knn_future = _executor.submit(knn_search, caption, emb, esq, index_name, recorder, timings, size) if caption else None
+    catalogue = species_records(esq, index_name, recorder, timings)
+    knn_ranked = knn_future.result() if knn_future else []
+
+    ranked = get_reranker().rerank(llm_ranked, knn_ranked, catalogue)
+    return {"ai_result": ai_result, "caption": caption, "llm_ranked": llm_ranked, "knn_ranked": knn_ranked,
+            "ranked": ranked}
+
+
+def image_knn_decision(pic_string: str, image_id: str, classifier, recorder: ProviderRecorder = _PASSTHROUGH,
+                       timings=None, size=5) -> Dict[str, Any]:
+    """Reference-photo kNN for the image; the embedding is recorded, the index search is local."""
+    def embed():
+        import base64
+        return classifier.embed(base64.b64decode(pic_string))
+
+    vector = recorder.call("image_embedding", [image_id, classifier.index.model_name], embed, timings,
+                           stage="image_embed")
+    return classifier.decide(vector, size)
+
+
+def run_image_knn_fast(provider: str, pic_string: str, image_id: str, clients: Dict[str, Any],
+                       recorder: ProviderRecorder = _PASSTHROUGH, timings=None) -> Dict[str, Any]:
+    """kNN answer when its margin clears the calibrated threshold, otherwise the `provider` LLM."""
+    decision = image_knn_decision(pic_string, image_id, clients["image_knn"], recorder, timings)
+    if decision["confident"]:
+        return {"ranked": decision["ranked"], "knn_margin": decision["margin"], "fast_path": True}
+    ai_result = identify_candidates(provider, pic_string, image_id, clients, recorder, timings)
+    return {"ai_result": ai_result, "ranked": rank_from_candidates(ai_result), "knn_margin": decision["margin"],
+            "fast_path": False}
+
+
+def run_pipeline(name: str, pic_string: str, image_id: str, emb, esq, index_name: str, clients: Dict[str, Any],
+                 recorder: ProviderRecorder = _PASSTHROUGH, timings=None, hybrid_provider: str = "groq") -> Dict[str, Any]:
+    """Runs one named pipeline and returns {"ranked": [...], ...extra outputs}."""
+    if name == "caption_knn":
+        return run_caption_knn(pic_string, image_id, emb, esq, index_name, recorder, timings)
+    if name in LLM_PROVIDERS:
+        ai_result = identify_candidates(name, pic_string, image_id, clients, recorder, timings)
+        return {"ai_result": ai_result, "ranked": rank_from_candidates(ai_result)}
+    if name == "hybrid":
+        knn_future = _executor.submit(run_caption_knn, pic_string, image_id, emb, esq, index_name, recorder, timings)
+        ai_result = identify_candidates(hybrid_provider, pic_string, image_id, clients, recorder, timings)
+        llm_ranked = rank_from_candidates(ai_result)
+        knn = knn_future.result()
+        ranked = get_reranker().rerank(llm_ranked, knn["ranked"], species_records(esq, index_name, recorder, timings))
+        return {"caption": knn["caption"], "ai_result": ai_result, "llm_ranked": llm_ranked,
+                "knn_ranked": knn["ranked"], "ranked": ranked}
+    if name == "caption_identify":
+        provider = hybrid_provider if hybrid_provider in CAPTION_PROVIDERS else "groq"
+        return run_caption_identify(provider, pic_string, image_id, emb, esq, index_name, clients, recorder, timings)
+    if name == "image_knn":
+        decision = image_knn_decision(pic_string, image_id, clients["image_knn"], recorder, timings)
+        return {"ranked": decision["ranked"], "knn_margin": decision["margin"], "fast_path": decision["confident"]}
+    if name == "image_knn_fast":
+        return run_image_knn_fast(hybrid_provider, pic_string, image_id, clients, recorder, timings)
+    raise ValueError(f"Unknown pipeline '{name}', expected one of {PIPELINES}")
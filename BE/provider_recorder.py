@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+MODES = ("off", "record", "replay", "auto")
+
+
+class RecordingNotFound(KeyError):
+    """Raised in replay mode when a provider call was never recorded."""
+
+
+class ProviderRecorder:
+    """
+    Record/replay layer for external provider calls (vision LLMs, embedding
+    service, Elasticsearch, COS listings).
+
+    Every call is identified by (provider, key_parts). In "record" mode the real
+    call is made and its JSON-serialisable result is written to
+    <directory>/<provider>/<sha256>.json together with the observed latency.
+    "replay" only reads recordings (a missing one raises RecordingNotFound),
+    "auto" replays when a recording exists and records otherwise, and "off"
+    always calls the provider. Replayed calls report the recorded latency so
+    offline evaluation runs still produce realistic latency percentiles.
+    """
+
+    def __init__(self, directory: Optional[str] = None, mode: str = "off"):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        if mode != "off" and not directory:
+            raise ValueError("a recording directory is required unless mode is 'off'")
+        self.directory = directory
+        self.mode = mode
+        self.stats = {"live_calls": 0, "replayed_calls": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(provider: str, key_parts: Any) -> str:
+        payload = json.dumps([provider, key_parts], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, provider: str, key: str) -> str:
+        return os.path.join(self.directory, provider, f"{key}.json")
+
+    def call(self, provider: str, key_parts: Any, fn: Callable[[], Any],
+             timings: Optional[Dict[str, List[float]]] = None, stage: Optional[str] = None) -> Any:
+        stage = stage or provider
+        path = None
+        if self.mode != "off":
+            path = self._path(provider, self.make_key(provider, key_parts))
+            if self.mode in ("replay", "auto") and os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    recording = json.load(f)
+                self._observe(timings, stage, recording.get("latency_s", 0.0), replayed=True)
+                return recording["response"]
+            if self.mode == "replay":
+                raise RecordingNotFound(f"No recording for {provider} {key_parts!r}")
+
+        start = time.perf_counter()
+        response = fn()
+        latency = time.perf_counter() - start
+        self._observe(timings, stage, latency, replayed=False)
+
+        if path is not None and response is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "provider": provider,
+                    "key_parts": key_parts,
+                    "latency_s": latency,
+                    "recorded_at": time.time(),
+                    "response": response,
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        return response
+
+    def _observe(self, timings, stage, latency, replayed):
+        with self._lock:
+            self.stats["replayed_calls" if replayed else "live_calls"] += 1
+            if timings is not None:
+                timings.setdefault(stage, []).append(latency)
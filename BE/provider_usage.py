@@ -0,0 +1,66 @@
+# provider_usage.py
+# Process-wide token and latency counters for the vision/LLM providers, reported
+# by GET /metrics. Cached prompt tokens are tracked separately so the effect of
+# prefix caching (Groq) and explicit context caching (Gemini) on latency and
+# cost per identification can be checked.
+import threading
+from typing import Any, Dict, Optional
+
+_lock = threading.Lock()
+_usage: Dict[str, Dict[str, float]] = {}
+
+
+def record_usage(provider: str, prompt_tokens: Optional[int] = 0, cached_tokens: Optional[int] = 0,
+                 completion_tokens: Optional[int] = 0, latency_s: float = 0.0):
+    prompt_tokens, cached_tokens, completion_tokens = prompt_tokens or 0, cached_tokens or 0, completion_tokens or 0
+    with _lock:
+        stats = _usage.setdefault(provider, {
+            "calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+            "cache_hit_calls": 0, "latency_s_total": 0.0, "latency_s_cache_hit": 0.0,
+        })
+        stats["calls"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["cached_tokens"] += cached_tokens
+        stats["completion_tokens"] += completion_tokens
+        stats["latency_s_total"] += latency_s
+        if cached_tokens:
+            stats["cache_hit_calls"] += 1
+            stats["latency_s_cache_hit"] += latency_s
+
+
+def record_groq_usage(completion, latency_s: float, provider: str = "groq"):
+    """Reads usage (and usage.prompt_tokens_details.cached_tokens) from a Groq/OpenAI-style completion."""
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        record_usage(provider, latency_s=latency_s)
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    record_usage(provider, getattr(usage, "prompt_tokens", 0), getattr(details, "cached_tokens", 0) if details else 0,
+                 getattr(usage, "completion_tokens", 0), latency_s)
+
+
+def record_gemini_usage(response, latency_s: float, provider: str = "gemini"):
+    """Reads usage_metadata (including cached_content_token_count) from a Gemini response."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        record_usage(provider, latency_s=latency_s)
+        return
+    record_usage(provider, getattr(usage, "prompt_token_count", 0), getattr(usage, "cached_content_token_count", 0),
+                 getattr(usage, "candidates_token_count", 0), latency_s)
+
+
+def usage_stats() -> Dict[str, Any]:
+    with _lock:
+        snapshot = {provider: dict(stats) for provider, stats in _usage.items()}
+    for stats in snapshot.values():
+        calls, hits = stats["calls"], stats["cache_hit_calls"]
+        misses = calls - hits
+        stats["cached_token_ratio"] = round(stats["cached_tokens"] / stats["prompt_tokens"], 4) if stats["prompt_tokens"] else 0.0
+        stats["avg_latency_s"] = round(stats["latency_s_total"] / calls, 4) if calls else None
+        stats["avg_latency_s_cache_hit"] = round(stats["latency_s_cache_hit"] / hits, 4) if hits else None
+        stats["avg_latency_s_cache_miss"] = (round((stats["latency_s_total"] - stats["latency_s_cache_hit"]) / misses, 4)
+                                             if misses else None)
+        stats["avg_prompt_tokens"] = round(stats["prompt_tokens"] / calls, 1) if calls else None
+        for key in ("latency_s_total", "latency_s_cache_hit"):
+            stats[key] = round(stats[key], 4)
+    return snapshot
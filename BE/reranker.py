@@ -0,0 +1,299 @@
+"""
+Re-ranking of fish candidates from two signals: the vision LLM's self-reported
+candidate scores and the caption kNN similarity from Elasticsearch.
+
+Both candidate lists are merged into one feature matrix (one row per species)
+and scored with NumPy in one pass:
+
+    weighted  w * llm + (1 - w) * knn, both normalised (RERANK_LLM_WEIGHT)
+    rrf       reciprocal rank fusion, sum of 1 / (k + rank) (RERANK_RRF_K)
+    logistic  sigmoid(features @ coef + intercept), fit offline on the
+              evaluation harness candidates.csv (RERANK_WEIGHTS_PATH)
+
+Fit and compare the methods on a harness run:
+
+    python reranker.py fit --candidates eval_output/candidates.csv --output reranker_weights.json
+    python reranker.py compare --candidates eval_output/candidates.csv
+"""
+import argparse
+import csv
+import json
+import os
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from species_catalogue import normalize_name as species_key
+
+FUSION_METHODS = ("weighted", "rrf", "logistic")
+NORMALIZATIONS = ("minmax", "max", "none")
+FEATURE_NAMES = ("llm_score", "knn_score", "knn_norm", "llm_rrank", "knn_rrank", "in_both")
+
+RERANK_METHOD = os.getenv("RERANK_METHOD", "weighted")
+RERANK_LLM_WEIGHT = float(os.getenv("RERANK_LLM_WEIGHT", "0.7"))
+RERANK_RRF_K = int(os.getenv("RERANK_RRF_K", "60"))
+RERANK_LLM_NORMALIZATION = os.getenv("RERANK_LLM_NORMALIZATION", "none")
+RERANK_KNN_NORMALIZATION = os.getenv("RERANK_KNN_NORMALIZATION", "minmax")
+RERANK_WEIGHTS_PATH = os.getenv("RERANK_WEIGHTS_PATH",
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "reranker_weights.json"))
+
+RECORD_FIELDS = ("thai_fish_name", "scientific_name", "order_name")
+
+
+def es_cosine(scores: np.ndarray) -> np.ndarray:
+    """ES reports cosine similarity as (1 + cos) / 2, map it back to cos in [0, 1]."""
+    return np.clip(2.0 * scores - 1.0, 0.0, 1.0)
+
+
+def normalize(values: np.ndarray, present: np.ndarray, method: str) -> np.ndarray:
+    """Normalises the present entries of `values`, missing entries become 0."""
+    if method not in NORMALIZATIONS:
+        raise ValueError(f"normalization must be one of {NORMALIZATIONS}")
+    out = np.where(present, values, 0.0)
+    if method == "none" or not present.any():
+        return out
+    observed = values[present]
+    if method == "max":
+        top = observed.max()
+        return np.where(present, values / top, 0.0) if top > 0 else out
+    low, high = observed.min(), observed.max()
+    if high - low < 1e-12:
+        return present.astype(float)
+    return np.where(present, (values - low) / (high - low), 0.0)
+
+
+def candidate_features(llm_ranked: List[Dict[str, Any]], knn_ranked: List[Dict[str, Any]],
+                       llm_normalization: str = RERANK_LLM_NORMALIZATION,
+                       knn_normalization: str = RERANK_KNN_NORMALIZATION):
+    """
+    Merges both ranked lists on species name. Returns (names, features) where
+    features maps every FEATURE_NAMES entry (plus the raw ranks and presence
+    masks) to an array with one value per species.
+    """
+    index: Dict[str, int] = {}
+    names: List[str] = []
+    for candidate in list(llm_ranked) + list(knn_ranked):
+        key = species_key(candidate.get("fish_name"))
+        if key and key not in index:
+            index[key] = len(names)
+            names.append(candidate["fish_name"])
+
+    n = len(names)
+    llm_raw, knn_raw = np.zeros(n), np.zeros(n)
+    llm_rank, knn_rank = np.full(n, np.inf), np.full(n, np.inf)
+    for ranked, raw, rank in ((llm_ranked, llm_raw, llm_rank), (knn_ranked, knn_raw, knn_rank)):
+        for position, candidate in enumerate(ranked, start=1):
+            i = index.get(species_key(candidate.get("fish_name")))
+            if i is None or np.isfinite(rank[i]):
+                continue
+            rank[i] = position
+            raw[i] = float(candidate.get("score") or 0.0)
+
+    in_llm, in_knn = np.isfinite(llm_rank), np.isfinite(knn_rank)
+    llm_score = normalize(np.clip(llm_raw, 0.0, 1.0), in_llm, llm_normalization)
+    knn_cos = es_cosine(knn_raw)
+    features = {
+        "llm_score": llm_score,
+        "knn_score": np.where(in_knn, knn_cos, 0.0),
+        "knn_norm": normalize(knn_cos, in_knn, knn_normalization),
+        "llm_rrank": np.where(in_llm, 1.0 / llm_rank, 0.0),
+        "knn_rrank": np.where(in_knn, 1.0 / knn_rank, 0.0),
+        "in_both": (in_llm & in_knn).astype(float),
+        "llm_rank": llm_rank,
+        "knn_rank": knn_rank,
+        "in_llm": in_llm,
+        "in_knn": in_knn,
+    }
+    return names, features
+
+
+def feature_matrix(features: Dict[str, np.ndarray]) -> np.ndarray:
+    return np.column_stack([features[name] for name in FEATURE_NAMES])
+
+
+def sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+def load_logistic_weights(path: str = RERANK_WEIGHTS_PATH) -> Optional[Dict[str, Any]]:
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        weights = json.load(f)
+    if list(weights.get("features", [])) != list(FEATURE_NAMES):
+        print(f"⚠️ Ignoring {path}: fitted on features {weights.get('features')}, expected {list(FEATURE_NAMES)}")
+        return None
+    return weights
+
+
+class Reranker:
+    """Scores merged LLM + kNN candidates with one of FUSION_METHODS."""
+
+    def __init__(self, method: str = RERANK_METHOD, llm_weight: float = RERANK_LLM_WEIGHT,
+                 rrf_k: int = RERANK_RRF_K, weights: Optional[Dict[str, Any]] = None):
+        if method not in FUSION_METHODS:
+            raise ValueError(f"method must be one of {FUSION_METHODS}")
+        if method == "logistic":
+            weights = weights or load_logistic_weights()
+            if weights is None:
+                print(f"⚠️ No logistic weights at {RERANK_WEIGHTS_PATH}, falling back to weighted fusion")
+                method = "weighted"
+        self.method = method
+        self.llm_weight = llm_weight
+        self.rrf_k = rrf_k
+        self.weights = weights
+
+    def score(self, features: Dict[str, np.ndarray]) -> np.ndarray:
+        if self.method == "weighted":
+            return self.llm_weight * features["llm_score"] + (1.0 - self.llm_weight) * features["knn_norm"]
+        if self.method == "rrf":
+            # 1 / (k + inf) is 0 for a list the species is missing from
+            return 1.0 / (self.rrf_k + features["llm_rank"]) + 1.0 / (self.rrf_k + features["knn_rank"])
+        coef = np.asarray(self.weights["coef"], dtype=float)
+        return sigmoid(feature_matrix(features) @ coef + float(self.weights["intercept"]))
+
+    def rerank(self, llm_ranked: List[Dict[str, Any]], knn_ranked: List[Dict[str, Any]],
+               catalogue: Optional[Dict[str, Dict[str, Any]]] = None, top_n: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Fused ranking as [{"fish_name", "score", "llm_score", "knn_score", ...species record fields}].
+        Records come from `catalogue` (normalized English name -> record, see
+        SpeciesCatalogue.by_key), falling back to the kNN hit itself.
+        """
+        names, features = candidate_features(llm_ranked, knn_ranked)
+        if not names:
+            return []
+        scores = self.score(features)
+        order = np.argsort(-scores, kind="stable")[:top_n]
+        knn_by_key = {species_key(c.get("fish_name")): c for c in knn_ranked}
+        catalogue = catalogue or {}
+        ranked = []
+        for i in order:
+            key = species_key(names[i])
+            record = catalogue.get(key) or knn_by_key.get(key) or {}
+            item = {
+                "fish_name": names[i],
+                "score": round(float(scores[i]), 6),
+                "llm_score": round(float(features["llm_score"][i]), 6),
+                "knn_score": round(float(features["knn_score"][i]), 6),
+            }
+            for field in RECORD_FIELDS:
+                item[field] = record.get(field)
+            ranked.append(item)
+        return ranked
+
+
+_default_reranker = None
+_default_lock = threading.Lock()
+
+
+def get_reranker() -> Reranker:
+    """Process-wide Reranker configured from the RERANK_* environment variables."""
+    global _default_reranker
+    with _default_lock:
+        if _default_reranker is None:
+            _default_reranker = Reranker()
+        return _default_reranker
+
+
+# ----------------------------------------------------------- offline fitting
+
+CANDIDATE_COLUMNS = ("pipeline", "image", "expected", "fish_name") + FEATURE_NAMES + ("llm_rank", "knn_rank", "label")
+
+
+def candidate_rows(pipeline, image_id, expected, llm_ranked, knn_ranked) -> List[Dict[str, Any]]:
+    """Rows for the harness candidates.csv: one per merged candidate, label 1 for the expected species."""
+    names, features = candidate_features(llm_ranked, knn_ranked)
+    expected_key = species_key(expected)
+    rows = []
+    for i, name in enumerate(names):
+        row = {"pipeline": pipeline, "image": image_id, "expected": expected, "fish_name": name}
+        for feature in FEATURE_NAMES:
+            row[feature] = round(float(features[feature][i]), 6)
+        for rank in ("llm_rank", "knn_rank"):
+            row[rank] = int(features[rank][i]) if np.isfinite(features[rank][i]) else ""
+        row["label"] = int(species_key(name) == expected_key)
+        rows.append(row)
+    return rows
+
+
+def read_candidates(path: str, pipeline: Optional[str] = None):
+    """Returns (groups, X, y) where groups holds the row indices of each image."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rows = [r for r in csv.DictReader(f) if not pipeline or r["pipeline"] == pipeline]
+    X = np.array([[float(r[name]) for name in FEATURE_NAMES] for r in rows], dtype=float).reshape(-1, len(FEATURE_NAMES))
+    y = np.array([int(r["label"]) for r in rows], dtype=float)
+    groups = defaultdict(list)
+    for i, r in enumerate(rows):
+        groups[(r["pipeline"], r["image"])].append(i)
+    return rows, list(groups.values()), X, y
+
+
+def fit_logistic(X: np.ndarray, y: np.ndarray, l2: float = 1e-2, lr: float = 0.5, epochs: int = 3000):
+    """L2-regularised logistic regression by full-batch gradient descent. Returns (coef, intercept)."""
+    coef = np.zeros(X.shape[1])
+    intercept = 0.0
+    # Positives are ~1 in 5-10 candidates, weight them so the model does not predict all zeros
+    pos = y.sum()
+    sample_weight = np.where(y == 1, (len(y) - pos) / max(pos, 1.0), 1.0)
+    sample_weight /= sample_weight.mean()
+    for _ in range(epochs):
+        error = (sigmoid(X @ coef + intercept) - y) * sample_weight
+        coef -= lr * (X.T @ error / len(y) + l2 * coef)
+        intercept -= lr * error.mean()
+    return coef, intercept
+
+
+def top1_accuracy(scores: np.ndarray, y: np.ndarray, groups) -> float:
+    """Share of images whose highest scored candidate is the expected species (images without it count as misses)."""
+    if not groups:
+        return 0.0
+    hits = sum(y[g][int(np.argmax(scores[g]))] == 1 for g in groups)
+    return hits / len(groups)
+
+
+def _features_from_rows(rows, idx):
+    features = {name: np.array([float(rows[i][name]) for i in idx]) for name in FEATURE_NAMES}
+    for rank in ("llm_rank", "knn_rank"):
+        features[rank] = np.array([float(rows[i][rank]) if rows[i][rank] != "" else np.inf for i in idx])
+    return features
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("fit", "compare"))
+    parser.add_argument("--candidates", default="eval_output/candidates.csv")
+    parser.add_argument("--pipeline", default=None, help="only use rows of this pipeline")
+    parser.add_argument("--output", default=RERANK_WEIGHTS_PATH)
+    parser.add_argument("--l2", type=float, default=1e-2)
+    args = parser.parse_args()
+
+    rows, groups, X, y = read_candidates(args.candidates, args.pipeline)
+    print(f"{len(rows)} candidates over {len(groups)} images, {int(y.sum())} positives")
+
+    if args.command == "fit":
+        coef, intercept = fit_logistic(X, y, l2=args.l2)
+        weights = {"features": list(FEATURE_NAMES), "coef": [round(float(c), 6) for c in coef],
+                   "intercept": round(float(intercept), 6), "fitted_on": args.candidates,
+                   "n_candidates": len(rows), "n_images": len(groups)}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(weights, f, indent=2)
+        print(f"Weights written to {args.output}: {dict(zip(FEATURE_NAMES, weights['coef']))}")
+        return
+
+    rerankers = {"weighted": Reranker("weighted"), "rrf": Reranker("rrf")}
+    weights = load_logistic_weights(args.output)
+    if weights:
+        rerankers["logistic"] = Reranker("logistic", weights=weights)
+    for name, reranker in rerankers.items():
+        scores = np.zeros(len(rows))
+        for g in groups:
+            scores[g] = reranker.score(_features_from_rows(rows, g))
+        print(f"{name:<9} top-1 {top1_accuracy(scores, y, groups):.4f}")
+    print(f"{'llm only':<9} top-1 {top1_accuracy(X[:, 0] + 1e-6 * X[:, 3], y, groups):.4f}")
+    print(f"{'knn only':<9} top-1 {top1_accuracy(X[:, 1], y, groups):.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Decides whether /generation needs a fresh species retrieval for a question.
+
+get_generated_response embeds the question and runs two kNN searches. A
+follow-up such as "what does it eat?" has no fish features to match, so that
+returns noise. The router picks one of:
+
+    retrieve  the question names a species or describes one: embed it as is
+    reuse     a follow-up: the references retrieved for the previous question
+    rewrite   a follow-up with nothing to reuse (e.g. another worker answered the
+              previous turn): embed it together with the species named in the
+              recent history, or the previous question
+    skip      greetings/thanks: no retrieval, the model answers from the history
+
+Keyword heuristics decide the clear cases. Ambiguous questions go to an
+optional small classifier model (RETRIEVAL_ROUTER_MODEL) and are retrieved as
+before when none is configured. Retrieved references are kept per
+conversation, keyed like the chat summaries (chat_history.prefix_hashes), so
+clients send nothing new.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from chat_history import Message, clean_history, prefix_hashes
+from species_catalogue import NAME_FIELDS, normalize_name
+
+RETRIEVAL_ROUTER = os.getenv("RETRIEVAL_ROUTER", "1") == "1"
+RETRIEVAL_ROUTER_MODEL = os.getenv("RETRIEVAL_ROUTER_MODEL", "")
+RETRIEVAL_ROUTER_CACHE_SIZE = int(os.getenv("RETRIEVAL_ROUTER_CACHE_SIZE", "5000"))
+# One question embedding plus the physical and general kNN searches
+RETRIEVAL_CALLS = 3
+FOLLOW_UP_MAX_WORDS = 4
+
+_WORD = re.compile(r"[a-z']+")
+FOLLOW_UP_WORDS = {"it", "its", "it's", "this", "that", "they", "them", "their", "these", "those", "he", "she",
+                   "him", "her", "one", "same", "also"}
+FOLLOW_UP_THAI = ("มัน", "ตัวนี้", "ตัวนั้น", "ชนิดนี้", "ชนิดนั้น", "ปลานี้", "ปลานั้น", "พวกนี้", "เหมือนกัน")
+FEATURE_WORDS = {"orange", "yellow", "red", "blue", "green", "black", "white", "silver", "brown", "grey", "gray",
+                 "purple", "pink", "gold", "golden", "striped", "stripe", "stripes", "spot", "spots", "spotted",
+                 "band", "bands", "banded", "fin", "fins", "tail", "scales", "scale", "body", "snout", "teeth",
+                 "mouth", "spine", "spines", "flat", "elongated", "round", "long", "whiskers", "barbels", "pattern"}
+FEATURE_THAI = ("สี", "ลาย", "จุด", "ครีบ", "หาง", "เกล็ด", "ลำตัว", "ปาก", "ฟัน", "หนาม")
+# Species name words that say nothing about which fish is meant
+GENERIC_NAME_WORDS = {"fish", "common", "giant", "great", "lesser", "greater", "false", "true", "spotted", "striped",
+                      "banded", "blue", "yellow", "black", "white", "red", "orange", "green", "silver", "brown",
+                      "golden", "the", "and", "of", "s"} | FEATURE_WORDS
+SMALL_TALK = re.compile(r"^\s*(hi|hello|hey|thanks|thank you|thx|ok|okay|cool|great|nice|bye|good ?bye|"
+                        r"สวัสดี|ขอบคุณ|โอเค|ขอบใจ)\b", re.IGNORECASE)
+
+CLASSIFIER_PROMPT = (
+    "Classify the user's last message in a chat about fish. Answer with one word: "
+    "'new' if it asks about a different fish or describes one, 'followup' if it continues with the fish "
+    "already discussed, 'offtopic' if it needs no fish information (greeting, thanks, unrelated)."
+)
+
+
+@dataclass
+class RouteDecision:
+    action: str
+    query: Optional[str] = None
+    reason: str = ""
+    references: Any = None
+    species: Optional[List[str]] = None
+
+
+def _has_any(text: str, words: set, thai: Sequence[str]) -> bool:
+    return bool(words.intersection(_WORD.findall(text.lower()))) or any(marker in text for marker in thai)
+
+
+def is_follow_up(question: str) -> bool:
+    words = _WORD.findall(question.lower())
+    thai_only = not words
+    return (_has_any(question, FOLLOW_UP_WORDS, FOLLOW_UP_THAI)
+            or (not thai_only and len(words) <= FOLLOW_UP_MAX_WORDS))
+
+
+def has_fish_features(question: str) -> bool:
+    return _has_any(question, FEATURE_WORDS, FEATURE_THAI)
+
+
+def is_small_talk(question: str) -> bool:
+    return bool(SMALL_TALK.match(question)) and len(question.split()) <= 6 and "?" not in question
+
+
+class RetrievalRouter:
+    """Routes /generation questions; remembers each conversation's last references (in memory, per process)."""
+
+    def __init__(self, catalogue_fn: Callable[[], Any], classifier: Optional[Callable[[str, List[Message]], str]] = None,
+                 max_entries: int = RETRIEVAL_ROUTER_CACHE_SIZE):
+        self.catalogue_fn = catalogue_fn
+        self.classifier = classifier
+        self.max_entries = max_entries
+        self.stats_counters = {"retrieve": 0, "reuse": 0, "rewrite": 0, "skip": 0, "retrieval_calls_saved": 0,
+                               "classifier_calls": 0, "classifier_failures": 0}
+        self._references: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def species_in(self, text: str) -> List[str]:
+        """English names of the catalogue species mentioned in `text` (any name kind)."""
+        normalized = f" {normalize_name(text)} "
+        found = []
+        catalogue = self.catalogue_fn()
+        for kind in NAME_FIELDS:
+            for name, record in catalogue.by_key(kind).items():
+                if not name:
+                    continue
+                hit = name in normalized if kind == "thai" else f" {name} " in normalized
+                if hit and record["fish_name"] not in found:
+                    found.append(record["fish_name"])
+        return found
+
+    def mentions_fish_word(self, text: str) -> bool:
+        """True when `text` uses a word of an English species name ("grouper", "stingray"), even a species we lack."""
+        words = set(_WORD.findall(text.lower()))
+        return any(words.intersection(_WORD.findall(name)) - GENERIC_NAME_WORDS
+                   for name in self.catalogue_fn().by_key("english"))
+
+    def _previous_references(self, history: List[Message]):
+        last_user = max((i for i, m in enumerate(history) if m["role"] == "user"), default=None)
+        if last_user is None:
+            return None
+        key = prefix_hashes(history[:last_user + 1])[-1]
+        with self._lock:
+            if key in self._references:
+                self._references.move_to_end(key)
+                return self._references[key]
+        return None
+
+    def _classify(self, question: str, history: List[Message]) -> Optional[str]:
+        if self.classifier is None:
+            return None
+        with self._lock:
+            self.stats_counters["classifier_calls"] += 1
+        try:
+            label = self.classifier(question, history[-4:]).strip().lower()
+            return next((l for l in ("followup", "offtopic", "new") if l in label), None)
+        except Exception as e:
+            print(f"✗ Retrieval router classifier failed: {e}")
+            with self._lock:
+                self.stats_counters["classifier_failures"] += 1
+            return None
+
+    def _decide(self, question: str, history: List[Message]) -> RouteDecision:
+        species = self.species_in(question)
+        if species:
+            return RouteDecision("retrieve", question, "names a species", species=species)
+        if has_fish_features(question):
+            return RouteDecision("retrieve", question, "describes fish features")
+        if self.mentions_fish_word(question):
+            return RouteDecision("retrieve", question, "mentions a kind of fish")
+        if is_small_talk(question):
+            return RouteDecision("skip", reason="small talk", references=self._previous_references(history))
+        if not history:
+            return RouteDecision("retrieve", question, "first question")
+
+        label = "followup" if is_follow_up(question) else self._classify(question, history)
+        if label == "offtopic":
+            return RouteDecision("skip", reason="classifier: off topic", references=self._previous_references(history))
+        if label != "followup":
+            return RouteDecision("retrieve", question, f"classifier: {label}" if label else "not a follow-up")
+
+        previous = self._previous_references(history)
+        if previous is not None:
+            return RouteDecision("reuse", reason="follow-up", references=previous)
+        recent = " ".join(m["content"] for m in history[-4:])
+        species = self.species_in(recent)
+        if species:
+            return RouteDecision("rewrite", f"{', '.join(species[:3])}: {question}", "follow-up, species from history",
+                                 species=species[:3])
+        previous_question = next((m["content"] for m in reversed(history) if m["role"] == "user"), "")
+        return RouteDecision("rewrite", f"{previous_question} {question}".strip(), "follow-up, previous question")
+
+    def route(self, question: str, chat_history: Optional[Sequence[Message]]) -> RouteDecision:
+        decision = self._decide(question, clean_history(chat_history))
+        saved = RETRIEVAL_CALLS if decision.action in ("reuse", "skip") else 0
+        with self._lock:
+            self.stats_counters[decision.action] += 1
+            self.stats_counters["retrieval_calls_saved"] += saved
+        detail = f" query={decision.query!r}" if decision.action == "rewrite" else ""
+        print(f"🔀 Retrieval router: {decision.action} ({decision.reason}){detail}, {saved} retrieval calls saved")
+        return decision
+
+    def remember(self, chat_history: Optional[Sequence[Message]], question: str, references: Any):
+        """Keeps the references used for `question` for the next turn of the same conversation."""
+        if references is None:
+            return
+        history = clean_history(list(chat_history or []) + [{"role": "user", "content": question}])
+        key = prefix_hashes(history)[-1]
+        with self._lock:
+            self._references[key] = references
+            self._references.move_to_end(key)
+            while len(self._references) > self.max_entries:
+                self._references.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            decisions = sum(self.stats_counters[a] for a in ("retrieve", "reuse", "rewrite", "skip"))
+            retrieved = self.stats_counters["retrieve"] + self.stats_counters["rewrite"]
+            return {**self.stats_counters, "conversations_cached": len(self._references),
+                    "retrieval_rate": round(retrieved / decisions, 3) if decisions else None}
@@ -0,0 +1,106 @@
+"""
+Compares the development server (`python api_services.py`) with the gunicorn
+entry point (`gunicorn -c gunicorn_conf.py api_services:app`) under the same
+closed-loop load from load_generator.py.
+
+Each server is started in turn against the local fakes (FISH_FAKE_BACKENDS=1),
+so the numbers reflect the serving stack and not the providers; only the
+packages from requirements.txt are needed, no Elasticsearch. Extra
+environment (fake latencies, GUNICORN_*) is passed through:
+
+    FAKE_LATENCY_GROQ=lognormal:2500:0.4 python serve_benchmark.py --routes live,search,search_possible_fish
+"""
+import argparse
+import csv
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import requests
+
+from load_generator import DEFAULT_IMAGES, ROUTES, run_level, summarize
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SERVERS = {
+    "flask_dev": [sys.executable, "api_services.py"],
+    "gunicorn": [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "api_services:app"],
+}
+
+
+def start_server(name, port, startup_timeout=60.0):
+    env = {**os.environ, "FISH_FAKE_BACKENDS": "1", "PORT": str(port)}
+    proc = subprocess.Popen(SERVERS[name], cwd=BASE_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{name} exited with code {proc.returncode}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/live", timeout=1).status_code == 200:
+                return proc
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    stop_server(proc)
+    raise RuntimeError(f"{name} did not answer /live within {startup_timeout}s")
+
+
+def stop_server(proc, timeout=35.0):
+    """SIGTERM (graceful for gunicorn) and the time it took to exit."""
+    start = time.time()
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", default="flask_dev,gunicorn", help=f"comma separated, any of {','.join(SERVERS)}")
+    parser.add_argument("--routes", default="live,search,search_possible_fish")
+    parser.add_argument("--concurrency", default="1,16,64")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per level")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", default="serve_benchmark.csv")
+    args = parser.parse_args()
+
+    servers = [s.strip() for s in args.servers.split(",") if s.strip()]
+    routes = [r.strip() for r in args.routes.split(",") if r.strip()]
+    unknown = [s for s in servers if s not in SERVERS] + [r for r in routes if r not in ROUTES]
+    if unknown:
+        parser.error(f"unknown servers/routes {unknown}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    rows = []
+    print(f"{'server':<10} {'route':<22} {'conc':>5} {'reqs':>6} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    for server in servers:
+        proc = start_server(server, args.port)
+        try:
+            for route in routes:
+                for concurrency in levels:
+                    samples, elapsed = run_level(base_url, route, concurrency, args.duration, DEFAULT_IMAGES,
+                                                 args.timeout)
+                    row = {"server": server, **summarize(route, concurrency, samples, elapsed)}
+                    rows.append(row)
+                    print(f"{server:<10} {route:<22} {concurrency:>5} {row['requests']:>6} {row['errors']:>5} "
+                          f"{row['throughput_rps']:>8} {row['p50_ms'] or '-':>9} {row['p99_ms'] or '-':>9}")
+        finally:
+            print(f"{server} stopped in {stop_server(proc):.1f}s")
+
+    with open(args.output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Single-flight de-duplication of identical in-flight calls.
+
+While a call for a key is running, further callers with the same key wait for
+it and get the same result (or exception) instead of starting their own
+upstream request. Nothing is cached: once the call returns, the next caller
+runs it again. Only concurrent duplicates (double taps, client retries,
+parallel identical searches) are coalesced within one process.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent do(key, fn) calls per key. Results are shared, so treat them as read-only."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stats_counters = {"calls": 0, "executed": 0, "coalesced": 0}
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Returns (result, shared); shared is True when another caller's in-flight call was reused."""
+        with self._lock:
+            self.stats_counters["calls"] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.stats_counters["coalesced"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.stats_counters["executed"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.stats_counters["calls"]
+            return {
+                **self.stats_counters,
+                "in_flight": len(self._calls),
+                "coalesced_rate": round(self.stats_counters["coalesced"] / calls, 4) if calls else None,
+            }
+
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(name: str) -> SingleFlight:
+    """Process-wide SingleFlight per name (e.g. "identify", "embedding")."""
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = _groups[name] = SingleFlight(name)
+        return group
+
+
+def single_flight_stats() -> Dict[str, Dict[str, Any]]:
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
@@ -0,0 +1,238 @@
+"""
+In-memory species catalogue.
+
+The species index holds ~91 rarely changing documents, so they are loaded once
+(from Elasticsearch, or the species CSV when no ES client is given) and served
+from dictionaries keyed by normalised scientific, English and Thai name. A small
+character-trigram index backs fuzzy lookups for typos and partial names.
+
+A background thread polls the index version (document count plus indexing
+counters) every CATALOGUE_CHECK_INTERVAL_S seconds and reloads the catalogue
+when it changes, so lookups themselves never touch ES.
+"""
+import csv
+import difflib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SPECIES_CSV = os.path.join(BASE_DIR, "..", "EXTRACTION", "DATA", "fish-description-files",
+                                   "Marine_Fish_Species_Formatted_updated.csv")
+
+CATALOGUE_CHECK_INTERVAL_S = float(os.getenv("CATALOGUE_CHECK_INTERVAL_S", "60"))
+CATALOGUE_FUZZY_CUTOFF = float(os.getenv("CATALOGUE_FUZZY_CUTOFF", "0.75"))
+
+NAME_FIELDS = {"scientific": "scientific_name", "english": "fish_name", "thai": "thai_fish_name"}
+RECORD_FIELDS = ("fish_name", "thai_fish_name", "scientific_name", "order_name", "general_description",
+                 "physical_description", "habitat", "avg_length_cm", "avg_age_years", "avg_depthlevel_m",
+                 "avg_weight_kg")
+# Fields copied onto LLM candidates by enrich()
+ENRICH_FIELDS = ("thai_fish_name", "scientific_name", "order_name")
+
+_PUNCTUATION = re.compile(r"[-_.,'\"()/]+")
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Case, width, punctuation and whitespace insensitive form of a species name."""
+    name = unicodedata.normalize("NFKC", name or "")
+    return " ".join(_PUNCTUATION.sub(" ", name).split()).lower()
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def load_species_csv(csv_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Reads the species CSV into ES-style documents (without embeddings)."""
+    csv_path = csv_path or os.getenv("SPECIES_CSV", DEFAULT_SPECIES_CSV)
+    docs = []
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            if not row.get("Fish Name"):
+                continue
+            docs.append({
+                "fish_name": row["Fish Name"],
+                "thai_fish_name": row.get("Thai Fish Name", ""),
+                "scientific_name": row.get("Scientific Name", ""),
+                "order_name": row.get("Order Name", ""),
+                "general_description": row.get("General Description", ""),
+                "physical_description": row.get("Physical Description", ""),
+                "habitat": row.get("habitat", ""),
+                "avg_length_cm": row.get("Avg Length(cm)"),
+                "avg_age_years": row.get("Avg Age(years)"),
+                "avg_depthlevel_m": row.get("Avg DepthLevel(m)"),
+                "avg_weight_kg": row.get("Avg Weight(kg)"),
+            })
+    return docs
+
+
+class SpeciesCatalogue:
+    """Exact and fuzzy species lookups over an in-memory copy of the index."""
+
+    def __init__(self, esq=None, index_name: Optional[str] = None, csv_path: Optional[str] = None,
+                 check_interval_s: float = CATALOGUE_CHECK_INTERVAL_S):
+        self.esq = esq
+        self.index_name = index_name
+        self.csv_path = csv_path
+        self.check_interval_s = check_interval_s
+        self.version = None
+        self.loaded_at = None
+        self.stats = {"loads": 0, "exact_hits": 0, "fuzzy_hits": 0, "misses": 0}
+        self._records: List[Dict[str, Any]] = []
+        self._exact: Dict[str, Dict[str, Dict[str, Any]]] = {kind: {} for kind in NAME_FIELDS}
+        self._trigrams: Dict[str, Dict[str, set]] = {kind: defaultdict(set) for kind in NAME_FIELDS}
+        self._load_lock = threading.Lock()
+        self._refresher_pid = None
+        self.load()
+
+    # ------------------------------------------------------------------ loading
+
+    def _fetch(self) -> List[Dict[str, Any]]:
+        if self.esq is None:
+            return load_species_csv(self.csv_path)
+        docs = self.esq.search_all(index_name=self.index_name, exclude_fields=["*_embedding"])
+        if docs is None:
+            raise RuntimeError(f"could not read species from index {self.index_name}")
+        return docs
+
+    def _fetch_version(self):
+        if self.esq is None:
+            path = self.csv_path or os.getenv("SPECIES_CSV", DEFAULT_SPECIES_CSV)
+            return os.path.getmtime(path)
+        return self.esq.index_version(self.index_name)
+
+    def load(self):
+        """(Re)builds every index from the source. Readers keep using the old copy until the swap."""
+        with self._load_lock:
+            version = self._fetch_version()
+            docs = self._fetch()
+            exact = {kind: {} for kind in NAME_FIELDS}
+            grams = {kind: defaultdict(set) for kind in NAME_FIELDS}
+            records = []
+            for doc in docs:
+                record = {field: doc.get(field) for field in RECORD_FIELDS}
+                records.append(record)
+                for kind, field in NAME_FIELDS.items():
+                    key = normalize_name(record.get(field))
+                    if not key:
+                        continue
+                    exact[kind].setdefault(key, record)
+                    for gram in trigrams(key):
+                        grams[kind][gram].add(key)
+            self._records, self._exact, self._trigrams = records, exact, grams
+            self.version = version
+            self.loaded_at = time.time()
+            self.stats["loads"] += 1
+            print(f"📚 Species catalogue loaded: {len(records)} species (version {version})")
+
+    def refresh_if_changed(self) -> bool:
+        """Reloads when the index version changed. Returns True when a reload happened."""
+        try:
+            version = self._fetch_version()
+        except Exception as e:
+            print(f"✗ Catalogue version check failed: {e}")
+            return False
+        if version is None or version == self.version:
+            return False
+        try:
+            self.load()
+            return True
+        except Exception as e:
+            print(f"✗ Catalogue reload failed, keeping version {self.version}: {e}")
+            return False
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.check_interval_s)
+            self.refresh_if_changed()
+
+    def start_refresher(self):
+        """Starts the version polling thread once per process (safe to call on every request)."""
+        if self.check_interval_s <= 0 or self._refresher_pid == os.getpid():
+            return
+        with self._load_lock:
+            if self._refresher_pid != os.getpid():
+                self._refresher_pid = os.getpid()
+                threading.Thread(target=self._refresh_loop, name="species-catalogue-refresh", daemon=True).start()
+
+    # ------------------------------------------------------------------ lookups
+
+    def __len__(self):
+        return len(self._records)
+
+    def records(self) -> List[Dict[str, Any]]:
+        return list(self._records)
+
+    def by_key(self, kind: str = "english") -> Dict[str, Dict[str, Any]]:
+        """normalized name -> record for one name kind."""
+        return self._exact[kind]
+
+    def fuzzy(self, name: str, kinds: Iterable[str] = tuple(NAME_FIELDS), cutoff: float = CATALOGUE_FUZZY_CUTOFF):
+        """Best (record, similarity) among names sharing trigrams with `name`, or (None, 0.0)."""
+        key = normalize_name(name)
+        if not key:
+            return None, 0.0
+        query_grams = trigrams(key)
+        best, best_score = None, 0.0
+        for kind in kinds:
+            shared = defaultdict(int)
+            index = self._trigrams[kind]
+            for gram in query_grams:
+                for candidate in index.get(gram, ()):
+                    shared[candidate] += 1
+            # Only the few names with the most shared trigrams get the (slower) difflib ratio
+            for candidate, _ in sorted(shared.items(), key=lambda x: -x[1])[:5]:
+                score = difflib.SequenceMatcher(None, key, candidate).ratio()
+                if score > best_score:
+                    best, best_score = self._exact[kind][candidate], score
+        if best_score < cutoff:
+            return None, best_score
+        return best, best_score
+
+    def lookup(self, name: str, kinds: Iterable[str] = tuple(NAME_FIELDS), fuzzy: bool = True) -> Optional[Dict[str, Any]]:
+        """Record for a scientific, English or Thai name; exact first, then fuzzy."""
+        key = normalize_name(name)
+        for kind in kinds:
+            record = self._exact[kind].get(key)
+            if record is not None:
+                self.stats["exact_hits"] += 1
+                return record
+        if fuzzy:
+            record, _ = self.fuzzy(name, kinds)
+            if record is not None:
+                self.stats["fuzzy_hits"] += 1
+                return record
+        self.stats["misses"] += 1
+        return None
+
+    def enrich(self, candidates: List[Dict[str, Any]], kinds: Iterable[str] = ("english",)) -> List[Dict[str, Any]]:
+        """Adds ENRICH_FIELDS to each {"fish_name": ...} candidate in place and returns the list."""
+        for candidate in candidates or []:
+            record = self.lookup(candidate.get("fish_name"), kinds) or {}
+            for field in ENRICH_FIELDS:
+                candidate.setdefault(field, record.get(field))
+        return candidates
+
+    def info(self) -> Dict[str, Any]:
+        return {"species": len(self._records), "version": self.version, "loaded_at": self.loaded_at, **self.stats}
+
+
+_catalogues: Dict[Any, SpeciesCatalogue] = {}
+_catalogues_lock = threading.Lock()
+
+
+def get_catalogue(esq=None, index_name: Optional[str] = None) -> SpeciesCatalogue:
+    """Process-wide catalogue per index, loaded on first use with its refresher running."""
+    key = (id(esq), index_name)
+    with _catalogues_lock:
+        catalogue = _catalogues.get(key)
+        if catalogue is None:
+            catalogue = _catalogues[key] = SpeciesCatalogue(esq, index_name)
+    catalogue.start_refresher()
+    return catalogue
@@ -0,0 +1,123 @@
+"""
+Builds the remote-only and the local-model BE images and compares their size
+and cold start:
+
+    python startup_benchmark.py                 # builds both, 3 cold starts each
+    python startup_benchmark.py --skip-build --runs 5
+
+For every image the script reports its size, the time from `docker run` until
+/live answers, until the first /search completes (the container runs against
+the local fakes, FISH_FAKE_BACKENDS=1, so no credentials are needed) and
+whether torch was imported by the API process. For the local-model image it
+also times loading the baked Snowflake model and the first local embedding.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+
+import requests
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGES = {"remote": "0", "local": "1"}
+# The fakes need no Elasticsearch or credentials, so the containers start without a network
+FAKE_ENV = {"FISH_FAKE_BACKENDS": "1"}
+IMPORT_CHECK = ("import sys, time; start = time.perf_counter(); import api_services; "
+                "print(round(time.perf_counter() - start, 2), 'torch' in sys.modules)")
+LOCAL_MODEL_CHECK = ("import time; start = time.perf_counter(); from embedding_service import EmbeddingService; "
+                     "emb = EmbeddingService('sentence_transformer', use_cache=False); "
+                     "loaded = time.perf_counter() - start; emb.embed_text('orange fish with white stripes'); "
+                     "print(round(loaded, 2), round(time.perf_counter() - start, 2))")
+
+
+def env_args(env):
+    return [arg for key, value in env.items() for arg in ("-e", f"{key}={value}")]
+
+
+def docker(*args, check=True):
+    return subprocess.run(["docker", *args], capture_output=True, text=True, check=check).stdout.strip()
+
+
+def build(tag, local_model):
+    start = time.perf_counter()
+    subprocess.run(["docker", "build", "--build-arg", f"LOCAL_MODEL={local_model}", "-t", tag, BASE_DIR], check=True)
+    return time.perf_counter() - start
+
+
+def image_size_mb(tag):
+    return int(docker("image", "inspect", "-f", "{{.Size}}", tag)) / (1024 * 1024)
+
+
+def cold_start(tag, port, timeout):
+    """Seconds from `docker run` to the first /live and to the first /search response."""
+    start = time.perf_counter()
+    container = docker("run", "-d", "--rm", "-p", f"{port}:8080", *env_args(FAKE_ENV), tag)
+    try:
+        live_s = None
+        deadline = start + timeout
+        while time.perf_counter() < deadline:
+            try:
+                if requests.get(f"http://127.0.0.1:{port}/live", timeout=1).status_code == 200:
+                    live_s = time.perf_counter() - start
+                    break
+            except requests.RequestException:
+                time.sleep(0.1)
+        if live_s is None:
+            raise RuntimeError(f"{tag} did not answer /live within {timeout}s")
+        response = requests.post(f"http://127.0.0.1:{port}/search", json={"text": "orange fish with white stripes"},
+                                 timeout=timeout)
+        response.raise_for_status()
+        return live_s, time.perf_counter() - start
+    finally:
+        docker("stop", "-t", "5", container, check=False)
+
+
+def run_python(tag, code):
+    return docker("run", "--rm", *env_args(FAKE_ENV), tag, "python", "-c", code).splitlines()[-1].split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="remote,local")
+    parser.add_argument("--tag-prefix", default="fish-be")
+    parser.add_argument("--skip-build", action="store_true")
+    parser.add_argument("--runs", type=int, default=3, help="cold starts per image")
+    parser.add_argument("--port", type=int, default=8097)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    results = []
+    for name in [i.strip() for i in args.images.split(",") if i.strip()]:
+        if name not in IMAGES:
+            parser.error(f"unknown image {name}, use {list(IMAGES)}")
+        tag = f"{args.tag_prefix}:{name}"
+        build_s = None if args.skip_build else build(tag, IMAGES[name])
+        starts = [cold_start(tag, args.port, args.timeout) for _ in range(args.runs)]
+        import_s, torch_imported = run_python(tag, IMPORT_CHECK)
+        row = {
+            "image": name,
+            "size_mb": round(image_size_mb(tag)),
+            "build_s": round(build_s, 1) if build_s is not None else None,
+            "live_s": round(statistics.median(s[0] for s in starts), 2),
+            "first_request_s": round(statistics.median(s[1] for s in starts), 2),
+            "import_s": float(import_s),
+            "torch_imported": torch_imported == "True",
+        }
+        if name == "local":
+            load_s, first_embedding_s = run_python(tag, LOCAL_MODEL_CHECK)
+            row.update(local_model_load_s=float(load_s), local_first_embedding_s=float(first_embedding_s))
+        results.append(row)
+        print(json.dumps(row))
+
+    print(f"{'image':<8} {'size MB':>8} {'/live s':>8} {'1st req s':>10} {'import s':>9} {'torch':>6} "
+          f"{'model load s':>13} {'1st embed s':>12}")
+    for r in results:
+        print(f"{r['image']:<8} {r['size_mb']:>8} {r['live_s']:>8.2f} {r['first_request_s']:>10.2f} "
+              f"{r['import_s']:>9.2f} {str(r['torch_imported']):>6} {r.get('local_model_load_s', '-'):>13} "
+              f"{r.get('local_first_embedding_s', '-'):>12}")
+
+
+if __name__ == "__main__":
+    main()
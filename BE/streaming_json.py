@@ -0,0 +1,139 @@
+"""
+Incremental JSON parsing for streamed LLM responses.
+
+The vision models return one JSON object, e.g.
+{"image_contains_fish": true, "rejection_reason": null, "results": [{...}, ...]}.
+IncrementalJSONParser is fed the text chunks as they arrive and reports
+top-level fields and the items of top-level arrays the moment each one is
+complete, so callers can act on `image_contains_fish` or send the first
+candidate without waiting for the rest of the generation.
+
+Text before the first "{" (markdown fences, prose) is skipped, as is anything
+after the object closes.
+"""
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+_WHITESPACE = " \t\r\n"
+_SCALAR_END = ",}]" + _WHITESPACE
+
+# Events returned by feed():
+#   ("key", key)                   a top-level key was read (its value follows)
+#   ("field", key, value)          a top-level value is complete
+#   ("item", key, index, value)    an element of the top-level array `key` is complete
+#   ("done", obj)                  the whole object is complete
+Event = Tuple
+
+
+class IncrementalJSONParser:
+    """Character-level scanner over a growing buffer; each value is json.loads'ed once it is closed."""
+
+    def __init__(self):
+        self.buffer = ""
+        self.fields: Dict[str, Any] = {}
+        self.result: Optional[Dict[str, Any]] = None
+        self._pos = 0
+        self._stack: List[Dict[str, Any]] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._scalar_start: Optional[int] = None
+        self._events: List[Event] = []
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    def feed(self, text: str) -> List[Event]:
+        """Appends `text` and returns the events it completed."""
+        self.buffer += text or ""
+        self._events = []
+        buffer = self.buffer
+        while self._pos < len(buffer) and not self.done:
+            self._step(buffer[self._pos])
+            self._pos += 1
+        return self._events
+
+    def close(self) -> List[Event]:
+        """Flushes a trailing scalar at end of input (only matters for truncated output)."""
+        self._events = []
+        if self._scalar_start is not None and not self.done:
+            self._end_value(self._scalar_start, len(self.buffer))
+            self._scalar_start = None
+        return self._events
+
+    # ------------------------------------------------------------------ scanner
+
+    def _step(self, ch: str):
+        pos = self._pos
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                self._end_string(self._string_start, pos + 1)
+            return
+        if self._scalar_start is not None:
+            if ch not in _SCALAR_END:
+                return
+            self._end_value(self._scalar_start, pos)
+            self._scalar_start = None
+        if not self._stack:
+            if ch == "{":
+                self._stack.append({"kind": "object", "start": pos, "key": None, "expect": "key"})
+            return
+        frame = self._stack[-1]
+        if ch in _WHITESPACE:
+            return
+        if ch == '"':
+            self._in_string, self._string_start = True, pos
+        elif ch in "{[":
+            kind = "object" if ch == "{" else "array"
+            self._stack.append({"kind": kind, "start": pos, "key": None, "expect": "key", "index": 0})
+        elif ch in "}]":
+            closed = self._stack.pop()
+            if not self._stack:
+                self.result = json.loads(self.buffer[closed["start"]:pos + 1])
+                self._events.append(("done", self.result))
+            else:
+                self._end_value(closed["start"], pos + 1)
+        elif ch == ":":
+            frame["expect"] = "value"
+        elif ch == ",":
+            frame["expect"] = "key"
+        else:
+            self._scalar_start = pos
+
+    def _end_string(self, start: int, end: int):
+        frame = self._stack[-1]
+        if frame["kind"] == "object" and frame["expect"] == "key":
+            frame["key"] = json.loads(self.buffer[start:end])
+            if len(self._stack) == 1:
+                self._events.append(("key", frame["key"]))
+        else:
+            self._end_value(start, end)
+
+    def _end_value(self, start: int, end: int):
+        parent = self._stack[-1]
+        depth = len(self._stack)
+        if depth > 2:
+            return  # nested deeper than a top-level array item; parsed with its container
+        value = json.loads(self.buffer[start:end])
+        if depth == 1:
+            self.fields[parent["key"]] = value
+            self._events.append(("field", parent["key"], value))
+        elif parent["kind"] == "array" and self._stack[0]["kind"] == "object":
+            self._events.append(("item", self._stack[0]["key"], parent["index"], value))
+            parent["index"] += 1
+
+
+def iter_events(chunks: Iterable[str]) -> Iterator[Event]:
+    """Events for a stream of text chunks, ending with ("done", obj) when the object closes."""
+    parser = IncrementalJSONParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+        if parser.done:
+            return
+    yield from parser.close()
@@ -0,0 +1,35 @@
+from background_uploads import BackgroundUploader, upload_key
+
+
+class _FlakyCOS:
+    def __init__(self, failures):
+        self.failures = failures
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("reset")
+        self.objects[(Bucket, Key)] = (Body, kwargs.get("ContentType"))
+
+
+def test_upload_keys_are_generated_under_the_prefix():
+    """Every upload gets a fresh random key; only a plain extension is kept from the file name"""
+    keys = {upload_key("IMG_1.JPG", prefix="user-upload/") for _ in range(3)}
+    assert len(keys) == 3 and all(k.startswith("user-upload/") and k.endswith(".jpg") for k in keys)
+    assert upload_key(None, "image/png", prefix="user-upload/").endswith(".png")
+    assert upload_key("../../fish.j/pg", "image/png", prefix="user-upload/").endswith(".png")
+    assert "/" not in upload_key("a.<x>", None, prefix="user-upload/")[len("user-upload/"):]
+
+
+def test_uploads_run_in_background_with_retries():
+    """A transient failure is retried; a persistent one is counted, never raised"""
+    cos = _FlakyCOS(failures=1)
+    uploader = BackgroundUploader(lambda: cos, bucket="bucket", workers=1, retries=1)
+    assert uploader.submit("user-upload/a.jpg", b"abc", "image/jpeg").result() is True
+    assert cos.objects[("bucket", "user-upload/a.jpg")] == (b"abc", "image/jpeg")
+
+    cos.failures = 5
+    assert uploader.submit("user-upload/b.jpg", b"xyz").result() is False
+    uploader.shutdown()
+    assert uploader.stats() == {"submitted": 2, "uploaded": 1, "failed": 1, "bytes": 3, "pending": 0}
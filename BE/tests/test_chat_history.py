@@ -0,0 +1,50 @@
+from chat_history import ChatHistoryManager, clean_history, count_tokens, dedupe_paragraphs
+
+
+def _conversation(turns, answer_words=300):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"question {i}"})
+        history.append({"role": "assistant", "content": f"answer {i} " + " ".join(["fish"] * answer_words)})
+    return history
+
+
+def test_budget_is_enforced_and_recent_turns_stay_verbatim():
+    manager = ChatHistoryManager(budget=1500, recent_turns=2)
+    history = _conversation(12)
+    messages, info = manager.build_messages("system", "latest question", history)
+
+    assert info["prompt_tokens_estimate"] <= 1500 < info["legacy_prompt_tokens_estimate"]
+    assert messages[-5:-1] == history[-4:]
+    assert info["dropped_messages"] > 0 and info["summarized_messages"] == 0
+
+
+def test_summary_written_after_response_is_used_by_the_next_request():
+    calls = []
+
+    def summarize(previous, messages):
+        calls.append((previous, [m["content"] for m in messages]))
+        return f"summary of {len(messages)} messages"
+
+    manager = ChatHistoryManager(summarize, budget=100000, recent_turns=2)
+    history = _conversation(5)
+    manager.after_response(history)
+    manager.drain()
+    assert calls == [("", [m["content"] for m in history[:8]])]
+
+    history = history + [{"role": "user", "content": "q"}, {"role": "assistant", "content": "a"}]
+    messages, info = manager.build_messages("system", "next", history)
+    assert info["summarized_messages"] == 8 and "summary of 8 messages" in messages[0]["content"]
+    assert messages[1:-1] == history[8:]
+    assert manager.stats()["summary_hits"] == 1
+
+
+def test_repeated_paragraphs_and_double_submits_are_dropped():
+    block = "The white-spotted puffer lives on Indo-Pacific reefs and feeds on algae, molluscs and sponges."
+    history = clean_history([{"role": "user", "content": "hi"}, {"role": "user", "content": "hi"},
+                             {"role": "assistant", "content": f"Intro\n\n{block}"},
+                             {"role": "assistant", "content": f"{block}\n\nMore"}])
+    assert len(history) == 3
+    deduped = dedupe_paragraphs(history)
+    assert deduped[1]["content"] == "Intro" and deduped[2]["content"] == f"{block}\n\nMore"
+    assert count_tokens("ปลา" * 10) > count_tokens("fish" * 10) / 2
@@ -0,0 +1,48 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def _fake_embed(calls):
+    def compute(texts):
+        calls.append(list(texts))
+        return [np.full(4, float(len(t)), dtype=np.float32) for t in texts]
+    return compute
+
+
+def test_only_misses_are_computed_in_one_batch(tmp_path):
+    """Cached texts are served from SQLite, misses are computed together"""
+    cache = EmbeddingCache("test-model", 4, path=str(tmp_path / "cache.sqlite3"))
+    calls = []
+    cache.embed_with_cache(["a", "bb"], _fake_embed(calls))
+    vectors = cache.embed_with_cache(["a", "ccc", "bb", "ccc"], _fake_embed(calls))
+
+    assert calls == [["a", "bb"], ["ccc"]]
+    assert [v[0] for v in vectors] == [1.0, 3.0, 2.0, 3.0]
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["entries"] == 3
+
+
+def test_normalized_text_shares_entry_and_model_is_part_of_key(tmp_path):
+    """Whitespace differences hit the same entry, another model name does not"""
+    path = str(tmp_path / "cache.sqlite3")
+    calls = []
+    EmbeddingCache("model-a", 4, path=path).embed_with_cache(["clown  fish "], _fake_embed(calls))
+    EmbeddingCache("model-a", 4, path=path).embed_with_cache(["clown fish"], _fake_embed(calls))
+    EmbeddingCache("model-b", 4, path=path).embed_with_cache(["clown fish"], _fake_embed(calls))
+
+    assert len(calls) == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    """Once max_entries is exceeded the oldest accessed rows are dropped"""
+    cache = EmbeddingCache("test-model", 4, path=str(tmp_path / "cache.sqlite3"), max_entries=2)
+    calls = []
+    cache.embed_with_cache(["a"], _fake_embed(calls))
+    cache.embed_with_cache(["bb"], _fake_embed(calls))
+    cache.embed_with_cache(["a"], _fake_embed(calls))  # refresh "a"
+    cache.embed_with_cache(["ccc"], _fake_embed(calls))  # evicts "bb"
+
+    assert set(cache.get_many(["a", "bb", "ccc"])) == {cache.text_hash("a"), cache.text_hash("ccc")}
+    assert cache.stats()["evictions"] == 1
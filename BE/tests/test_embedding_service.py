@@ -0,0 +1,13 @@
+import subprocess
+import sys
+from pathlib import Path
+
+BE_DIR = Path(__file__).resolve().parents[1]
+
+
+def test_remote_embedding_does_not_import_torch():
+    # The remote-only image has no sentence-transformers/torch installed
+    code = ("import sys; from embedding_service import EmbeddingService; "
+            "assert 'sentence_transformers' not in sys.modules and 'torch' not in sys.modules")
+    result = subprocess.run([sys.executable, "-c", code], cwd=BE_DIR, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,40 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+from embedding_wire_format import decode_embedding_response
+
+MATRIX = np.array([[0.5, -1.25, 2.0], [0.0, 3.5, -0.75]], dtype=np.float32)
+
+
+class _Response:
+    def __init__(self, content, content_type, **headers):
+        self.content = content
+        self.headers = {"Content-Type": content_type, **headers}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def test_binary_and_json_bodies_decode_to_the_same_matrix():
+    shape = {"X-Embedding-Shape": "2,3"}
+    npy = io.BytesIO()
+    np.save(npy, MATRIX, allow_pickle=False)
+    values = [[f"s{i}", row.tolist()] for i, row in enumerate(MATRIX)]
+    responses = [
+        _Response(MATRIX.astype("<f4").tobytes(), "application/x-float32", **shape),
+        _Response(MATRIX.astype("<f2").tobytes(), "application/x-float16; charset=binary", **shape),
+        _Response(npy.getvalue(), "application/x-npy"),
+        _Response(json.dumps({"predictions": [{"values": values}]}), "application/json"),
+    ]
+    for response in responses:
+        decoded = decode_embedding_response(response)
+        assert decoded.shape == (2, 3)
+        np.testing.assert_array_equal(decoded, MATRIX)
+
+
+def test_unknown_content_types_are_rejected():
+    with pytest.raises(ValueError, match="text/html"):
+        decode_embedding_response(_Response(b"<html>Bad gateway</html>", "text/html"))
@@ -0,0 +1,80 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from fake_providers import (FakeCOSClient, FakeGroqClient, FakeProviderError, FakeVisionModel, HashEmbeddingService,
+                            InMemoryElasticsearchQuery, LatencyModel, load_species)
+
+BE_DIR = Path(__file__).resolve().parents[1]
+# Imported by api_services even when the fakes replace them
+PROVIDER_SDKS = ("groq", "google.genai", "ibm_boto3", "elasticsearch", "ibm_watsonx_ai")
+
+
+def _no_latency(provider):
+    return LatencyModel(provider, "fixed:0", error_rate=0.0)
+
+
+def test_hash_embedding_is_deterministic_and_ranks_similar_text_first():
+    """Same text gives the same vector; a doc's own description is its nearest neighbour"""
+    docs = load_species()[:20]
+    embedder = HashEmbeddingService(latency=_no_latency("embedding"))
+    vector = embedder.embed_text("red lionfish")
+    assert vector.dtype == np.float32 and vector.shape == (embedder.dim,)
+    assert np.array_equal(vector, embedder.embed_text(["red lionfish", "clownfish"])[0])
+
+    es = InMemoryElasticsearchQuery(embedder, docs, latency=_no_latency("es"))
+    query = embedder.embed_text(docs[3]["physical_description"])
+    hits = es.search_embedding("fake", "physical_description_embedding", query, size=3)["hits"]["hits"]
+    assert hits[0]["_source"]["fish_name"] == docs[3]["fish_name"]
+    assert 0.0 <= hits[-1]["_score"] <= hits[0]["_score"] <= 1.0
+
+
+def test_fake_groq_returns_schema_valid_candidates():
+    """Candidates come from the catalogue and details are returned for the details prompt"""
+    docs = load_species()
+    groq = FakeGroqClient(FakeVisionModel("groq", docs, latency=_no_latency("groq"), canned={}))
+    messages = [{"role": "system", "content": "identify"},
+                {"role": "user", "content": [{"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}}]}]
+
+    result = json.loads(groq.chat.completions.create(messages=messages, model="m").choices[0].message.content)
+    names = {d["fish_name"] for d in docs}
+    assert result["image_contains_fish"] is True
+    assert len(result["results"]) == 5
+    assert all(r["fish_name"] in names for r in result["results"])
+
+    messages[0]["content"] = "Return fish_details"
+    details = json.loads(groq.chat.completions.create(messages=messages, model="m").choices[0].message.content)
+    assert set(details["fish_details"]) == {"fish_name", "scientific_name", "order_name", "physical_description", "habitat"}
+
+
+def test_fake_cos_ranged_read_and_injected_errors(tmp_path):
+    """Range requests return the slice, an error rate of 1 always fails"""
+    (tmp_path / "fish").mkdir()
+    (tmp_path / "fish" / "a.png").write_bytes(b"0123456789")
+    cos = FakeCOSClient(str(tmp_path), latency=_no_latency("cos"))
+    response = cos.get_object(Bucket="b", Key="fish/a.png", Range="bytes=2-5")
+    assert response["Body"].read() == b"2345"
+    assert cos.head_object(Bucket="b", Key="fish/a.png")["ContentLength"] == 10
+
+    failing = FakeCOSClient(str(tmp_path), latency=LatencyModel("cos", "fixed:0", error_rate=1.0))
+    with pytest.raises(FakeProviderError, match="injected"):
+        failing.get_object(Bucket="b", Key="fish/a.png")
+
+
+@pytest.mark.skipif(any(importlib.util.find_spec(m.split(".")[0]) is None for m in PROVIDER_SDKS),
+                    reason="provider SDKs from requirements.txt are not installed")
+def test_api_starts_with_only_the_fake_backends_flag(tmp_path):
+    """No Elasticsearch settings or reachable cluster are needed with FISH_FAKE_BACKENDS=1"""
+    env = {"PATH": os.environ.get("PATH", ""), "HOME": str(tmp_path), "FISH_FAKE_BACKENDS": "1",
+           "JOB_DB_PATH": str(tmp_path / "jobs.sqlite3"), "EMBEDDING_CACHE_PATH": str(tmp_path / "cache.sqlite3")}
+    code = ("import sys, api_services; assert 'function' not in sys.modules; "
+            "assert api_services.app.test_client().get('/live').status_code == 200")
+    result = subprocess.run([sys.executable, "-c", code], cwd=BE_DIR, env=env, capture_output=True, text=True,
+                            timeout=120)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,64 @@
+import importlib.util
+import json
+
+import pytest
+
+pytestmark = pytest.mark.skipif(any(importlib.util.find_spec(m) is None for m in ("groq", "google")),
+                                reason="provider SDKs from requirements.txt are not installed")
+
+REJECTION = {"image_contains_fish": False, "rejection_reason": "a cat", "results": []}
+
+
+def _fake_provider(monkeypatch, obj, size=5):
+    """Replaces the provider text streams with `obj` as JSON in `size`-character chunks"""
+    import fish_services
+
+    text = json.dumps(obj)
+    state = {"sent": 0, "closed": False}
+
+    def text_stream(client, pic_string, with_caption):
+        try:
+            for i in range(0, len(text), size):
+                state["sent"] = i + size
+                yield text[i:i + size]
+        finally:
+            state["closed"] = True
+
+    monkeypatch.setitem(fish_services._TEXT_STREAMS, "fake", text_stream)
+    return text, state
+
+
+def _events(obj, monkeypatch):
+    import fish_services
+
+    text, state = _fake_provider(monkeypatch, obj)
+    return list(fish_services.stream_fish_candidates("fake", None, "", with_caption=True)), text, state
+
+
+def test_full_result_streams_caption_and_candidates(monkeypatch):
+    result = {"image_contains_fish": True, "caption": "Orange with white bars", "rejection_reason": None,
+              "results": [{"fish_name": "Clown anemonefish", "score": 0.9}, {"fish_name": "Tomato clownfish",
+                                                                              "score": 0.1}]}
+    events, _, state = _events(result, monkeypatch)
+    assert events == [("caption", result["caption"]), ("candidate", result["results"][0]),
+                      ("candidate", result["results"][1]), ("result", result)]
+    assert state["closed"]
+
+
+def test_rejection_exits_early_with_the_normalized_shape(monkeypatch):
+    """Generation stops once the rejection_reason is read, before the rest of the object"""
+    obj = {"image_contains_fish": False, "rejection_reason": "a cat",
+           "results": [{"fish_name": "Red lionfish", "score": 0.01, "score_reason": "x" * 200}]}
+    events, text, state = _events(obj, monkeypatch)
+    assert events == [("rejected", REJECTION)]
+    assert state["closed"] and state["sent"] < len(text)
+
+
+def test_rejection_in_a_completed_object_has_the_same_shape(monkeypatch):
+    """Without a rejection_reason the rejection is only known when the object completes"""
+    missing_reason = {"image_contains_fish": False, "rejection_reason": None, "results": []}
+    events, _, _ = _events({"image_contains_fish": False}, monkeypatch)
+    assert events == [("rejected", missing_reason)]
+
+    events, _, _ = _events({"caption": "A cat on a sofa", "image_contains_fish": False}, monkeypatch)
+    assert events == [("caption", "A cat on a sofa"), ("rejected", missing_reason)]
@@ -0,0 +1,16 @@
+import pytest
+
+from gunicorn_conf import derive_concurrency
+
+
+def test_threads_follow_io_ratio():
+    assert derive_concurrency(4, 0.0) == (4, 1)
+    assert derive_concurrency(4, 0.9) == (4, 10)
+    assert derive_concurrency(4, 0.98) == (4, 50)
+
+
+def test_bounds():
+    # Never fewer than two workers, never more than max_threads threads
+    assert derive_concurrency(1, 0.999, max_threads=64) == (2, 64)
+    with pytest.raises(ValueError):
+        derive_concurrency(2, 1.0)
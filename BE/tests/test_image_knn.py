@@ -0,0 +1,106 @@
+import numpy as np
+
+import image_knn
+from image_knn import (ElasticsearchImageIndex, ImageKNNClassifier, ImageKNNIndex, calibrate, calibrate_margin,
+                       get_image_classifier, group_hits)
+
+
+class _Embedder:
+    """Maps the test's image bytes to fixed unit vectors instead of running CLIP."""
+
+    model_name = "test-model"
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed(self, images):
+        return np.stack([self.vectors[data] for data in images])
+
+
+def _unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+INDEX = ImageKNNIndex(
+    np.stack([_unit(1, 0, 0), _unit(0, 1, 0), _unit(0.9, 0.1, 0), _unit(0, 0.95, 0.05), _unit(0, 0, 1)]),
+    ["Tomato clownfish", "Red lionfish", "Tomato clownfish", "Red lionfish", "Whale shark"],
+    model_name="test-model")
+
+
+def test_species_are_scored_by_their_best_reference_photo():
+    query = _unit(0.95, 0.2, 0)
+    ranked, margin = INDEX.rank(query)
+    assert [c["fish_name"] for c in ranked] == ["Tomato clownfish", "Red lionfish", "Whale shark"]
+    assert np.isclose(ranked[0]["score"], max(_unit(1, 0, 0) @ query, _unit(0.9, 0.1, 0) @ query))
+    assert np.isclose(margin, ranked[0]["score"] - ranked[1]["score"])
+
+
+def test_calibration_picks_the_lowest_margin_that_keeps_the_target_precision(tmp_path):
+    margins = np.array([0.30, 0.25, 0.20, 0.15, 0.10, 0.05])
+    correct = np.array([True, True, True, False, True, False])
+    assert calibrate_margin(margins, correct, 1.0) == (0.20, 1.0, 0.5)
+    assert calibrate_margin(margins, correct, 0.8)[0] == 0.10
+    assert calibrate_margin(margins, np.zeros(6, dtype=bool), 0.9)[0] == float("inf")
+
+    report = calibrate(INDEX, 1.0)
+    assert report["leave_one_out_top1"] == 0.8  # the only Whale shark photo has no other reference
+    INDEX.save(str(tmp_path / "index.npz"))
+    loaded = ImageKNNIndex.load(str(tmp_path / "index.npz"))
+    assert loaded.labels == INDEX.labels and loaded.margin_threshold == INDEX.margin_threshold
+
+
+def test_fast_path_needs_both_margin_and_similarity():
+    embedder = _Embedder({b"clear": _unit(1, 0.02, 0), b"between": _unit(1, 1, 0), b"unknown": _unit(-1, -1, 0)})
+    classifier = ImageKNNClassifier(INDEX, embedder, margin_threshold=0.2, min_similarity=0.75)
+
+    clear = classifier.classify(b"clear")
+    assert clear["confident"]
+    result = classifier.as_identification(clear)
+    assert result["image_contains_fish"] and result["results"][0]["fish_name"] == "Tomato clownfish"
+    assert not classifier.classify(b"between")["confident"]   # two species equally close
+    assert not classifier.classify(b"unknown")["confident"]   # nothing similar enough
+    assert classifier.classify(b"not embeddable") is None
+    stats = classifier.stats()
+    assert (stats["requests"], stats["fast_path"], stats["errors"]) == (3, 1, 1)
+
+
+def test_mean_aggregation_and_grouped_elasticsearch_hits():
+    """Mean favours species whose photos agree; ES hits are grouped per species the same way"""
+    mean_index = ImageKNNIndex(INDEX.vectors, INDEX.labels, model_name="test-model", aggregation="mean")
+    query = _unit(0.6, 0.8, 0)
+    by_max, by_mean = INDEX.rank(query, 3)[0], mean_index.rank(query, 3)[0]
+    assert by_max[1]["score"] > by_mean[1]["score"]
+    assert np.isclose(by_mean[0]["score"], np.mean([_unit(0, 1, 0) @ query, _unit(0, 0.95, 0.05) @ query]))
+    assert mean_index.leave_one_out()[2].tolist() == [True, True, True, True, False]
+
+    hits = [("Red lionfish", 0.9), ("Tomato clownfish", 0.8), ("Red lionfish", 0.5)]
+    assert group_hits(hits, "max") == {"Red lionfish": 0.9, "Tomato clownfish": 0.8}
+    assert group_hits(hits, "mean") == {"Red lionfish": 0.7, "Tomato clownfish": 0.8}
+
+
+class _StubImageES:
+    """get_mapping/search_embedding over fixed hits, standing in for ElasticsearchQuery"""
+
+    def __init__(self, hits):
+        self.hits = hits
+        self.es = self
+        self.indices = self
+
+    def get_mapping(self, index):
+        return {index: {"mappings": {"_meta": {"model_name": "test-model", "margin_threshold": 0.1}}}}
+
+    def search_embedding(self, index_name, embedding_field, query_vector, size):
+        return {"hits": {"hits": [{"_source": {"fish_name": name}, "_score": score} for name, score in self.hits]}}
+
+
+def test_elasticsearch_backend_needs_no_npz_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(image_knn, "IMAGE_KNN_FAST_PATH", True)
+    monkeypatch.setattr(image_knn, "IMAGE_KNN_BACKEND", "es")
+    monkeypatch.setattr(image_knn, "_default_classifier", None)
+    esq = _StubImageES([("Red lionfish", 0.95), ("Tomato clownfish", 0.6), ("Red lionfish", 0.9)])
+
+    classifier = get_image_classifier(esq, path=str(tmp_path / "missing.npz"))
+    assert isinstance(classifier.index, ElasticsearchImageIndex) and classifier.margin_threshold == 0.1
+    decision = classifier.decide(_unit(1, 0, 0))
+    assert decision["ranked"][0]["fish_name"] == "Red lionfish" and decision["confident"]
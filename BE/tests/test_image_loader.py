@@ -0,0 +1,57 @@
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from fake_providers import FakeCOSClient, LatencyModel
+from image_loader import Base64Encoder, ImageLoader, ImageTooLarge, UnsupportedImage, sniff_image
+
+
+def _image_bytes(fmt, size=(321, 123)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 80, 20)).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def test_sniff_reads_format_and_dimensions_from_the_header():
+    """JPEG, PNG, GIF and WebP are recognised from their first bytes; anything else is rejected"""
+    for fmt, name in (("JPEG", "jpeg"), ("PNG", "png"), ("GIF", "gif"), ("WEBP", "webp")):
+        info = sniff_image(_image_bytes(fmt)[:4096])
+        assert (info["format"], info["width"], info["height"]) == (name, 321, 123)
+    with pytest.raises(UnsupportedImage):
+        sniff_image(b"<html>not an image</html>")
+
+
+def test_incremental_base64_matches_one_shot_encoding():
+    """Chunk sizes that are not multiples of 3 still give the exact b64encode output"""
+    data = bytes(range(256)) * 41 + b"x"
+    for chunk in (1, 5, 1000, len(data)):
+        for expected_size in (len(data), None):
+            encoder = Base64Encoder(expected_size)
+            for start in range(0, len(data), chunk):
+                encoder.update(data[start:start + chunk])
+            assert encoder.finish() == base64.b64encode(data).decode("ascii")
+
+
+def test_cos_load_streams_and_rejects_before_downloading(tmp_path):
+    """Both encodings return the object; oversized objects fail after the ranged sniff only"""
+    data = _image_bytes("PNG", (800, 600))
+    (tmp_path / "fish.png").write_bytes(data)
+    cos = FakeCOSClient(root=str(tmp_path), latency=LatencyModel("cos", "fixed:0", 0.0))
+    loader = ImageLoader(sniff_bytes=64, chunk_bytes=999, trace_memory=True)
+
+    image = loader.load_cos(cos, "bucket", "fish.png", "base64")
+    assert image.data == base64.b64encode(data).decode("ascii")
+    assert (image.info["width"], image.mime_type) == (800, "image/png")
+    assert loader.load_cos(cos, "bucket", "fish.png", "bytes").data == data
+    assert loader.stats()["peak_bytes_max"] > 0
+
+    ranges = []
+    get_object = cos.get_object
+    cos.get_object = lambda **kwargs: ranges.append(kwargs.get("Range")) or get_object(**kwargs)
+    with pytest.raises(ImageTooLarge):
+        ImageLoader(max_bytes=len(data) - 1, sniff_bytes=64).load_cos(cos, "bucket", "fish.png")
+    assert ranges == ["bytes=0-63"]
+    with pytest.raises(ImageTooLarge):
+        ImageLoader(max_pixels=1000).load_bytes(data)
@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from job_queue import JobQueue
+
+
+def _queue(tmp_path, **kwargs):
+    queue = JobQueue(path=str(tmp_path / "jobs.sqlite3"), workers=0, **kwargs)
+    queue.register("echo", lambda payload: {"echo": payload["image"]})
+    return queue
+
+
+def test_submitted_job_runs_and_result_is_stored(tmp_path):
+    """submit returns at once; a worker pass stores the handler's result"""
+    queue = _queue(tmp_path)
+    job_id = queue.submit("echo", {"image": "user-upload/a.jpg"})
+    assert queue.get(job_id)["status"] == "queued"
+    assert queue.stats()["queue_depth"] == 1
+
+    assert queue.run_one()
+    job = queue.get(job_id)
+    assert job["status"] == "done" and job["attempts"] == 1
+    assert job["result"] == {"echo": "user-upload/a.jpg"}
+    assert not queue.run_one()
+    assert queue.stats()["completed"] == 1
+
+
+def test_failures_are_retried_and_expired_leases_reclaimed(tmp_path):
+    """A raising handler is retried up to max_attempts; a job of a dead worker runs again"""
+    queue = _queue(tmp_path, max_attempts=2, retry_base_s=0)
+    queue.register("boom", lambda payload: 1 / 0)
+    job_id = queue.submit("boom", {"image": "x"})
+    queue.run_one()
+    assert queue.get(job_id)["status"] == "queued"
+    queue.run_one()
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and "division" in job["error"]
+
+    crashed = _queue(tmp_path, lease_s=-1)  # same file, e.g. a restarted process
+    job_id = crashed.submit("echo", {"image": "y"})
+    assert crashed.claim()["id"] == job_id  # claimed, then the worker "dies"
+    assert crashed.run_one()
+    assert crashed.get(job_id)["status"] == "done"
+    assert crashed.get(job_id)["attempts"] == 2
+
+
+def test_webhook_receives_the_finished_job(tmp_path):
+    """The finished job is POSTed to webhook_url"""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.handle_request, daemon=True).start()
+    queue = _queue(tmp_path, webhook_hosts=["127.0.0.1"])
+    job_id = queue.submit("echo", {"image": "z"}, webhook_url=f"http://127.0.0.1:{server.server_port}/hook")
+    queue.run_one()  # no worker pool running, so the webhook is sent inline
+    server.server_close()
+
+    assert received[0]["job_id"] == job_id and received[0]["result"] == {"echo": "z"}
+    assert queue.get(job_id)["webhook_status"] == "delivered"
+
+
+def test_failed_attempts_back_off_and_long_jobs_keep_their_lease(tmp_path):
+    """A retry waits retry_base_s * 2^(attempt-1); a running handler's lease is renewed"""
+    queue = _queue(tmp_path, retry_base_s=30, retry_max_s=60)
+    queue.register("boom", lambda payload: 1 / 0)
+    job_id = queue.submit("boom", {"image": "x"})
+    queue.run_one()
+    assert queue.get(job_id)["status"] == "queued"
+    assert not queue.run_one()  # still backing off
+    assert (queue.retry_delay(1), queue.retry_delay(2), queue.retry_delay(5)) == (30, 60, 60)
+
+    slow = _queue(tmp_path, lease_s=0.3)
+    slow.register("slow", lambda payload: time.sleep(1.0) or {"ok": True})
+    slow_id = slow.submit("slow", {"image": "y"})
+    worker = threading.Thread(target=slow.run_one)
+    worker.start()
+    time.sleep(0.6)  # past the first lease
+    assert _queue(tmp_path, lease_s=0.3).claim() is None
+    worker.join()
+    assert slow.get(slow_id)["status"] == "done" and slow.get(slow_id)["attempts"] == 1
+    assert slow.stats()["lease_renewals"] >= 1
+
+
+def test_webhooks_are_limited_to_allowed_hosts(tmp_path):
+    queue = _queue(tmp_path, webhook_hosts=["hooks.example.com", "*.partner.org"])
+    assert queue.webhook_allowed("https://hooks.example.com/fish")
+    assert queue.webhook_allowed("https://api.partner.org/cb")
+    assert not queue.webhook_allowed("http://169.254.169.254/latest/meta-data")
+    assert not queue.webhook_allowed("https://hooks.example.com.evil.net/")
+    assert not queue.webhook_allowed("ftp://hooks.example.com/")
+    with pytest.raises(ValueError):
+        queue.submit("echo", {"image": "z"}, webhook_url="http://localhost:8080/admin")
+    assert not _queue(tmp_path).webhook_allowed("https://hooks.example.com/fish")  # none configured
@@ -0,0 +1,52 @@
+import io
+
+from PIL import Image, ImageDraw
+
+from perceptual_hash import BKTree, NearDuplicateCache, dhash, hamming, phash
+
+
+def _photo(seed, size=(400, 300), quality=90, scale=1.0):
+    image = Image.new("RGB", size, (20, 60, 120))
+    draw = ImageDraw.Draw(image)
+    for i in range(6):
+        x, y = (seed * 97 + i * 53) % size[0], (seed * 31 + i * 71) % size[1]
+        draw.ellipse((x - 40, y - 25, x + 40, y + 25), fill=((seed * 50 + i * 40) % 255, 200 - i * 30, 60))
+    if scale != 1.0:
+        image = image.resize((int(size[0] * scale), int(size[1] * scale)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def test_hashes_survive_recompression_and_resizing_but_separate_different_images():
+    for hasher in (dhash, phash):
+        original = hasher(_photo(1))
+        assert hamming(original, hasher(_photo(1, quality=30, scale=0.5))) <= 6
+        assert hamming(original, hasher(_photo(7))) > 12
+
+
+def test_bk_tree_search_matches_a_linear_scan():
+    hashes = [(i * 0x9E3779B97F4A7C15) & (2 ** 64 - 1) for i in range(300)]
+    tree = BKTree()
+    for i, h in enumerate(hashes):
+        tree.add(h, i)
+    query = hashes[17] ^ 0b1011
+    expected = sorted((hamming(query, h), i) for i, h in enumerate(hashes) if hamming(query, h) <= 20)
+    assert sorted(tree.search(query, 20)) == expected
+    assert tree.search(query, 3)[0] == (3, 17)
+
+
+def test_cache_returns_near_duplicates_per_namespace_and_counts_saved_time():
+    cache = NearDuplicateCache("phash", max_distance=6, max_entries=2)
+    original = cache.hash_image(_photo(1))
+    cache.put("groq", original, {"results": ["tuna"]}, cost_s=2.0)
+
+    assert cache.get("groq", cache.hash_image(_photo(1, quality=40, scale=0.6)))[0] == {"results": ["tuna"]}
+    assert cache.get("gemini", original) is None
+    assert cache.hash_image(b"not an image") is None
+
+    cache.put("groq", cache.hash_image(_photo(2)), {}, 1.0)
+    cache.put("groq", cache.hash_image(_photo(3)), {}, 1.0)
+    assert cache.get("groq", original) is None  # evicted past max_entries
+    stats = cache.stats()
+    assert (stats["hits"], stats["saved_s_total"], stats["entries"], stats["hash_errors"]) == (1, 2.0, 2, 1)
@@ -0,0 +1,50 @@
+from evaluation_harness import evaluate, summarize
+from fake_providers import HashEmbeddingService, InMemoryElasticsearchQuery, LatencyModel, load_species
+from pipelines import PROMPT_VERSION, run_pipeline
+from provider_recorder import ProviderRecorder
+
+DOCS = load_species()[:20]
+
+
+def _fakes():
+    embedder = HashEmbeddingService(latency=LatencyModel("embedding", "fixed:0", error_rate=0.0))
+    es = InMemoryElasticsearchQuery(embedder, DOCS, latency=LatencyModel("es", "fixed:0", error_rate=0.0))
+    return embedder, es
+
+
+def _record_captions(directory, docs):
+    """Captions stand in for the watsonx vision call: each image is captioned with its species' description."""
+    recorder = ProviderRecorder(str(directory), mode="record")
+    for doc in docs:
+        recorder.call("watsonx_caption", [f"fish/{doc['fish_name']}.png", PROMPT_VERSION],
+                      lambda doc=doc: doc["physical_description"])
+
+
+def test_caption_knn_pipeline_on_the_fakes(tmp_path):
+    _record_captions(tmp_path, DOCS[:1])
+    emb, esq = _fakes()
+    timings = {}
+    output = run_pipeline("caption_knn", "", f"fish/{DOCS[0]['fish_name']}.png", emb, esq, "fake", {},
+                          recorder=ProviderRecorder(str(tmp_path), mode="auto"), timings=timings)
+
+    assert output["caption"] == DOCS[0]["physical_description"]
+    assert output["ranked"][0]["fish_name"] == DOCS[0]["fish_name"]
+    assert set(timings) == {"caption", "embed", "knn"}
+
+
+def test_evaluation_is_reproducible_from_recordings(tmp_path):
+    """A run in auto mode records the kNN calls; the replayed run scores the same without any provider"""
+    _record_captions(tmp_path, DOCS[:3])
+    dataset = [(f"fish/{doc['fish_name']}.png", doc["fish_name"]) for doc in DOCS[:3]]
+    emb, esq = _fakes()
+
+    live_rows, live_latencies = evaluate(dataset, ["caption_knn"], lambda image_id: "",
+                                         ProviderRecorder(str(tmp_path), mode="auto"), emb, esq, index_name="fake")
+    replay_rows, replay_latencies = evaluate(dataset, ["caption_knn"], lambda image_id: "",
+                                             ProviderRecorder(str(tmp_path), mode="replay"), index_name="fake")
+
+    live = summarize(live_rows, live_latencies, ["caption_knn"])
+    replayed = summarize(replay_rows, replay_latencies, ["caption_knn"])
+    assert live["caption_knn"]["top1_accuracy"] == replayed["caption_knn"]["top1_accuracy"] == 1.0
+    assert replayed["caption_knn"]["errors"] == 0
+    assert [r["All Top 5 Candidates"] for r in live_rows] == [r["All Top 5 Candidates"] for r in replay_rows]
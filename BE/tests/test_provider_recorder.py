@@ -0,0 +1,36 @@
+import pytest
+
+from provider_recorder import ProviderRecorder, RecordingNotFound
+
+
+def test_recorded_call_is_replayed_with_its_latency(tmp_path):
+    """record writes the response once; replay returns it without calling the provider"""
+    calls = []
+
+    def provider():
+        calls.append(1)
+        return {"results": [{"fish_name": "Red lionfish", "score": 0.9}]}
+
+    recorder = ProviderRecorder(str(tmp_path), mode="record")
+    recorded = recorder.call("groq_candidates", ["fish/a.png", "v1"], provider)
+
+    timings = {}
+    replayer = ProviderRecorder(str(tmp_path), mode="replay")
+    replayed = replayer.call("groq_candidates", ["fish/a.png", "v1"], lambda: pytest.fail("provider called on replay"),
+                             timings, stage="groq_llm")
+    assert replayed == recorded and len(calls) == 1
+    assert len(timings["groq_llm"]) == 1 and timings["groq_llm"][0] >= 0.0
+    assert (recorder.stats, replayer.stats) == ({"live_calls": 1, "replayed_calls": 0},
+                                                {"live_calls": 0, "replayed_calls": 1})
+
+
+def test_replay_misses_raise_and_auto_records_them(tmp_path):
+    replayer = ProviderRecorder(str(tmp_path), mode="replay")
+    with pytest.raises(RecordingNotFound):
+        replayer.call("embedding", ["abc"], lambda: [0.1, 0.2])
+
+    auto = ProviderRecorder(str(tmp_path), mode="auto")
+    assert auto.call("embedding", ["abc"], lambda: [0.1, 0.2]) == [0.1, 0.2]
+    assert auto.call("embedding", ["abc"], lambda: [9.9]) == [0.1, 0.2]
+    assert replayer.call("embedding", ["abc"], lambda: [9.9]) == [0.1, 0.2]
+    assert auto.stats == {"live_calls": 1, "replayed_calls": 1}
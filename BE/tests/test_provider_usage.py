@@ -0,0 +1,29 @@
+from fake_providers import FakeGroqClient, FakeVisionModel, LatencyModel, load_species
+from provider_usage import record_gemini_usage, record_groq_usage, usage_stats
+from types import SimpleNamespace
+
+
+def test_repeated_system_prefix_is_reported_as_cached_tokens():
+    """The second Groq call with the same system prompt counts as a cache hit"""
+    groq = FakeGroqClient(FakeVisionModel("groq", load_species(), latency=LatencyModel("groq", "fixed:0", 0.0), canned={}))
+    messages = [{"role": "system", "content": "species prompt " * 50},
+                {"role": "user", "content": [{"type": "text", "text": "identify"},
+                                             {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}}]}]
+    for latency in (2.0, 1.0):
+        record_groq_usage(groq.chat.completions.create(messages=messages), latency, provider="test_groq")
+
+    stats = usage_stats()["test_groq"]
+    assert stats["calls"] == 2 and stats["cache_hit_calls"] == 1
+    assert 0 < stats["cached_token_ratio"] < 1
+    assert stats["avg_latency_s_cache_hit"] == 1.0 and stats["avg_latency_s_cache_miss"] == 2.0
+
+
+def test_gemini_usage_metadata_and_missing_usage():
+    """cached_content_token_count is read from usage_metadata; responses without usage still count"""
+    usage = SimpleNamespace(prompt_token_count=1000, cached_content_token_count=800, candidates_token_count=50)
+    record_gemini_usage(SimpleNamespace(usage_metadata=usage), 0.5, provider="test_gemini")
+    record_gemini_usage(SimpleNamespace(usage_metadata=None), 0.7, provider="test_gemini")
+
+    stats = usage_stats()["test_gemini"]
+    assert stats["calls"] == 2 and stats["cached_tokens"] == 800
+    assert stats["cached_token_ratio"] == 0.8
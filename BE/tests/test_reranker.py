@@ -0,0 +1,47 @@
+import numpy as np
+
+from reranker import Reranker, candidate_features, fit_logistic, normalize, top1_accuracy
+
+LLM = [{"fish_name": "Red lionfish", "score": 0.6}, {"fish_name": "Tomato clownfish", "score": 0.5}]
+KNN = [{"fish_name": "Tomato clownfish", "score": 0.95, "scientific_name": "Amphiprion frenatus"},
+       {"fish_name": "Whale shark", "score": 0.9}]
+
+
+def test_features_merge_lists_and_map_es_scores_to_cosine():
+    """Species are merged on name, missing signals are 0 and ES (1 + cos) / 2 scores become cosine"""
+    names, features = candidate_features(LLM, KNN, knn_normalization="minmax")
+
+    assert names == ["Red lionfish", "Tomato clownfish", "Whale shark"]
+    assert np.allclose(features["llm_score"], [0.6, 0.5, 0.0])
+    assert np.allclose(features["knn_score"], [0.0, 0.9, 0.8])
+    assert np.allclose(features["knn_norm"], [0.0, 1.0, 0.0])
+    assert np.allclose(features["in_both"], [0, 1, 0])
+    assert np.allclose(normalize(np.array([2.0, 4.0, 9.0]), np.array([True, True, False]), "max"), [0.5, 1.0, 0.0])
+
+
+def test_weighted_and_rrf_prefer_species_found_by_both_signals():
+    """Both fusions put the species from both lists first; records come from the catalogue"""
+    catalogue = {"red lionfish": {"scientific_name": "Pterois volitans"}}
+    weighted = Reranker("weighted", llm_weight=0.5).rerank(LLM, KNN, catalogue)
+    rrf = Reranker("rrf", rrf_k=60).rerank(LLM, KNN, catalogue)
+
+    assert weighted[0]["fish_name"] == rrf[0]["fish_name"] == "Tomato clownfish"
+    assert weighted[0]["scientific_name"] == "Amphiprion frenatus"  # from the kNN hit
+    assert next(r for r in weighted if r["fish_name"] == "Red lionfish")["scientific_name"] == "Pterois volitans"
+    assert abs(rrf[0]["score"] - (1 / 62 + 1 / 61)) < 1e-6
+
+
+def test_logistic_fit_learns_the_informative_feature():
+    """On data where only the kNN score predicts the label, the fitted model ranks by it"""
+    rng = np.random.default_rng(0)
+    X = rng.random((400, 6))
+    y = (X[:, 1] > 0.7).astype(float)
+    coef, intercept = fit_logistic(X, y)
+
+    assert coef[1] == max(coef)
+    weights = {"features": ["llm_score", "knn_score", "knn_norm", "llm_rrank", "knn_rrank", "in_both"],
+               "coef": coef.tolist(), "intercept": intercept}
+    ranked = Reranker("logistic", weights=weights).rerank(LLM, KNN)
+    assert ranked[0]["fish_name"] == "Tomato clownfish"
+    groups = [list(range(i, i + 4)) for i in range(0, 400, 4)]
+    assert top1_accuracy(X @ coef, y, groups) > 0.5
@@ -0,0 +1,68 @@
+from retrieval_router import RETRIEVAL_CALLS, RetrievalRouter
+from species_catalogue import SpeciesCatalogue
+
+
+class _StubIndex:
+    """search_all/index_version over a list, standing in for ElasticsearchQuery"""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def search_all(self, index_name, size=1000, exclude_fields=None):
+        return list(self.docs)
+
+    def index_version(self, index_name):
+        return (len(self.docs), 1)
+
+
+DOCS = [
+    {"fish_name": "Red lionfish", "thai_fish_name": "ปลาสิงโตแดง", "scientific_name": "Pterois volitans"},
+    {"fish_name": "Tomato clownfish", "thai_fish_name": "ปลาการ์ตูนแดง", "scientific_name": "Amphiprion frenatus"},
+    {"fish_name": "Giant grouper", "thai_fish_name": "ปลาหมอทะเล", "scientific_name": "Epinephelus lanceolatus"},
+]
+CATALOGUE = SpeciesCatalogue(_StubIndex(DOCS), "fish", check_interval_s=0)
+
+
+def _router(classifier=None):
+    return RetrievalRouter(lambda: CATALOGUE, classifier)
+
+
+def _turn(question, answer="It is a reef fish."):
+    return [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+
+
+def test_new_fish_questions_are_retrieved():
+    router = _router()
+    history = _turn("Tell me about the Red lionfish")
+
+    assert router.route("Tell me about the Red lionfish", []).species == ["Red lionfish"]
+    assert router.route("and what about ปลาการ์ตูนแดง", history).action == "retrieve"
+    assert router.route("It has orange stripes and white bands", history).action == "retrieve"
+    assert router.route("Is there a grouper like that", history).action == "retrieve"
+    assert router.stats()["retrieval_calls_saved"] == 0
+
+
+def test_follow_ups_reuse_references_and_small_talk_skips():
+    router = _router()
+    references = (["Red lionfish"], ["Red lionfish"])
+    router.remember([], "Tell me about the Red lionfish", references)
+    history = _turn("Tell me about the Red lionfish")
+
+    decision = router.route("What does it eat?", history)
+    assert decision.action == "reuse" and decision.references == references
+    assert router.route("thanks!", history).action == "skip"
+    stats = router.stats()
+    assert stats["retrieval_calls_saved"] == 2 * RETRIEVAL_CALLS and stats["retrieval_rate"] == 0
+
+
+def test_follow_up_without_references_is_rewritten_or_classified():
+    history = _turn("Tell me about this fish", "This looks like a Tomato clownfish.")
+    decision = _router().route("Is it poisonous?", history)
+    assert decision.action == "rewrite" and decision.query == "Tomato clownfish: Is it poisonous?"
+
+    decision = _router().route("Where can I find it?", _turn("What lives on coral reefs"))
+    assert decision.query == "What lives on coral reefs Where can I find it?"
+
+    router = _router(lambda question, recent: "offtopic")
+    assert router.route("Can you recommend a good recipe book for dinner tonight", history).action == "skip"
+    assert router.stats()["classifier_calls"] == 1
@@ -0,0 +1,59 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def _concurrent(flight, key, fn, n=5):
+    """Runs n callers, starting the followers only once the leader is inside fn."""
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        leader = pool.submit(flight.do, key, fn)
+        fn.started.wait(5)
+        followers = [pool.submit(flight.do, key, fn) for _ in range(n - 1)]
+        while flight.stats()["coalesced"] < n - 1:
+            time.sleep(0.001)
+        fn.release.set()
+        return [leader] + followers
+
+
+def _slow(result=None, error=None):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        fn.started.set()
+        fn.release.wait(5)
+        if error:
+            raise error
+        return result
+
+    fn.started, fn.release, fn.calls = threading.Event(), threading.Event(), calls
+    return fn
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    """Five callers with the same key run the function once and get the same object"""
+    flight = SingleFlight("identify")
+    fn = _slow(result={"results": []})
+    outcomes = [f.result() for f in _concurrent(flight, ("groq", "abc"), fn)]
+
+    assert len(fn.calls) == 1
+    assert all(result is outcomes[0][0] for result, _ in outcomes)
+    assert [shared for _, shared in outcomes] == [False, True, True, True, True]
+    assert flight.stats() == {"calls": 5, "executed": 1, "coalesced": 4, "in_flight": 0, "coalesced_rate": 0.8}
+
+
+def test_errors_are_shared_and_nothing_is_cached():
+    """Followers see the leader's exception; a later call runs again"""
+    flight = SingleFlight("embedding")
+    futures = _concurrent(flight, "text", _slow(error=RuntimeError("upstream down")), n=3)
+    for future in futures:
+        with pytest.raises(RuntimeError, match="upstream down"):
+            future.result()
+
+    assert flight.do("text", lambda: 42) == (42, False)
+    assert flight.do("other", lambda: 7) == (7, False)
+    assert flight.stats()["executed"] == 3
@@ -0,0 +1,58 @@
+from species_catalogue import SpeciesCatalogue, normalize_name
+
+
+class _StubIndex:
+    """search_all/index_version over a list, standing in for ElasticsearchQuery"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.version = 1
+        self.searches = 0
+
+    def search_all(self, index_name, size=1000, exclude_fields=None):
+        self.searches += 1
+        return list(self.docs)
+
+    def index_version(self, index_name):
+        return (len(self.docs), self.version)
+
+
+DOCS = [
+    {"fish_name": "Red lionfish", "thai_fish_name": "ปลาสิงโตแดง", "scientific_name": "Pterois volitans", "order_name": "Scorpaeniformes"},
+    {"fish_name": "Tomato clownfish", "thai_fish_name": "ปลาการ์ตูนแดง", "scientific_name": "Amphiprion frenatus", "order_name": "Perciformes"},
+]
+
+
+def test_exact_lookup_by_any_name_is_normalized():
+    """Scientific, English and Thai names resolve regardless of case, hyphens and spacing"""
+    catalogue = SpeciesCatalogue(_StubIndex(DOCS), "fish", check_interval_s=0)
+
+    assert catalogue.lookup("pterois  VOLITANS")["fish_name"] == "Red lionfish"
+    assert catalogue.lookup("Tomato-clownfish")["scientific_name"] == "Amphiprion frenatus"
+    assert catalogue.lookup("ปลาสิงโตแดง")["fish_name"] == "Red lionfish"
+    assert normalize_name(" Red_Lionfish ") == "red lionfish"
+    assert catalogue.stats["exact_hits"] == 3
+
+
+def test_fuzzy_lookup_and_enrichment():
+    """Typos fall back to the trigram index; unrelated names miss; candidates get species fields"""
+    catalogue = SpeciesCatalogue(_StubIndex(DOCS), "fish", check_interval_s=0)
+
+    assert catalogue.lookup("Amphiprion frenatis")["fish_name"] == "Tomato clownfish"
+    assert catalogue.lookup("Whale shark") is None
+    candidates = catalogue.enrich([{"fish_name": "Red Lionfish", "score": 0.9}, {"fish_name": "Unknown"}])
+    assert candidates[0]["scientific_name"] == "Pterois volitans"
+    assert candidates[1]["scientific_name"] is None
+
+
+def test_reload_only_when_index_version_changes():
+    """An unchanged version does not query the index again; a new document does"""
+    index = _StubIndex(list(DOCS))
+    catalogue = SpeciesCatalogue(index, "fish", check_interval_s=0)
+    assert not catalogue.refresh_if_changed()
+    assert index.searches == 1
+
+    index.docs.append({"fish_name": "Whale shark", "scientific_name": "Rhincodon typus"})
+    assert catalogue.refresh_if_changed()
+    assert catalogue.lookup("Rhincodon typus", fuzzy=False)["fish_name"] == "Whale shark"
+    assert len(catalogue) == 3
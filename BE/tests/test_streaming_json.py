@@ -0,0 +1,50 @@
+import json
+
+from streaming_json import IncrementalJSONParser, iter_events
+
+RESULT = {
+    "image_contains_fish": True,
+    "caption": "Orange body with three white \"bars\", edged in black",
+    "rejection_reason": None,
+    "results": [{"fish_name": "Clown anemonefish", "score": 0.91, "score_reason": "bars {1,2}"},
+                {"fish_name": "Tomato clownfish", "score": 0.2, "score_reason": "colour"}],
+}
+
+
+def _chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_fields_and_items_are_reported_as_soon_as_complete():
+    """Chunk boundaries anywhere (inside strings, escapes, numbers) give the same events"""
+    text = "```json\n" + json.dumps(RESULT) + "\n```"
+    for size in (1, 3, 7, len(text)):
+        events = list(iter_events(_chunks(text, size)))
+        assert events[1] == ("field", "image_contains_fish", True)
+        items = [e for e in events if e[0] == "item"]
+        assert [e[2] for e in items] == [0, 1]
+        assert items[0][3] == RESULT["results"][0]
+        assert events[-1] == ("done", RESULT)
+
+
+def test_first_candidate_is_available_before_the_list_is_generated():
+    """The first result is reported while the second one is still incomplete"""
+    text = json.dumps(RESULT)
+    cut = text.index('{"fish_name": "Tomato') + 10
+    parser = IncrementalJSONParser()
+    events = parser.feed(text[:cut])
+
+    assert ("item", "results", 0, RESULT["results"][0]) in events
+    assert parser.fields["caption"] == RESULT["caption"]
+    assert not parser.done
+    assert parser.feed(text[cut:])[-1] == ("done", RESULT)
+
+
+def test_rejection_is_known_after_the_first_field():
+    """A consumer can stop reading right after image_contains_fish: false"""
+    parser = IncrementalJSONParser()
+    events = parser.feed('{"image_contains_fish": false, "rejection_reason": "Cooked fi')
+
+    assert ("field", "image_contains_fish", False) in events
+    assert ("key", "rejection_reason") in events
+    assert "rejection_reason" not in parser.fields
@@ -9,7 +9,9 @@ from google.genai import types
 import requests
 import pandas as pd
 from google.genai.errors import APIError
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Union
+import time
+from provider_usage import record_gemini_usage, record_groq_usage
 
 load_dotenv()
 
@@ -291,6 +293,7 @@ def get_json_generated_image_details_groq(groq_client: Groq ,pic_string: str):
     groq_model_id = "meta-llama/llama-4-maverick-17b-128e-instruct"
     
     try:
+        start = time.perf_counter()
         completion = groq_client.chat.completions.create(
             model=groq_model_id,
             messages=[
@@ -315,6 +318,8 @@ def get_json_generated_image_details_groq(groq_client: Groq ,pic_string: str):
             response_format={"type": "json_object"}, 
         )
 
+        record_groq_usage(completion, time.perf_counter() - start, provider="groq_details")
+
         # Groq guarantees valid JSON in the response.content when JSON mode is used.
         json_string = completion.choices[0].message.content
         
@@ -340,58 +345,66 @@ def get_json_generated_image_details_groq(groq_client: Groq ,pic_string: str):
         return None
       
       
-def get_json_generated_image_details_gemini(client: genai.Client, pic_string: str) -> Optional[Dict[str, Any]]:
+# ---------------------------------------------------------
+# JSON Schemas for get_json_generated_image_details_gemini (built once)
+# ---------------------------------------------------------
+
+# Schema สำหรับรายละเอียดปลา
+GEMINI_FISH_DETAILS_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        "fish_name": types.Schema(type=types.Type.STRING, description="Common name in English."),
+        "scientific_name": types.Schema(type=types.Type.STRING, description="Scientific Latin name."),
+        "order_name": types.Schema(type=types.Type.STRING, description="Taxonomic Order in English."),
+        "physical_description": types.Schema(type=types.Type.STRING, description="Comprehensive 3-5 sentence physical description IN THAI LANGUAGE."),
+        "habitat": types.Schema(type=types.Type.STRING, description="Detailed habitat description IN THAI LANGUAGE(e.g., water type, depth, environment)."),
+    },
+    required=["fish_name", "scientific_name", "order_name", "physical_description", "habitat"]
+)
+
+# Schema หลัก
+GEMINI_DETAILS_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        "image_contains_fish": types.Schema(type=types.Type.BOOLEAN, description="True if the image contains a valid, fresh fish specimen."),
+        "fish_details": GEMINI_FISH_DETAILS_SCHEMA, 
+    },
+    required=["image_contains_fish", "fish_details"],
+)
+
+GEMINI_DETAILS_SYSTEM_CONTENT = """
+You are an expert Ichthyologist and AI assistant specializing in marine biology and taxonomy, particularly species found in Thailand. 
+Your task is to analyze the input image and generate a strictly formatted JSON response based on your internal knowledge base.
+
+--- STEP 1: VALIDATION ---
+Analyze the image to determine if it contains a VALID, LIVING, or FRESH biological specimen of a fish.
+
+You must set `image_contains_fish` to `false` if the image shows:
+1. Cooked food (fried, grilled, steamed, or plated dishes).
+2. Processed fish (fillets, heads removed, dried fish).
+3. Non-realistic images (cartoons, drawings).
+4. Poor visibility (too blurry to identify).
+
+--- STEP 2: GENERATION ---
+If the image is valid, generate the details using the schema below.
+"""
+
+GEMINI_DETAILS_CONFIG = types.GenerateContentConfig(
+    response_schema=GEMINI_DETAILS_SCHEMA, # ใช้ Schema ที่ประกาศไว้ข้างบน
+    response_mime_type="application/json",
+    temperature=0.0, 
+    system_instruction=GEMINI_DETAILS_SYSTEM_CONTENT,
+    max_output_tokens=900
+)
+
+
+def get_json_generated_image_details_gemini(client: genai.Client, pic_string: Union[str, bytes]) -> Optional[Dict[str, Any]]:
     """
     Analyzes a base64 encoded image using Gemini's Vision model
     and returns a structured JSON response based on the defined schema.
     """
     
-    # ---------------------------------------------------------
-    # 1. Define JSON Schemas (Defined locally inside function)
-    # ---------------------------------------------------------
-    
-    # Schema สำหรับรายละเอียดปลา
-    fish_details_schema = types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "fish_name": types.Schema(type=types.Type.STRING, description="Common name in English."),
-            "scientific_name": types.Schema(type=types.Type.STRING, description="Scientific Latin name."),
-            "order_name": types.Schema(type=types.Type.STRING, description="Taxonomic Order in English."),
-            "physical_description": types.Schema(type=types.Type.STRING, description="Comprehensive 3-5 sentence physical description IN THAI LANGUAGE."),
-            "habitat": types.Schema(type=types.Type.STRING, description="Detailed habitat description IN THAI LANGUAGE(e.g., water type, depth, environment)."),
-        },
-        required=["fish_name", "scientific_name", "order_name", "physical_description", "habitat"]
-    )
-
-    # Schema หลัก
-    main_json_schema = types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "image_contains_fish": types.Schema(type=types.Type.BOOLEAN, description="True if the image contains a valid, fresh fish specimen."),
-            "fish_details": fish_details_schema, 
-        },
-        required=["image_contains_fish", "fish_details"],
-    )
-
-    # ---------------------------------------------------------
-    # 2. Define System Prompt
-    # ---------------------------------------------------------
-    system_content_full = """
-    You are an expert Ichthyologist and AI assistant specializing in marine biology and taxonomy, particularly species found in Thailand. 
-    Your task is to analyze the input image and generate a strictly formatted JSON response based on your internal knowledge base.
-
-    --- STEP 1: VALIDATION ---
-    Analyze the image to determine if it contains a VALID, LIVING, or FRESH biological specimen of a fish.
-
-    You must set `image_contains_fish` to `false` if the image shows:
-    1. Cooked food (fried, grilled, steamed, or plated dishes).
-    2. Processed fish (fillets, heads removed, dried fish).
-    3. Non-realistic images (cartoons, drawings).
-    4. Poor visibility (too blurry to identify).
-
-    --- STEP 2: GENERATION ---
-    If the image is valid, generate the details using the schema below.
-    """
+    # Schemas, system prompt and config are built once at import (GEMINI_DETAILS_CONFIG)
 
     user_message = "Analyze the provided image. Identify the species and return the detailed JSON object as defined in your system instructions."
 
@@ -400,7 +413,7 @@ def get_json_generated_image_details_gemini(client: genai.Client, pic_string: st
     # ---------------------------------------------------------
     try:
         # Decode base64 เป็น bytes
-        image_bytes = base64.b64decode(pic_string)
+        image_bytes = pic_string if isinstance(pic_string, (bytes, bytearray)) else base64.b64decode(pic_string)
         print("Image bytes decoded successfully.")
         
         # เตรียม Image Part
@@ -409,24 +422,17 @@ def get_json_generated_image_details_gemini(client: genai.Client, pic_string: st
             mime_type='image/webp' 
         )
 
-        # Config Gemini
-        config = types.GenerateContentConfig(
-            response_schema=main_json_schema, # ใช้ Schema ที่ประกาศไว้ข้างบน
-            response_mime_type="application/json",
-            temperature=0.0, 
-            system_instruction=system_content_full,
-            max_output_tokens=900
-        )
-
         # Call API
+        start = time.perf_counter()
         response = client.models.generate_content(
             model='gemini-2.5-flash',
             contents=[
-                image_part,
-                user_message
+                user_message,
+                image_part
             ],
-            config=config
+            config=GEMINI_DETAILS_CONFIG
         )
+        record_gemini_usage(response, time.perf_counter() - start, provider="gemini_details")
 
         # Parse Response
         if response.text:
@@ -1,46 +1,160 @@
 # This script will be used to create a formatted CSV for embedding purposes.
+#
+# Descriptions are generated concurrently by a bounded worker pool and every
+# finished fish is appended as one line to a JSONL journal, so a crashed run can
+# be resumed without redoing the work (and without rewriting the whole
+# checkpoint after every fish). The CSV is written once at the very end.
+import argparse
+import csv
+import json
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import pandas as pd
-from physical_description_service import get_fish_description_from_watsonxai
-# Placeholder for CSV creation logic
+import requests
+from physical_description_service import get_fish_description_from_watsonxai, get_access_token, WatsonxRequestError
 
-def create_embedding_csv(output_path):
-    # Read fish names from the provided CSV
-    import csv
-    input_csv = "./DATA/fish-description-files/Marine_Fish_Species_Full_Description_test.csv"
+INPUT_CSV = "./DATA/fish-description-files/Marine_Fish_Species_Full_Description_test.csv"
+JOURNAL_PATH = "fish_descriptions_journal.jsonl"
+# Old single-file checkpoint, still read so existing progress is not lost
+LEGACY_CHECKPOINT_PATH = "fish_descriptions_checkpoint.json"
+EMPTY_DESCRIPTION = "body: , colors: , features: , unique_marks: "
+
+MAX_WORKERS = int(os.getenv("DESCRIPTION_MAX_WORKERS", "4"))
+REQUESTS_PER_SECOND = float(os.getenv("DESCRIPTION_REQUESTS_PER_SECOND", "2"))
+MAX_RETRIES = int(os.getenv("DESCRIPTION_MAX_RETRIES", "5"))
+BACKOFF_BASE_S = 1.0
+BACKOFF_MAX_S = 30.0
+
+# 429 = rate limited, 5xx = watsonx side hiccup; everything else is treated as permanent
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Spaces out calls so that at most `rate` calls per second start, across all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def is_transient_error(error):
+    if isinstance(error, WatsonxRequestError):
+        return error.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+def describe_with_retry(fish_name, limiter, max_retries=MAX_RETRIES):
+    """Calls watsonx for one fish, retrying transient failures with exponential backoff and jitter."""
+    attempt = 0
+    while True:
+        limiter.wait()
+        try:
+            return get_fish_description_from_watsonxai(fish_name, access_token=get_access_token())
+        except Exception as e:
+            unauthorized = isinstance(e, WatsonxRequestError) and e.status_code == 401
+            # 401 refreshes count against max_retries too, a persistent 401 is a bad API key
+            if not (unauthorized or is_transient_error(e)) or attempt >= max_retries:
+                raise
+            if unauthorized:
+                # Token was revoked or expired early, fetch a new one and try again
+                get_access_token(force_refresh=True)
+            delay = min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** attempt)) * random.uniform(0.5, 1.0)
+            attempt += 1
+            print(f"Retrying {fish_name} in {delay:.1f}s (attempt {attempt}/{max_retries}): {e}")
+            time.sleep(delay)
+
+
+def load_journal(journal_path=JOURNAL_PATH, legacy_path=LEGACY_CHECKPOINT_PATH):
+    """
+    Rebuilds {fish_name: description} from the legacy JSON checkpoint and the JSONL journal.
+    Later journal lines win. A half-written last line (crash mid-write) is ignored.
+    """
+    fish_descriptions = {}
+    if legacy_path and os.path.exists(legacy_path):
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            fish_descriptions.update(json.load(f))
+        print(f"Loaded legacy checkpoint with {len(fish_descriptions)} fish descriptions.")
+
+    if os.path.exists(journal_path):
+        with open(journal_path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Ignoring corrupt journal line {line_no} in {journal_path}")
+                    continue
+                if entry.get("description"):
+                    fish_descriptions[entry["fish_name"]] = entry["description"]
+        print(f"Journal replayed, {len(fish_descriptions)} fish descriptions available.")
+    return fish_descriptions
+
+
+def append_to_journal(journal_file, entry):
+    journal_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    journal_file.flush()
+    os.fsync(journal_file.fileno())
+
+
+def read_fish_names(input_csv=INPUT_CSV):
     fish_names = []
     with open(input_csv, newline='', encoding='utf-8') as csvfile:
         reader = csv.DictReader(csvfile)
         for row in reader:
             fish_names.append(row["Fish Name"])
+    return fish_names
 
-    # get fish physical descriptions with checkpointing
-    import json
-    checkpoint_path = "fish_descriptions_checkpoint.json"
-    # Try to load checkpoint if exists
-    if os.path.exists(checkpoint_path):
-        with open(checkpoint_path, "r", encoding="utf-8") as f:
-            fish_descriptions = json.load(f)
-        print(f"Loaded checkpoint with {len(fish_descriptions)} fish descriptions.")
-    else:
-        fish_descriptions = {}
-
-    for fish_name in fish_names:
-        if fish_name in fish_descriptions and isinstance(fish_descriptions[fish_name], str) and fish_descriptions[fish_name]:
-            # Already processed, skip
-            print(f"Skipping {fish_name}, already processed.")
-            continue
-        try:
-            description = get_fish_description_from_watsonxai(fish_name)
-            fish_descriptions[fish_name] = description
-        except Exception as e:
-            print(f"Error getting description for {fish_name}: {e}")
-            fish_descriptions[fish_name] = "body: , colors: , features: , unique_marks: "
-        # Save checkpoint after each fish
-        with open(checkpoint_path, "w", encoding="utf-8") as f:
-            json.dump(fish_descriptions, f, ensure_ascii=False, indent=2)
-        print(f"Processed {len(fish_descriptions)} out of {len(fish_names)} fish descriptions (checkpoint saved)")
-        
+
+def generate_descriptions(fish_names, journal_path=JOURNAL_PATH, max_workers=MAX_WORKERS, requests_per_second=REQUESTS_PER_SECOND):
+    """Fills in every missing description, journaling each result as soon as it arrives."""
+    fish_descriptions = load_journal(journal_path)
+    pending = [name for name in fish_names if not fish_descriptions.get(name)]
+    print(f"{len(fish_names) - len(pending)} already described, {len(pending)} to go "
+          f"({max_workers} workers, {requests_per_second} req/s)")
+    if not pending:
+        return fish_descriptions
+
+    limiter = RateLimiter(requests_per_second)
+    done = 0
+    with open(journal_path, "a", encoding="utf-8") as journal_file, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(describe_with_retry, name, limiter): name for name in pending}
+        for future in as_completed(futures):
+            fish_name = futures[future]
+            done += 1
+            try:
+                description = future.result()
+                fish_descriptions[fish_name] = description
+                append_to_journal(journal_file, {"fish_name": fish_name, "description": description, "ts": time.time()})
+                print(f"[{done}/{len(pending)}] Described {fish_name}")
+            except Exception as e:
+                # Failures are journaled for visibility but not marked done, so a rerun retries them
+                append_to_journal(journal_file, {"fish_name": fish_name, "error": str(e), "ts": time.time()})
+                print(f"[{done}/{len(pending)}] Error getting description for {fish_name}: {e}")
+    return fish_descriptions
+
+
+def create_embedding_csv(output_path, max_workers=MAX_WORKERS, requests_per_second=REQUESTS_PER_SECOND):
+    # Read fish names from the provided CSV
+    fish_names = read_fish_names()
+
+    # get fish physical descriptions, resuming from the journal
+    fish_descriptions = generate_descriptions(fish_names, max_workers=max_workers, requests_per_second=requests_per_second)
 
     # Prepare new rows
     rows = []
@@ -53,18 +167,19 @@ def create_embedding_csv(output_path):
         ]
         rows.append({
             "Fish Name": fish,
-            "Physical Description": fish_descriptions[fish],
+            "Physical Description": fish_descriptions.get(fish) or EMPTY_DESCRIPTION,
             "Object Names": ", ".join(object_names)
         })
 
-    # Write to new CSV
+    # Write to new CSV in a single pass
     df = pd.DataFrame(rows)
     df.to_csv(output_path, index=False)
+    print(f"Wrote {len(rows)} rows to {output_path}")
 
 if __name__ == "__main__":
-    # Example usage (to be updated with actual logic)
-    create_embedding_csv("embedding_format.csv")
-    
-
-
-
+    parser = argparse.ArgumentParser(description="Generate physical descriptions and build the embedding CSV")
+    parser.add_argument("--output", default="embedding_format.csv")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--rps", type=float, default=REQUESTS_PER_SECOND, help="max watsonx requests started per second")
+    args = parser.parse_args()
+    create_embedding_csv(args.output, max_workers=args.workers, requests_per_second=args.rps)
@@ -3,6 +3,8 @@ import base64
 import os
 import http.client
 import json
+import threading
+import time
 import requests
 import pandas as pd
 
@@ -14,15 +16,48 @@ project_id = os.getenv("PROJECT_ID", None)
 ibm_cloud_iam_url = os.getenv("IAM_IBM_CLOUD_URL", None)
 chat_url = os.getenv("IBM_WATSONX_AI_INFERENCE_URL", None)
 
-def get_fish_description_from_watsonxai(fish_name):
-    conn_ibm_cloud_iam = http.client.HTTPSConnection(ibm_cloud_iam_url)
-    payload = "grant_type=urn%3Aibm%3Aparams%3Aoauth%3Agrant-type%3Aapikey&apikey=" + watsonx_api_key
-    headers = {'Content-Type': "application/x-www-form-urlencoded"}
-    conn_ibm_cloud_iam.request("POST", "/identity/token", payload, headers)
-    res = conn_ibm_cloud_iam.getresponse()
-    data = res.read()
-    decoded_json = json.loads(data.decode("utf-8"))
-    access_token = decoded_json["access_token"]
+# Refresh the IAM token this many seconds before it actually expires
+TOKEN_REFRESH_MARGIN_S = 300
+
+_token_lock = threading.Lock()
+_cached_token = None
+_cached_token_expiry = 0.0
+
+
+class WatsonxRequestError(Exception):
+    """Raised when the watsonx chat endpoint answers with a non-200 status."""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"Non-200 response ({status_code}): {text}")
+        self.status_code = status_code
+
+
+def get_access_token(force_refresh=False):
+    """
+    Returns a cached IAM access token and only asks IAM for a new one when
+    the current token is about to expire. Safe to call from several threads.
+    """
+    global _cached_token, _cached_token_expiry
+    with _token_lock:
+        if not force_refresh and _cached_token and time.time() < _cached_token_expiry - TOKEN_REFRESH_MARGIN_S:
+            return _cached_token
+
+        conn_ibm_cloud_iam = http.client.HTTPSConnection(ibm_cloud_iam_url)
+        payload = "grant_type=urn%3Aibm%3Aparams%3Aoauth%3Agrant-type%3Aapikey&apikey=" + watsonx_api_key
+        headers = {'Content-Type': "application/x-www-form-urlencoded"}
+        conn_ibm_cloud_iam.request("POST", "/identity/token", payload, headers)
+        res = conn_ibm_cloud_iam.getresponse()
+        data = res.read()
+        decoded_json = json.loads(data.decode("utf-8"))
+        _cached_token = decoded_json["access_token"]
+        # IAM returns an absolute "expiration" (epoch seconds) next to the relative "expires_in"
+        _cached_token_expiry = float(decoded_json.get("expiration") or time.time() + decoded_json.get("expires_in", 3600))
+        return _cached_token
+
+
+def get_fish_description_from_watsonxai(fish_name, access_token=None):
+    if access_token is None:
+        access_token = get_access_token()
 
     system_content = """You are a helpful, respectful and honest assistant. Always answer as helpfully as possible, while being safe. Your answers should not include any harmful, unethical, racist, sexist, toxic, dangerous, or illegal content. Please ensure that your responses are socially unbiased and positive in nature. If a question does not make any sense, or is not factually coherent, explain why instead of answering something not correct. If you don't know the answer to a question, please don't share false information. Do not use markdown formatting in your response."""
     user_message = f"""Please provide a detailed description of the fish species named '{fish_name}' focusing on the following aspects:\n    1. Body shape and size\n    2. Coloration patterns and markings\n    3. Distinctive features (fins, scales, head shape, etc.)\n    4. Any unique identifying characteristics\n\nReturn your answer as a single string in the following format (do not use JSON, do not add extra text):\nbody: ...; colors: ...; features: ...; unique_marks: ...\n"""
@@ -54,11 +89,12 @@ def get_fish_description_from_watsonxai(fish_name):
     response = requests.post(
         chat_url,
         headers=headers,
-        json=body
+        json=body,
+        timeout=120
     )
 
     if response.status_code != 200:
-        raise Exception("Non-200 response: " + str(response.text))
+        raise WatsonxRequestError(response.status_code, str(response.text))
 
     data = response.json()
     return data['choices'][0]['message']['content']
@@ -1,9 +1,8 @@
 import csv
-import json
+from create_embedding_csv import load_journal
 
-# Load JSON data
-with open('fish_descriptions_checkpoint.json', 'r', encoding='utf-8') as f_json:
-    fish_desc = json.load(f_json)
+# Load descriptions (legacy JSON checkpoint + JSONL journal)
+fish_desc = load_journal()
 
 # Read CSV and update Physical Description
 input_csv = 'DATA/fish-description-files/Marine_Fish_Species_Formatted.csv'
@@ -70,6 +70,35 @@ class ElasticsearchManager:
             print(f"Index '{index_name}' already exists.")
         return index_name
 
+    def create_image_index(self, index_name, dims, meta=None):
+        """Per-image reference vectors (one document per COS object) for the image kNN fast path."""
+        if self.es.indices.exists(index=index_name):
+            print(f"Index '{index_name}' already exists.")
+            return index_name
+        mappings = {
+            "mappings": {
+                "_meta": meta or {},
+                "properties": {
+                    "fish_name": {"type": "keyword"},
+                    "object_key": {"type": "keyword"},
+                    "etag": {"type": "keyword"},
+                    "model_name": {"type": "keyword"},
+                    "image_embedding": {
+                        "type": "dense_vector",
+                        "dims": dims,
+                        "similarity": "cosine"
+                    }
+                }
+            }
+        }
+        self.es.indices.create(index=index_name, body=mappings)
+        print(f"Index '{index_name}' created.")
+        return index_name
+
+    def set_index_meta(self, index_name, meta):
+        """Replaces the mapping _meta (model name, calibrated margin) read by the BE at startup."""
+        self.es.indices.put_mapping(index=index_name, body={"_meta": meta})
+
     def delete_index(self, index_name):
         try:
             response = self.es.indices.delete(index=index_name)
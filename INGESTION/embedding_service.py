@@ -1,16 +1,26 @@
 import os
+import sys
 import requests
+import numpy as np
 from typing import List, Union
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 
+# The embedding cache and the response decoder are shared with the BE
+BE_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "BE"))
+if BE_DIR not in sys.path:
+    sys.path.append(BE_DIR)
+from embedding_cache import EmbeddingCache
+from embedding_wire_format import WIRE_FORMATS, decode_embedding_response
+
 
 class EmbeddingService:
-    def __init__(self, embedding_type: str = "watsonx", model_name: str = None):
+    def __init__(self, embedding_type: str = "watsonx", model_name: str = None, use_cache: bool = None):
         self.embedding_type = embedding_type.lower()
+        self.model_name = model_name or os.getenv("EMBEDDING_MODEL_NAME", 'Snowflake/snowflake-arctic-embed-l-v2.0')
         print(f"Using embedding type: {self.embedding_type}")
         if self.embedding_type == "sentence_transformer":
-            self.model = SentenceTransformer(model_name or 'Snowflake/snowflake-arctic-embed-l-v2.0')
+            self.model = SentenceTransformer(self.model_name)
         elif self.embedding_type == "watsonx":
             load_dotenv()
             self.emb_url = os.getenv("EMBEDDING_SERVICE_URL")
@@ -18,20 +28,47 @@ class EmbeddingService:
                 raise ValueError("EMBEDDING_SERVICE_URL environment variable required")
         else:
             raise ValueError("embedding_type must be 'sentence_transformer' or 'watsonx'")
+
+        self.request_batch_size = int(os.getenv("EMBEDDING_REQUEST_BATCH_SIZE", "32"))
+        wire_format = os.getenv("EMBEDDING_WIRE_FORMAT", "json").lower()
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"EMBEDDING_WIRE_FORMAT must be one of {list(WIRE_FORMATS)}")
+        self.accept = WIRE_FORMATS[wire_format]
+        if use_cache is None:
+            use_cache = os.getenv("EMBEDDING_CACHE_ENABLED", "1") == "1"
+        self.cache = EmbeddingCache(self.model_name, int(os.getenv("EMBEDDING_DIM", "1024"))) if use_cache else None
+
+    def _compute(self, sentences: List[str]):
+        """Embeds a list of sentences without touching the cache."""
+        if self.embedding_type == "sentence_transformer":
+            return list(self.model.encode(sentences))
+        # The embedding service accepts a batch and returns one [sentence, vector] pair per input
+        embeddings = []
+        for start in range(0, len(sentences), self.request_batch_size):
+            batch = sentences[start:start + self.request_batch_size]
+            response = requests.post(self.emb_url, json={"sentence": batch}, headers={"Accept": self.accept})
+            response.raise_for_status()
+            embeddings.extend(decode_embedding_response(response))
+        return embeddings
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache else {"enabled": False}
     
     def embed_text(self, sentences: Union[str, List[str]]):
         single_input = isinstance(sentences, str)
         print(f"Embedding input: {sentences}")
         if single_input:
             sentences = [sentences]
-        
+        sentences = list(sentences)
+
+        if self.cache is not None:
+            embeddings = self.cache.embed_with_cache(sentences, self._compute)
+        else:
+            embeddings = self._compute(sentences)
+
         if self.embedding_type == "sentence_transformer":
-            embeddings = self.model.encode(sentences)
-        else:  # watsonx
-            print("Using WatsonX for embedding...")
-            embeddings = []
-            for sentence in sentences:
-                response = requests.post(self.emb_url, json={"sentence": [sentence]})
-                embeddings.append(response.json()["predictions"][0]["values"][0][1])
-        
+            embeddings = np.vstack(embeddings)
+        else:
+            embeddings = [np.asarray(e, dtype=np.float32).tolist() for e in embeddings]
+
         return embeddings[0] if single_input else embeddings
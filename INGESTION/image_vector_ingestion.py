@@ -0,0 +1,259 @@
+# Reference photo vectors for the image kNN fast path (BE/image_knn.py).
+#
+# Lists fish_images/<Species>/<image> in COS (the "Object Names" that
+# EXTRACTION/create_embedding_csv.py writes, three per species). New or changed
+# objects are downloaded on a thread pool and embedded with the BE image
+# embedder while the next batch downloads. Each image becomes one vector with
+# its species, written either to an Elasticsearch index (one document per
+# object) or to the .npz file the BE loads.
+#
+# Runs are incremental. image_vectors.jsonl keeps the ETag, species and vector
+# of every object, so only objects whose ETag changed are downloaded and
+# embedded again. A second checkpoint per ES index records what is already
+# indexed. Objects that disappeared from the bucket are removed from the output.
+#
+# Usage (from the INGESTION folder):
+#   python image_vector_ingestion.py --output npz
+#   python image_vector_ingestion.py --output es --index fish_image_index_v1
+#   python image_vector_ingestion.py --output npz --csv ../EXTRACTION/embedding_format.csv
+#   python image_vector_ingestion.py --output npz --fake-cos   # EXTRACTION/DATA stands in for the bucket
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+from pipeline import DEFAULT_CHECKPOINT_DIR, StageCheckpoint, fingerprint
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BE_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "BE"))
+if BE_DIR not in sys.path:
+    sys.path.append(BE_DIR)
+
+BUCKET_NAME = 'fish-image-bucket'
+DEFAULT_PREFIX = "fish_images/"
+DEFAULT_INDEX_NAME = "fish_image_index_v1"
+DEFAULT_NPZ_PATH = os.path.join(BE_DIR, "image_knn_index.npz")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+DOWNLOAD_WORKERS = int(os.getenv("IMAGE_INGEST_WORKERS", "16"))
+EMBED_BATCH_SIZE = int(os.getenv("IMAGE_INGEST_BATCH_SIZE", "16"))
+ES_BULK_SIZE = 200
+
+
+def make_cos_client(fake=False):
+    if fake:
+        from fake_providers import FakeCOSClient, LatencyModel
+        return FakeCOSClient(latency=LatencyModel("cos", "fixed:0", 0.0))
+    import ibm_boto3
+    from ibm_botocore.client import Config
+    return ibm_boto3.client(
+        's3',
+        ibm_api_key_id=os.environ.get('IBM_COS_API_KEY'),
+        ibm_service_instance_id=os.environ.get('IBM_COS_RESOURCE_INSTANCE_ID'),
+        config=Config(signature_version='oauth'),
+        endpoint_url=os.environ.get('IBM_COS_ENDPOINT')
+    )
+
+
+def species_from_key(key, prefix):
+    folder = key[len(prefix):].split("/")[0]
+    return " ".join(folder.replace("_", "-").split("-")).strip()
+
+
+def document_id(key):
+    return re.sub(r"[^a-z0-9]+", "-", key.lower()).strip("-")
+
+
+def list_objects(cos, bucket, prefix):
+    """{key: etag} for every image under prefix. One listing call per 1000 objects, no per-object HEAD."""
+    objects = {}
+    for page in cos.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].lower().endswith(IMAGE_EXTENSIONS) and "/" in obj["Key"][len(prefix):]:
+                objects[obj["Key"]] = obj["ETag"].strip('"')
+    return objects
+
+
+def csv_objects(csv_path):
+    """{key: species} from the "Object Names" column of the embedding CSV."""
+    objects = {}
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            for key in (row.get("Object Names") or "").split(","):
+                if key.strip():
+                    objects[key.strip()] = row["Fish Name"].strip()
+    return objects
+
+
+def reference_objects(cos, bucket, prefix, csv_path=None):
+    """{key: (species, etag)} for the objects to index; CSV entries missing from the bucket are reported."""
+    etags = list_objects(cos, bucket, prefix)
+    if not csv_path:
+        return {key: (species_from_key(key, prefix), etag) for key, etag in etags.items()}, []
+    named = csv_objects(csv_path)
+    missing = sorted(key for key in named if key not in etags)
+    return {key: (species, etags[key]) for key, species in named.items() if key in etags}, missing
+
+
+def sync_vectors(cos, bucket, objects, embedder, checkpoint, workers=DOWNLOAD_WORKERS, batch_size=EMBED_BATCH_SIZE):
+    """
+    Embeds every object whose (ETag, species, model) is not in the checkpoint.
+    The next batch downloads while the current one is embedded, and at most
+    two batches of image bytes are held in memory.
+    """
+    stats = {"listed": len(objects), "unchanged": 0, "embedded": 0, "failed": 0}
+    todo = []
+    for key, (species, etag) in sorted(objects.items()):
+        input_hash = fingerprint(etag, species, embedder.model_name)
+        if checkpoint.lookup(key, input_hash) is not None:
+            stats["unchanged"] += 1
+        else:
+            todo.append((key, species, etag, input_hash))
+
+    def download(item):
+        return cos.get_object(Bucket=bucket, Key=item[0])["Body"].read()
+
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = [pool.submit(download, item) for item in batches[0]] if batches else []
+        for i, batch in enumerate(batches):
+            current = pending
+            pending = [pool.submit(download, item) for item in batches[i + 1]] if i + 1 < len(batches) else []
+            ready = []
+            for item, future in zip(batch, current):
+                try:
+                    ready.append((item, future.result()))
+                except Exception as e:
+                    print(f"✗ Download of {item[0]} failed: {e}")
+                    stats["failed"] += 1
+            if not ready:
+                continue
+            try:
+                vectors = embedder.embed([data for _, data in ready])
+            except Exception as e:
+                print(f"✗ Embedding a batch of {len(ready)} images failed: {e}")
+                stats["failed"] += len(ready)
+                continue
+            for ((key, species, etag, input_hash), _), vector in zip(ready, vectors):
+                checkpoint.save(key, input_hash, {"species": species, "etag": etag,
+                                                  "vector": [round(float(x), 6) for x in vector]})
+            stats["embedded"] += len(ready)
+            print(f"Embedded {stats['embedded']}/{len(todo)} changed images")
+    return stats
+
+
+def current_entries(checkpoint, objects, model_name):
+    """[(key, species, etag, vector)] for every listed object that has an up-to-date vector."""
+    entries = []
+    for key, (species, etag) in sorted(objects.items()):
+        output = checkpoint.lookup(key, fingerprint(etag, species, model_name))
+        if output is not None:
+            entries.append((key, species, etag, output["vector"]))
+    return entries
+
+
+def calibrated_index(entries, model_name, target_precision):
+    from image_knn import ImageKNNIndex, calibrate
+    index = ImageKNNIndex(np.asarray([e[3] for e in entries], dtype=np.float32), [e[1] for e in entries],
+                          [e[0] for e in entries], model_name)
+    return index, calibrate(index, target_precision)
+
+
+def write_es(entries, index_name, model_name, report, checkpoint_dir, reindex=False):
+    """Indexes new/changed vectors and deletes documents of objects that are gone."""
+    from elasticsearch.helpers import bulk
+    from elasticsearch_manager import ElasticsearchManager
+    esm = ElasticsearchManager(os.environ["es_endpoint"], os.environ["es_username"], os.environ["es_password"])
+    meta = {"model_name": model_name, "margin_threshold": report["margin_threshold"]
+            if np.isfinite(report["margin_threshold"]) else None,
+            "references": report["references"], "species": report["species"]}
+    esm.create_image_index(index_name, len(entries[0][3]), meta)
+    esm.set_index_meta(index_name, meta)
+    indexed = StageCheckpoint(os.path.join(checkpoint_dir, f"image_vectors_es_{index_name}.jsonl"))
+    stats = {"indexed": 0, "deleted": 0}
+    try:
+        actions, saves = [], []
+        for key, species, etag, vector in entries:
+            input_hash = fingerprint(etag, species, model_name)
+            if not reindex and indexed.lookup(key, input_hash) is not None:
+                continue
+            actions.append({"_index": index_name, "_id": document_id(key), "_source": {
+                "fish_name": species, "object_key": key, "etag": etag, "model_name": model_name,
+                "image_embedding": vector}})
+            saves.append((key, input_hash))
+        listed = {e[0] for e in entries}
+        for key, entry in list(indexed.entries.items()):
+            if key not in listed and not entry["output"].get("deleted"):
+                actions.append({"_op_type": "delete", "_index": index_name, "_id": document_id(key)})
+                saves.append((key, None))
+        for start in range(0, len(actions), ES_BULK_SIZE):
+            chunk = actions[start:start + ES_BULK_SIZE]
+            _, errors = bulk(esm.es, chunk, raise_on_error=False)
+            failed = {error.get("index", error.get("delete", {})).get("_id") for error in errors or []}
+            for action, (key, input_hash) in zip(chunk, saves[start:start + ES_BULK_SIZE]):
+                if action["_id"] in failed:
+                    print(f"✗ Bulk {action.get('_op_type', 'index')} of {key} failed")
+                elif input_hash is None:
+                    indexed.save(key, "deleted", {"deleted": True})
+                    stats["deleted"] += 1
+                else:
+                    indexed.save(key, input_hash, {"_id": action["_id"]})
+                    stats["indexed"] += 1
+    finally:
+        indexed.close()
+    return stats
+
+
+def run(output="npz", prefix=DEFAULT_PREFIX, csv_path=None, index_name=DEFAULT_INDEX_NAME, npz_path=DEFAULT_NPZ_PATH,
+        checkpoint_dir=DEFAULT_CHECKPOINT_DIR, target_precision=0.97, fake_cos=False, reindex=False):
+    from image_knn import ImageEmbedder
+    start = time.time()
+    cos = make_cos_client(fake_cos)
+    objects, missing = reference_objects(cos, BUCKET_NAME, prefix, csv_path)
+    if missing:
+        print(f"✗ {len(missing)} objects named in the CSV are not in the bucket, e.g. {missing[:3]}")
+
+    embedder = ImageEmbedder()
+    checkpoint = StageCheckpoint(os.path.join(checkpoint_dir, "image_vectors.jsonl"))
+    try:
+        stats = sync_vectors(cos, BUCKET_NAME, objects, embedder, checkpoint)
+    finally:
+        checkpoint.close()
+    stats["missing"] = len(missing)
+    entries = current_entries(checkpoint, objects, embedder.model_name)
+    if not entries:
+        print("No reference vectors, nothing written")
+        return stats
+
+    index, report = calibrated_index(entries, embedder.model_name, target_precision)
+    if output == "npz":
+        index.save(npz_path)
+        print(f"Wrote {len(entries)} vectors to {npz_path}")
+    else:
+        stats.update(write_es(entries, index_name, embedder.model_name, report, checkpoint_dir, reindex))
+    print(f"Image vectors finished in {time.time() - start:.1f}s: {stats}")
+    print(f"Calibration: {report}")
+    return stats
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Incremental fish_images/ -> image embedding -> ES/.npz ingestion")
+    parser.add_argument("--output", choices=("npz", "es"), default="npz")
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX)
+    parser.add_argument("--csv", default=None, help="only index the Object Names of this embedding CSV")
+    parser.add_argument("--index", default=DEFAULT_INDEX_NAME)
+    parser.add_argument("--npz", default=DEFAULT_NPZ_PATH)
+    parser.add_argument("--checkpoint-dir", default=DEFAULT_CHECKPOINT_DIR)
+    parser.add_argument("--target-precision", type=float, default=0.97)
+    parser.add_argument("--fake-cos", action="store_true", help="read EXTRACTION/DATA instead of COS")
+    parser.add_argument("--reindex", action="store_true", help="push every vector to ES again (no re-embedding)")
+    args = parser.parse_args()
+    run(output=args.output, prefix=args.prefix, csv_path=args.csv, index_name=args.index, npz_path=args.npz,
+        checkpoint_dir=args.checkpoint_dir, target_precision=args.target_precision, fake_cos=args.fake_cos,
+        reindex=args.reindex)
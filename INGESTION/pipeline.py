@@ -0,0 +1,442 @@
+# Streaming CSV -> describe -> embed -> Elasticsearch pipeline.
+#
+# Replaces create_embedding_csv.py -> fish_descriptions_checkpoint.json ->
+# updating_description.py -> *_updated.csv -> main.py with one command.
+# Records flow through bounded queues so the stages overlap, and every stage
+# keeps an append-only JSONL checkpoint keyed by a hash of its inputs: a record
+# whose inputs did not change since the last run is not sent to watsonx, the
+# embedding service or Elasticsearch again.
+#
+# Usage (from the INGESTION folder):
+#   python pipeline.py --csv ../EXTRACTION/DATA/fish-description-files/Marine_Fish_Species_Formatted_updated.csv
+#   python pipeline.py --stages load,embed,ingest      # keep the CSV descriptions
+#   python pipeline.py --stages load,describe          # only refresh descriptions
+import argparse
+import csv
+import hashlib
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EXTRACTION_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "EXTRACTION"))
+
+DEFAULT_CSV = os.path.join(EXTRACTION_DIR, "DATA", "fish-description-files", "Marine_Fish_Species_Formatted_updated.csv")
+DEFAULT_CHECKPOINT_DIR = os.path.join(BASE_DIR, "pipeline_checkpoints")
+DEFAULT_INDEX_NAME = 'fish_index_v4'
+ALL_STAGES = ["load", "describe", "embed", "ingest"]
+
+# Bump when the describe prompt changes so cached descriptions are regenerated
+DESCRIBE_PROMPT_VERSION = "v1"
+
+_END = object()  # end-of-stream marker passed between stages
+
+
+def fingerprint(*parts):
+    """Stable hash of the values a stage consumes."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(json.dumps(part, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+def record_key(record):
+    return record["Fish Name"].strip()
+
+
+def document_id(record):
+    # Deterministic _id so re-ingesting a species overwrites it instead of duplicating it
+    return re.sub(r"[^a-z0-9]+", "-", record_key(record).lower()).strip("-")
+
+
+class StageCheckpoint:
+    """Append-only JSONL file of {key, input_hash, output}. The last entry per key wins."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn write from a crash
+                    self.entries[entry["key"]] = entry
+        self._file = None
+
+    def lookup(self, key, input_hash):
+        entry = self.entries.get(key)
+        if entry and entry["input_hash"] == input_hash:
+            return entry["output"]
+        return None
+
+    def latest(self, key):
+        entry = self.entries.get(key)
+        return entry["output"] if entry else None
+
+    def save(self, key, input_hash, output):
+        entry = {"key": key, "input_hash": input_hash, "output": output, "ts": time.time()}
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self.entries[key] = entry
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Stage:
+    """
+    Base class for a pipeline stage. Subclasses implement `input_hash` and
+    `run_batch`; `apply_output` merges a (cached or fresh) output into the record.
+    An enabled stage skips records whose input hash matches its checkpoint and
+    replays the stored output. A disabled stage passes records through
+    unchanged, so e.g. --stages load,embed,ingest keeps the CSV descriptions.
+    """
+    name = "stage"
+    batch_size = 1
+    workers = 1
+
+    def __init__(self, checkpoint_dir, enabled=True):
+        self.checkpoint = StageCheckpoint(os.path.join(checkpoint_dir, f"{self.name}.jsonl"))
+        self.enabled = enabled
+        self.stats = {"processed": 0, "cached": 0, "passed_through": 0, "failed": 0}
+        self._stats_lock = threading.Lock()
+
+    def input_hash(self, record):
+        raise NotImplementedError
+
+    def run_batch(self, records):
+        """Returns one output per record (same order); None marks that record as failed."""
+        raise NotImplementedError
+
+    def apply_output(self, record, output):
+        record.update(output)
+        return record
+
+    def open(self):
+        pass
+
+    def close(self):
+        self.checkpoint.close()
+
+    def _count(self, stat, n=1):
+        with self._stats_lock:
+            self.stats[stat] += n
+
+    def process(self, records):
+        if not self.enabled:
+            self._count("passed_through", len(records))
+            return records
+        todo = []
+        for record in records:
+            h = self.input_hash(record)
+            cached = self.checkpoint.lookup(record_key(record), h)
+            if cached is not None:
+                self.apply_output(record, cached)
+                self._count("cached")
+            else:
+                todo.append((record, h))
+
+        if todo:
+            try:
+                outputs = self.run_batch([record for record, _ in todo])
+            except Exception as e:
+                print(f"✗ [{self.name}] batch of {len(todo)} failed: {e}")
+                self._count("failed", len(todo))
+                for record, _ in todo:
+                    record.setdefault("_failed_stages", []).append(self.name)
+                return records
+            for (record, h), output in zip(todo, outputs):
+                if output is None:
+                    self._count("failed")
+                    record.setdefault("_failed_stages", []).append(self.name)
+                    continue
+                self.checkpoint.save(record_key(record), h, output)
+                self.apply_output(record, output)
+                self._count("processed")
+        return records
+
+
+class LoadStage(Stage):
+    """Streams rows out of the CSV; its checkpoint records which rows are new or changed."""
+    name = "load"
+
+    def __init__(self, checkpoint_dir, csv_path, enabled=True):
+        super().__init__(checkpoint_dir, enabled=enabled)
+        self.csv_path = csv_path
+
+    def input_hash(self, record):
+        return fingerprint(record)
+
+    def iter_records(self):
+        with open(self.csv_path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                if not row.get("Fish Name"):
+                    continue
+                key = record_key(row)
+                h = self.input_hash(row)
+                if self.checkpoint.lookup(key, h) is not None:
+                    self._count("cached")
+                else:
+                    self.checkpoint.save(key, h, {"row_hash": h})
+                    self._count("processed")
+                yield dict(row)
+
+
+class DescribeStage(Stage):
+    """Generates the physical description with watsonx (reuses the EXTRACTION journal when possible)."""
+    name = "describe"
+    workers = int(os.getenv("DESCRIPTION_MAX_WORKERS", "4"))
+
+    def input_hash(self, record):
+        return fingerprint(record_key(record), DESCRIBE_PROMPT_VERSION)
+
+    def open(self):
+        if not self.enabled:
+            return
+        if EXTRACTION_DIR not in sys.path:
+            sys.path.append(EXTRACTION_DIR)
+        from create_embedding_csv import RateLimiter, REQUESTS_PER_SECOND, describe_with_retry, load_journal
+        self._describe = describe_with_retry
+        self._limiter = RateLimiter(REQUESTS_PER_SECOND)
+        self._journal = load_journal(
+            os.path.join(EXTRACTION_DIR, "fish_descriptions_journal.jsonl"),
+            os.path.join(EXTRACTION_DIR, "fish_descriptions_checkpoint.json"),
+        )
+
+    def run_batch(self, records):
+        outputs = []
+        for record in records:
+            description = self._journal.get(record_key(record)) or self._describe(record_key(record), self._limiter)
+            outputs.append({"Physical Description": description})
+        return outputs
+
+
+class EmbedStage(Stage):
+    """Embeds general and physical descriptions in micro-batches."""
+    name = "embed"
+    batch_size = int(os.getenv("PIPELINE_EMBED_BATCH_SIZE", "16"))
+
+    def input_hash(self, record):
+        return fingerprint(record.get("General Description", ""), record.get("Physical Description", ""))
+
+    def open(self):
+        if not self.enabled:
+            return
+        from embedding_service import EmbeddingService
+        self.emb = EmbeddingService('watsonx')
+
+    def run_batch(self, records):
+        texts = []
+        for record in records:
+            texts.append(record.get("General Description", "") or "")
+            texts.append(record.get("Physical Description", "") or "")
+        vectors = self.emb.embed_text(texts)
+        outputs = []
+        for i in range(len(records)):
+            outputs.append({
+                "general_description_embedding": [float(x) for x in vectors[2 * i]],
+                "physical_description_embedding": [float(x) for x in vectors[2 * i + 1]],
+            })
+        return outputs
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_es_document(record):
+    return {
+        "fish_name": record["Fish Name"],
+        "thai_fish_name": record.get("Thai Fish Name"),
+        "scientific_name": record.get("Scientific Name"),
+        "order_name": record.get("Order Name"),
+        "general_description": record.get("General Description"),
+        "physical_description": record.get("Physical Description"),
+        "habitat": record.get("habitat"),
+        "avg_length_cm": _to_float(record.get("Avg Length(cm)")),
+        "avg_age_years": _to_float(record.get("Avg Age(years)")),
+        "avg_depthlevel_m": _to_float(record.get("Avg DepthLevel(m)")),
+        "avg_weight_kg": _to_float(record.get("Avg Weight(kg)")),
+        "general_description_embedding": record.get("general_description_embedding"),
+        "physical_description_embedding": record.get("physical_description_embedding"),
+    }
+
+
+class IngestStage(Stage):
+    """Bulk-indexes documents with deterministic ids, one bulk request per batch."""
+    name = "ingest"
+    batch_size = int(os.getenv("PIPELINE_INGEST_BATCH_SIZE", "50"))
+
+    def __init__(self, checkpoint_dir, index_name, enabled=True):
+        super().__init__(checkpoint_dir, enabled=enabled)
+        self.index_name = index_name
+
+    def input_hash(self, record):
+        return fingerprint(self.index_name, to_es_document(record))
+
+    def open(self):
+        if not self.enabled:
+            return
+        from elasticsearch_manager import ElasticsearchManager
+        self.esm = ElasticsearchManager(os.environ["es_endpoint"], os.environ["es_username"], os.environ["es_password"])
+        self.esm.create_index(self.index_name)
+
+    def apply_output(self, record, output):
+        return record
+
+    def run_batch(self, records):
+        from elasticsearch.helpers import bulk
+        ready = [r for r in records if r.get("physical_description_embedding") is not None]
+        if len(ready) != len(records):
+            print(f"✗ [{self.name}] {len(records) - len(ready)} records have no embeddings, run the embed stage first")
+        if ready:
+            actions = [
+                {"_index": self.index_name, "_id": document_id(r), "_source": to_es_document(r)}
+                for r in ready
+            ]
+            success, errors = bulk(self.esm.es, actions, raise_on_error=False)
+            if errors:
+                raise RuntimeError(f"bulk indexing errors: {errors}")
+        # Only the records without embeddings fail, the rest of the batch is indexed
+        return [{"_id": document_id(r)} if r.get("physical_description_embedding") is not None else None
+                for r in records]
+
+
+def _process(stage, batch):
+    """stage.process, marking the batch failed on errors outside run_batch (input hash, checkpoint)."""
+    try:
+        return stage.process(batch)
+    except Exception as e:
+        print(f"✗ [{stage.name}] batch of {len(batch)} failed: {e}")
+        stage._count("failed", len(batch))
+        for record in batch:
+            if stage.name not in record.setdefault("_failed_stages", []):
+                record["_failed_stages"].append(stage.name)
+        return batch
+
+
+def _run_stage(stage, in_queue, out_queue, finished):
+    """Worker loop: pull records, process in batches, push downstream."""
+    batch = []
+    try:
+        while True:
+            item = in_queue.get()
+            if item is _END:
+                # Let sibling workers of the same stage see the marker as well
+                in_queue.put(_END)
+                break
+            batch.append(item)
+            if len(batch) >= stage.batch_size or in_queue.empty():
+                for record in _process(stage, batch):
+                    out_queue.put(record)
+                batch = []
+        if batch:
+            for record in _process(stage, batch):
+                out_queue.put(record)
+    finally:
+        # Always close downstream, or run_pipeline would wait for the end marker forever
+        finished()
+
+
+def run_pipeline(csv_path=DEFAULT_CSV, stages=None, index_name=DEFAULT_INDEX_NAME,
+                 checkpoint_dir=DEFAULT_CHECKPOINT_DIR, queue_size=32):
+    stages = set(stages or ALL_STAGES)
+    unknown = stages - set(ALL_STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages: {sorted(unknown)}")
+
+    load = LoadStage(checkpoint_dir, csv_path)
+    workers = [
+        DescribeStage(checkpoint_dir, enabled="describe" in stages),
+        EmbedStage(checkpoint_dir, enabled="embed" in stages),
+        IngestStage(checkpoint_dir, index_name, enabled="ingest" in stages),
+    ]
+    for stage in workers:
+        stage.open()
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(workers) + 1)]
+    threads = []
+    for i, stage in enumerate(workers):
+        n_workers = stage.workers if stage.enabled else 1
+        remaining = [n_workers]
+        lock = threading.Lock()
+
+        def finished(out_queue=queues[i + 1], remaining=remaining, lock=lock):
+            # Only the last worker of a stage closes the downstream queue
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    out_queue.put(_END)
+
+        for _ in range(n_workers):
+            t = threading.Thread(target=_run_stage, args=(stage, queues[i], queues[i + 1], finished),
+                                 name=f"pipeline-{stage.name}", daemon=True)
+            t.start()
+            threads.append(t)
+
+    start = time.time()
+    total = 0
+    for record in load.iter_records():
+        queues[0].put(record)  # blocks when describe falls behind
+        total += 1
+    queues[0].put(_END)
+
+    failed = []
+    while True:
+        record = queues[-1].get()
+        if record is _END:
+            break
+        if record.get("_failed_stages"):
+            failed.append((record_key(record), record["_failed_stages"]))
+
+    for t in threads:
+        t.join()
+    for stage in [load] + workers:
+        stage.close()
+
+    print(f"Pipeline finished: {total} records in {time.time() - start:.1f}s")
+    for stage in [load] + workers:
+        state = "on" if stage.enabled else "off"
+        print(f"  {stage.name:<9} ({state}): {stage.stats}")
+    for key, failed_stages in failed:
+        print(f"  ✗ {key} failed in {failed_stages}")
+    return {"total": total, "failed": failed, "stats": {s.name: s.stats for s in [load] + workers}}
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Streaming load -> describe -> embed -> ingest pipeline")
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--stages", default=",".join(ALL_STAGES),
+                        help="comma separated subset of: " + ",".join(ALL_STAGES))
+    parser.add_argument("--index", default=DEFAULT_INDEX_NAME)
+    parser.add_argument("--checkpoint-dir", default=DEFAULT_CHECKPOINT_DIR)
+    parser.add_argument("--queue-size", type=int, default=32)
+    args = parser.parse_args()
+    run_pipeline(
+        csv_path=args.csv,
+        stages=[s.strip() for s in args.stages.split(",") if s.strip()],
+        index_name=args.index,
+        checkpoint_dir=args.checkpoint_dir,
+        queue_size=args.queue_size,
+    )
@@ -0,0 +1,62 @@
+import csv
+
+from pipeline import DescribeStage, Stage, run_pipeline
+
+
+class _UpperStage(Stage):
+    """Upper-cases the general description and counts the records it really processed"""
+    name = "upper"
+    batch_size = 10
+
+    def __init__(self, checkpoint_dir, enabled=True):
+        super().__init__(checkpoint_dir, enabled=enabled)
+        self.seen = []
+
+    def input_hash(self, record):
+        return record["General Description"]
+
+    def run_batch(self, records):
+        self.seen.extend(r["Fish Name"] for r in records)
+        return [{"General Description": r["General Description"].upper()} for r in records]
+
+
+def _records():
+    return [{"Fish Name": "Red lionfish", "General Description": "venomous spines"},
+            {"Fish Name": "Tomato clownfish", "General Description": "lives in anemones"}]
+
+
+def test_checkpointed_records_are_skipped_until_their_input_changes(tmp_path):
+    stage = _UpperStage(str(tmp_path))
+    stage.process(_records())
+    stage.close()
+
+    rerun = _UpperStage(str(tmp_path))
+    records = _records()
+    records[1]["General Description"] = "lives in sea anemones"
+    records = rerun.process(records)
+    assert rerun.seen == ["Tomato clownfish"]
+    assert [r["General Description"] for r in records] == ["VENOMOUS SPINES", "LIVES IN SEA ANEMONES"]
+    assert (rerun.stats["cached"], rerun.stats["processed"]) == (1, 1)
+
+
+def test_disabled_stages_pass_records_through_unchanged(tmp_path):
+    """A describe checkpoint from an earlier run must not overwrite the CSV description"""
+    csv_path = tmp_path / "fish.csv"
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["Fish Name", "General Description", "Physical Description"])
+        writer.writeheader()
+        writer.writerow({"Fish Name": "Red lionfish", "General Description": "venomous spines",
+                         "Physical Description": "from the csv"})
+    describe = DescribeStage(str(tmp_path / "checkpoints"))
+    describe.checkpoint.save("Red lionfish", describe.input_hash({"Fish Name": "Red lionfish"}),
+                             {"Physical Description": "old checkpoint"})
+    describe.close()
+
+    disabled = DescribeStage(str(tmp_path / "checkpoints"), enabled=False)
+    record = disabled.process([{"Fish Name": "Red lionfish", "Physical Description": "from the csv"}])[0]
+    assert record["Physical Description"] == "from the csv"
+
+    result = run_pipeline(str(csv_path), stages=["load"], checkpoint_dir=str(tmp_path / "checkpoints"))
+    assert result["total"] == 1 and result["failed"] == []
+    for name in ("describe", "embed", "ingest"):
+        assert result["stats"][name]["passed_through"] == 1 and result["stats"][name]["cached"] == 0
@@ -1,30 +1,35 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import base64
-from sentence_transformers import SentenceTransformer
+import torch
+from inference_backend import MODEL_NAME, load_model
+from text_preprocessing import encode_bucketed
+from wire_format import JSON, choose_media_type, encode_json, encode_binary
 
 app = Flask(__name__)
-model_name = 'Snowflake/snowflake-arctic-embed-l-v2.0'
+model_name = MODEL_NAME
 
 
 # Ensure the directory exists
 import os
 
-model = SentenceTransformer(model_name)
+# Backend, thread count and warm-up are configured through EMBEDDING_* env vars
+model = load_model(model_name=model_name)
 
 @app.route('/extract_text', methods=['POST'])
 def extract_text():
     try:
         data = request.get_json()
         sentences = data['sentence']
-        embeddings = model.encode(sentences)
-        return {
-            'predictions': [
-                {
-                    'fields': ['sentence', 'embedding'],
-                    'values': [[sentence, embedding.tolist()] for sentence, embedding in zip(sentences, embeddings)]
-                }
-            ]
-        }
+        with torch.inference_mode():
+            # Markdown stripping, token-budget truncation and length-sorted batching
+            embeddings = encode_bucketed(model, sentences)
+
+        # JSON stays the default, binary formats are opt-in through the Accept header
+        media_type = choose_media_type(request.headers.get('Accept'))
+        if media_type == JSON:
+            return encode_json(sentences, embeddings)
+        body, headers = encode_binary(embeddings, media_type)
+        return Response(body, mimetype=media_type, headers=headers)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
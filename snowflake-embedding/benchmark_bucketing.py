@@ -0,0 +1,105 @@
+"""
+Throughput of plain model.encode vs Markdown stripping + token budget +
+length-sorted batching (text_preprocessing.encode_bucketed).
+
+The input mix mirrors production traffic: the 91 stored physical descriptions,
+Markdown captions shaped like the ones get_fish_description_from_watsonxai
+returns, and short free-text queries, shuffled together:
+
+    python benchmark_bucketing.py --max-tokens 256 --batch-size 32
+"""
+import argparse
+import csv
+import os
+import random
+import time
+
+import torch
+
+from inference_backend import load_model
+from text_preprocessing import encode_bucketed, padding_stats, prepare_texts, token_lengths
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "EXTRACTION", "DATA",
+                           "fish-description-files", "Marine_Fish_Species_Formatted_updated.csv")
+
+QUERIES = [
+    "orange fish with white stripes",
+    "flat fish lying on sand",
+    "long silver fish with sharp teeth",
+    "yellow box shaped fish with black spots",
+    "What does a lionfish look like?",
+]
+
+
+def markdown_caption(description):
+    """Wraps a plain description in the heading/bullet layout of the vision captions."""
+    parts = [p.strip() for p in description.split(";") if p.strip()]
+    bullets = "\n".join(f"* **{p.split(':')[0].strip().title()}:** {p.split(':', 1)[-1].strip()}" for p in parts)
+    return (
+        "## Image Description\n\nThe image depicts a **fish** swimming near coral reefs.\n\n"
+        f"### Key Features:\n\n{bullets}\n\n"
+        "### Conclusion\n\nBased on the *visible* features, the fish appears healthy and is shown in its natural habitat."
+    )
+
+
+def build_mix(csv_path, captions, queries, seed=0):
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        descriptions = [row["Physical Description"] for row in csv.DictReader(f) if row.get("Physical Description")]
+    rng = random.Random(seed)
+    mix = list(descriptions)
+    mix += [markdown_caption(rng.choice(descriptions)) for _ in range(captions)]
+    mix += [rng.choice(QUERIES) for _ in range(queries)]
+    rng.shuffle(mix)
+    return mix
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--captions", type=int, default=60)
+    parser.add_argument("--queries", type=int, default=60)
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    texts = build_mix(args.csv, args.captions, args.queries)
+    model = load_model()
+    tokenizer = model.tokenizer
+
+    raw_lengths = token_lengths(tokenizer, texts)
+    clean_lengths = [min(n, args.max_tokens) for n in token_lengths(tokenizer, prepare_texts(texts))]
+    print(f"{len(texts)} inputs ({args.captions} captions, {args.queries} queries), "
+          f"batch size {args.batch_size}, token budget {args.max_tokens}")
+    print(f"  tokens before clean-up: {sum(raw_lengths)}, after strip+truncate: {sum(clean_lengths)}")
+    print(f"  padding, arrival order : {padding_stats(raw_lengths, args.batch_size, sort=False)}")
+    print(f"  padding, length sorted : {padding_stats(clean_lengths, args.batch_size, sort=True)}")
+
+    default_max = model.max_seq_length
+    with torch.inference_mode():
+        def baseline():
+            model.max_seq_length = default_max
+            model.encode(texts, batch_size=args.batch_size)
+
+        def bucketed():
+            encode_bucketed(model, texts, max_tokens=args.max_tokens, batch_size=args.batch_size)
+
+        baseline_s = timed(baseline, args.repeat)
+        bucketed_s = timed(bucketed, args.repeat)
+
+    print(f"{'mode':<10} {'seconds':>8} {'inputs/s':>9}")
+    print(f"{'baseline':<10} {baseline_s:>8.2f} {len(texts) / baseline_s:>9.1f}")
+    print(f"{'bucketed':<10} {bucketed_s:>8.2f} {len(texts) / bucketed_s:>9.1f}  ({baseline_s / bucketed_s:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmarks the inference backends on the 91 species descriptions.
+
+Each backend runs in its own subprocess so peak RSS is measured in isolation.
+Reports load time, sentences/s, peak RSS and cosine agreement with the fp32
+torch vectors:
+
+    python benchmark_inference.py --backends torch,torch_int8,onnx_int8 --threads 2
+"""
+import argparse
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "EXTRACTION", "DATA",
+                           "fish-description-files", "Marine_Fish_Species_Formatted_updated.csv")
+
+
+def load_descriptions(csv_path):
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        return [row["Physical Description"] for row in csv.DictReader(f) if row.get("Physical Description")]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def worker(backend, csv_path, threads, batch_size, repeat, output_path):
+    """Runs inside the subprocess: load, warm up, time encoding, dump vectors."""
+    import torch
+    from inference_backend import load_model
+
+    sentences = load_descriptions(csv_path)
+    start = time.perf_counter()
+    model = load_model(backend=backend, num_threads=threads, warmup=True)
+    load_s = time.perf_counter() - start
+
+    timings = []
+    with torch.inference_mode():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            vectors = model.encode(sentences, batch_size=batch_size)
+            timings.append(time.perf_counter() - start)
+    np.save(output_path, np.asarray(vectors, dtype=np.float32))
+    best = min(timings)
+    print(json.dumps({
+        "backend": backend,
+        "load_s": round(load_s, 2),
+        "sentences_per_s": round(len(sentences) / best, 2),
+        "best_batch_s": round(best, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }))
+
+
+def cosine_agreement(reference, candidate):
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = np.sum(reference * candidate, axis=1)
+    # Does the quantized model still rank the same nearest neighbour for every description?
+    same_neighbour = np.mean(
+        np.argsort(-(reference @ reference.T), axis=1)[:, 1] == np.argsort(-(candidate @ candidate.T), axis=1)[:, 1])
+    return float(cosines.mean()), float(cosines.min()), float(same_neighbour)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="torch,torch_int8")
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.csv, args.threads, args.batch_size, args.repeat, args.output)
+        return
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    if "torch" not in backends:
+        backends.insert(0, "torch")  # fp32 reference for the agreement numbers
+
+    tmp_dir = tempfile.mkdtemp(prefix="embedding-bench-")
+    results = {}
+    for backend in backends:
+        output = os.path.join(tmp_dir, f"{backend}.npy")
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", backend, "--output", output,
+               "--csv", args.csv, "--batch-size", str(args.batch_size), "--repeat", str(args.repeat)]
+        if args.threads:
+            cmd += ["--threads", str(args.threads)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"✗ {backend} failed:\n{proc.stderr[-2000:]}")
+            continue
+        results[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+        results[backend]["vectors"] = np.load(output)
+
+    if "torch" not in results:
+        print("fp32 reference run failed, cannot compute agreement")
+        return
+    reference = results["torch"]["vectors"]
+    print(f"{len(reference)} descriptions, batch size {args.batch_size}, threads {args.threads or os.cpu_count()}")
+    print(f"{'backend':<11} {'load s':>7} {'sent/s':>8} {'speedup':>8} {'peak RSS MB':>12} "
+          f"{'mean cos':>9} {'min cos':>8} {'same NN':>8}")
+    for backend, r in results.items():
+        mean_cos, min_cos, same_nn = cosine_agreement(reference, r["vectors"])
+        print(f"{backend:<11} {r['load_s']:>7.1f} {r['sentences_per_s']:>8.1f} "
+              f"{r['sentences_per_s'] / results['torch']['sentences_per_s']:>7.2f}x {r['peak_rss_mb']:>12.0f} "
+              f"{mean_cos:>9.4f} {min_cos:>8.4f} {same_nn:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
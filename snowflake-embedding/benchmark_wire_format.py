@@ -0,0 +1,66 @@
+"""
+Compares the JSON response of /extract_text with the binary wire formats.
+
+Measures payload size and the CPU time spent encoding on the server and
+decoding on the client, using random unit vectors with the Snowflake
+dimensions so it runs without the model:
+
+    python benchmark_wire_format.py --rows 32 --dim 1024 --repeat 50
+"""
+import argparse
+import gzip
+import json
+import time
+
+import numpy as np
+
+from wire_format import FLOAT16, FLOAT32, NPY, decode_binary, encode_binary, encode_json
+
+
+def cpu_time_ms(fn, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        result = fn()
+    return (time.process_time() - start) * 1000 / repeat, result
+
+
+def run(rows, dim, repeat):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((rows, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    sentences = [f"sentence {i}" for i in range(rows)]
+
+    results = []
+
+    # Current format: Flask serialises the nested lists, the BE parses them back into Python floats
+    encode_ms, body = cpu_time_ms(lambda: json.dumps(encode_json(sentences, embeddings)).encode("utf-8"), repeat)
+    decode_ms, decoded = cpu_time_ms(
+        lambda: np.asarray([v[1] for v in json.loads(body)["predictions"][0]["values"]], dtype=np.float32), repeat)
+    results.append(("json", len(body), len(gzip.compress(body)), encode_ms, decode_ms, decoded))
+
+    for name, media_type in (("float32", FLOAT32), ("float16", FLOAT16), ("npy", NPY)):
+        encode_ms, (payload, headers) = cpu_time_ms(lambda: encode_binary(embeddings, media_type), repeat)
+        decode_ms, decoded = cpu_time_ms(
+            lambda: decode_binary(payload, media_type, headers["X-Embedding-Shape"]), repeat)
+        results.append((name, len(payload), len(gzip.compress(payload)), encode_ms, decode_ms, decoded))
+
+    json_size = results[0][1]
+    print(f"{rows} x {dim} embeddings, {repeat} repetitions (CPU time per response)")
+    print(f"{'format':<8} {'bytes':>10} {'gzip':>10} {'vs json':>8} {'encode ms':>10} {'decode ms':>10} "
+          f"{'max abs err':>12} {'min cosine':>11}")
+    for name, size, gz_size, encode_ms, decode_ms, decoded in results:
+        decoded = np.asarray(decoded, dtype=np.float32)
+        max_err = float(np.max(np.abs(decoded - embeddings)))
+        cosine = np.sum(decoded * embeddings, axis=1) / (
+            np.linalg.norm(decoded, axis=1) * np.linalg.norm(embeddings, axis=1))
+        print(f"{name:<8} {size:>10} {gz_size:>10} {size / json_size:>8.2%} {encode_ms:>10.3f} {decode_ms:>10.3f} "
+              f"{max_err:>12.2e} {float(cosine.min()):>11.6f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=32)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    run(args.rows, args.dim, args.repeat)
@@ -0,0 +1,156 @@
+"""
+Compares N gunicorn workers that share one copy of the model (loaded in the
+master before fork) with N workers that each load their own:
+
+    python benchmark_workers.py --workers 4 --duration 30
+
+For each mode the server is started from scratch and the script reports the
+cold start (until every worker has logged that it is ready), RSS and PSS per
+worker (PSS divides shared pages between the processes that map them, so the
+sum over all processes is the real footprint) and sentences/s under a closed
+loop of --concurrency clients posting the species descriptions.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from benchmark_inference import DEFAULT_CSV, load_descriptions
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODES = {"shared": "1", "independent": "0"}
+
+
+def memory_mb(pid):
+    """(rss, pss) of one process from /proc/<pid>/smaps_rollup."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0][:-1]] = int(parts[1]) / 1024
+    return values.get("Rss", 0.0), values.get("Pss", 0.0)
+
+
+def child_pids(pid):
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children", "r") as f:
+            children.extend(int(c) for c in f.read().split())
+    return children
+
+
+def wait_ready(log_path, proc, workers, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {proc.returncode}, see {log_path}")
+        with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+            ready = set(re.findall(r"Embedding worker (\d+) ready", f.read()))
+        if len(ready) >= workers:
+            return
+        time.sleep(0.5)
+    raise RuntimeError(f"workers not ready after {timeout}s, see {log_path}")
+
+
+def run_load(url, sentences, concurrency, duration, batch_size):
+    """Closed loop: each client posts `batch_size` descriptions back to back. Returns (sentences, errors)."""
+    counts = {"sentences": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(offset):
+        i = offset
+        while time.perf_counter() < deadline:
+            batch = [sentences[(i + j) % len(sentences)] for j in range(batch_size)]
+            i += batch_size * concurrency
+            request = urllib.request.Request(url, data=json.dumps({"sentence": batch}).encode("utf-8"),
+                                             headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(request, timeout=300) as response:
+                    response.read()
+                with lock:
+                    counts["sentences"] += len(batch)
+            except Exception:
+                with lock:
+                    counts["errors"] += 1
+
+    threads = [threading.Thread(target=client, args=(n * batch_size,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return counts["sentences"], counts["errors"]
+
+
+def benchmark_mode(mode, args, sentences):
+    env = {**os.environ, "EMBEDDING_WORKERS": str(args.workers), "EMBEDDING_SHARED_WEIGHTS": MODES[mode],
+           "PORT": str(args.port)}
+    log_path = os.path.join(tempfile.mkdtemp(prefix="embedding-workers-"), f"{mode}.log")
+    with open(log_path, "w") as log:
+        start = time.time()
+        proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "app:app"],
+                                cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_ready(log_path, proc, args.workers, args.startup_timeout)
+        cold_start = time.time() - start
+        url = f"http://127.0.0.1:{args.port}/extract_text"
+        done, errors = run_load(url, sentences, args.concurrency or 2 * args.workers, args.duration, args.batch_size)
+        # Measured after the load so pages touched while serving are included
+        workers = child_pids(proc.pid)
+        worker_memory = [memory_mb(pid) for pid in workers]
+        _, master_pss = memory_mb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=60)
+    return {
+        "mode": mode,
+        "workers": len(workers),
+        "cold_start_s": round(cold_start, 1),
+        "sentences_per_s": round(done / args.duration, 1),
+        "errors": errors,
+        "rss_per_worker_mb": round(sum(m[0] for m in worker_memory) / len(worker_memory), 0),
+        "pss_per_worker_mb": round(sum(m[1] for m in worker_memory) / len(worker_memory), 0),
+        "total_pss_mb": round(master_pss + sum(m[1] for m in worker_memory), 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--modes", default="shared,independent")
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load per mode")
+    parser.add_argument("--concurrency", type=int, default=None, help="clients, default 2 x workers")
+    parser.add_argument("--batch-size", type=int, default=8, help="sentences per request")
+    parser.add_argument("--port", type=int, default=8098)
+    parser.add_argument("--startup-timeout", type=float, default=900.0)
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        parser.error(f"unknown modes {unknown}, use {list(MODES)}")
+    sentences = load_descriptions(args.csv)
+
+    print(f"{'mode':<12} {'workers':>7} {'cold s':>7} {'sent/s':>8} {'err':>4} "
+          f"{'RSS/worker MB':>14} {'PSS/worker MB':>14} {'total PSS MB':>13}")
+    for mode in modes:
+        try:
+            r = benchmark_mode(mode, args, sentences)
+        except RuntimeError as e:
+            print(f"✗ {mode} failed: {e}")
+            continue
+        print(f"{r['mode']:<12} {r['workers']:>7} {r['cold_start_s']:>7.1f} {r['sentences_per_s']:>8.1f} "
+              f"{r['errors']:>4} {r['rss_per_worker_mb']:>14.0f} {r['pss_per_worker_mb']:>14.0f} "
+              f"{r['total_pss_mb']:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
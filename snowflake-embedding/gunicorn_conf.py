@@ -0,0 +1,55 @@
+"""
+Gunicorn settings for the embedding server:
+
+    gunicorn -c gunicorn_conf.py app:app
+
+    EMBEDDING_WORKERS         worker processes (default 1)
+    EMBEDDING_SHARED_WEIGHTS  1 (default) loads the model once in the master and
+                              forks the workers from it; 0 lets every worker
+                              load its own copy
+    EMBEDDING_NUM_THREADS     torch threads per worker, defaults to CPUs / workers
+
+Encoding is CPU bound, so workers are sync (one request at a time) and the
+cores are split between them instead of every worker using all of them.
+Shared weights only apply to the torch backends; onnxruntime sessions are not
+safe to use across fork(), so the onnx backends always load per worker.
+"""
+import os
+import sys
+import time
+
+STARTED = time.time()
+
+WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+SHARED_WEIGHTS = os.getenv("EMBEDDING_SHARED_WEIGHTS", "1") == "1" and BACKEND in ("torch", "torch_int8")
+WARMUP = os.getenv("EMBEDDING_WARMUP", "1") == "1"
+
+os.environ.setdefault("EMBEDDING_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // WORKERS)))
+if SHARED_WEIGHTS:
+    # The master must not run inference before forking: torch's OpenMP thread
+    # pool does not survive fork(), so every worker warms up after it starts
+    os.environ["EMBEDDING_WARMUP"] = "0"
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = WORKERS
+worker_class = "sync"
+preload_app = SHARED_WEIGHTS
+# Loading a 2 GB model in a worker can take minutes on a cold cache
+timeout = int(os.getenv("EMBEDDING_WORKER_TIMEOUT", "300"))
+graceful_timeout = 30
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def when_ready(server):
+    if SHARED_WEIGHTS:
+        from inference_backend import prepare_for_fork
+        prepare_for_fork(sys.modules["app"].model)
+
+
+def post_worker_init(worker):
+    if SHARED_WEIGHTS and WARMUP:
+        from inference_backend import warm_up
+        warm_up(sys.modules["app"].model)
+    print(f"✓ Embedding worker {os.getpid()} ready {time.time() - STARTED:.1f}s after start "
+          f"(shared_weights={SHARED_WEIGHTS})", flush=True)
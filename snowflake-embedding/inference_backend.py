@@ -0,0 +1,147 @@
+"""
+Selectable CPU inference backends for the embedding server.
+
+Configured through environment variables:
+
+    EMBEDDING_BACKEND      torch (fp32, default) | torch_int8 | onnx | onnx_int8
+    EMBEDDING_NUM_THREADS  intra-op threads, defaults to the number of CPUs
+    EMBEDDING_WARMUP       1 (default) runs a few dummy batches at start-up
+    EMBEDDING_ONNX_QUANTIZATION  onnx_int8 only: arm64 | avx2 | avx512 | avx512_vnni,
+                           detected from the CPU when unset
+
+With several gunicorn workers (gunicorn_conf.py) the model can be loaded once in
+the master and shared with the forked workers, see prepare_for_fork.
+
+torch_int8 applies torch dynamic quantization to the Linear layers and needs no
+extra packages. The onnx backends also need optimum[onnxruntime] (see
+requirements-onnx.txt). Run benchmark_inference.py
+before switching production to a quantized backend.
+"""
+import gc
+import os
+import platform
+import time
+
+import torch
+from sentence_transformers import SentenceTransformer
+
+MODEL_NAME = 'Snowflake/snowflake-arctic-embed-l-v2.0'
+BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8")
+ONNX_QUANTIZATION_CONFIGS = ("arm64", "avx2", "avx512", "avx512_vnni")
+
+# Short query, typical description and a long caption, so every code path is compiled/allocated once
+WARMUP_SENTENCES = [
+    "orange fish with white stripes",
+    "body: slender, elongated body; colors: brown with dark bands; features: two dorsal fins set far back",
+    " ".join(["The fish has a compressed oval body with bright yellow fins and a dark eye stripe."] * 12),
+]
+
+
+def configure_threads(num_threads=None):
+    num_threads = int(num_threads or os.getenv("EMBEDDING_NUM_THREADS") or os.cpu_count() or 1)
+    torch.set_num_threads(num_threads)
+    # A single request is one batch, so inter-op parallelism only adds contention
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # can only be set once per process, before any parallel work
+    return num_threads
+
+
+def _cpu_flags():
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def onnx_quantization_config():
+    """
+    The optimum dynamic quantization config for this machine. A model quantized
+    for avx512_vnni runs slowly or not at all on CPUs without those instructions,
+    so the config follows the CPU unless EMBEDDING_ONNX_QUANTIZATION is set.
+    """
+    config = os.getenv("EMBEDDING_ONNX_QUANTIZATION", "").lower()
+    if config:
+        if config not in ONNX_QUANTIZATION_CONFIGS:
+            raise ValueError(f"EMBEDDING_ONNX_QUANTIZATION must be one of {ONNX_QUANTIZATION_CONFIGS}")
+        return config
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    flags = _cpu_flags()
+    for config, flag in (("avx512_vnni", "avx512_vnni"), ("avx512", "avx512f"), ("avx2", "avx2")):
+        if flag in flags:
+            return config
+    raise RuntimeError("Could not detect a quantization config for this CPU, "
+                       f"set EMBEDDING_ONNX_QUANTIZATION to one of {ONNX_QUANTIZATION_CONFIGS}")
+
+
+def _load_onnx(model_name, quantized):
+    try:
+        model = SentenceTransformer(model_name, backend="onnx")
+    except TypeError as e:
+        raise RuntimeError("The onnx backends need sentence-transformers>=3.2 and optimum[onnxruntime]") from e
+    if not quantized:
+        return model
+
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+    config = onnx_quantization_config()
+    export_dir = os.getenv("EMBEDDING_ONNX_DIR", "/tmp/onnx_models/" + model_name.replace("/", "__"))
+    quantized_file = f"model_qint8_{config}.onnx"
+    if not os.path.exists(os.path.join(export_dir, "onnx", quantized_file)):
+        print(f"Exporting dynamically quantized ({config}) ONNX model to {export_dir}")
+        model.save_pretrained(export_dir)
+        export_dynamic_quantized_onnx_model(model, config, export_dir)
+    return SentenceTransformer(export_dir, backend="onnx", model_kwargs={"file_name": f"onnx/{quantized_file}"})
+
+
+def load_model(backend=None, model_name=MODEL_NAME, num_threads=None, warmup=None):
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "torch")).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"EMBEDDING_BACKEND must be one of {BACKENDS}")
+    threads = configure_threads(num_threads)
+
+    start = time.perf_counter()
+    if backend in ("onnx", "onnx_int8"):
+        model = _load_onnx(model_name, quantized=backend == "onnx_int8")
+    else:
+        model = SentenceTransformer(model_name, device="cpu")
+        model.eval()
+        if backend == "torch_int8":
+            transformer = model[0].auto_model
+            model[0].auto_model = torch.quantization.quantize_dynamic(transformer, {torch.nn.Linear}, dtype=torch.qint8)
+    print(f"Loaded {model_name} with backend={backend}, threads={threads} in {time.perf_counter() - start:.1f}s")
+
+    if warmup is None:
+        warmup = os.getenv("EMBEDDING_WARMUP", "1") == "1"
+    if warmup:
+        warm_up(model)
+    return model
+
+
+def warm_up(model):
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for _ in range(2):
+            model.encode(WARMUP_SENTENCES)
+    print(f"Warm-up finished in {time.perf_counter() - start:.1f}s")
+
+
+def prepare_for_fork(model):
+    """
+    Runs in the gunicorn master after loading, right before the workers fork.
+    Parameters and buffers move to shared memory, so every worker maps the same
+    pages instead of a copy-on-write view that writes could duplicate, and the
+    objects alive so far are frozen out of the garbage collector, whose passes
+    in the workers would otherwise write to their pages. Quantized (int8) packed
+    weights are not parameters and stay shared copy-on-write.
+    """
+    start = time.perf_counter()
+    model.share_memory()
+    gc.freeze()
+    print(f"Model weights moved to shared memory in {time.perf_counter() - start:.1f}s "
+          f"({gc.get_freeze_count()} objects frozen)")
@@ -0,0 +1,24 @@
+import numpy as np
+
+from wire_format import FLOAT16, FLOAT32, JSON, NPY, SHAPE_HEADER, choose_media_type, decode_binary, encode_binary
+
+
+def test_accept_header_picks_the_best_supported_type():
+    assert choose_media_type(None) == JSON
+    assert choose_media_type("application/x-float16, application/x-float32") == FLOAT16
+    assert choose_media_type("application/x-float16;q=0.5, application/x-float32") == FLOAT32
+    assert choose_media_type("Application/X-NPY; q=0.9, application/json; q=0.1") == NPY
+    assert choose_media_type("application/x-float32;q=0, application/json;q=0.2") == JSON
+
+
+def test_unknown_or_unusable_types_fall_back_to_json():
+    assert choose_media_type("text/html, */*") == JSON
+    assert choose_media_type("application/x-float64") == JSON
+    assert choose_media_type("application/x-float32;q=high") == JSON
+
+
+def test_binary_encodings_round_trip():
+    matrix = np.array([[0.5, -1.25, 2.0], [0.0, 3.5, -0.75]], dtype=np.float32)
+    for media_type in (FLOAT32, FLOAT16, NPY):
+        body, headers = encode_binary(matrix, media_type)
+        np.testing.assert_array_equal(decode_binary(body, media_type, headers[SHAPE_HEADER]), matrix)
@@ -0,0 +1,105 @@
+"""
+Input clean-up and batching for the embedding model.
+
+Captions from the vision model are Markdown documents (### headings, bullets,
+**bold**) while stored descriptions are plain text. Markdown syntax costs
+tokens without adding meaning, so it is stripped before embedding. Every input
+is then capped at a token budget, and a request is encoded in batches of
+similar token length so short queries are not padded up to the longest caption
+in their batch.
+
+    EMBEDDING_MAX_TOKENS       token budget per input (default 512)
+    EMBEDDING_STRIP_MARKDOWN   1 (default) strips Markdown syntax
+    EMBEDDING_BATCH_SIZE       inputs per forward pass (default 32)
+"""
+import os
+import re
+
+import numpy as np
+
+MAX_TOKENS = int(os.getenv("EMBEDDING_MAX_TOKENS", "512"))
+STRIP_MARKDOWN = os.getenv("EMBEDDING_STRIP_MARKDOWN", "1") == "1"
+BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+_CODE_FENCE = re.compile(r"```[a-zA-Z0-9_-]*")
+_IMAGE_OR_LINK = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+_HEADING = re.compile(r"^\s{0,3}#{1,6}\s*", re.MULTILINE)
+_BLOCKQUOTE = re.compile(r"^\s*>+\s?", re.MULTILINE)
+_BULLET = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+", re.MULTILINE)
+_TABLE_RULE = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(?:\|\s*:?-{3,}:?\s*)*\|?\s*$", re.MULTILINE)
+_HORIZONTAL_RULE = re.compile(r"^\s*(?:[-*_]\s*){3,}$", re.MULTILINE)
+_EMPHASIS = re.compile(r"(\*{1,3}|_{2,3})(\S(?:.*?\S)?)\1")
+_INLINE_CODE = re.compile(r"`([^`]*)`")
+_HTML_TAG = re.compile(r"</?[a-zA-Z][^>]*>")
+_WHITESPACE = re.compile(r"[ \t]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+def strip_markdown(text):
+    """Removes Markdown syntax but keeps the words, one line per paragraph/bullet."""
+    text = _CODE_FENCE.sub("", text)
+    text = _IMAGE_OR_LINK.sub(r"\1", text)
+    text = _TABLE_RULE.sub("", text)
+    text = _HORIZONTAL_RULE.sub("", text)
+    text = _HEADING.sub("", text)
+    text = _BLOCKQUOTE.sub("", text)
+    text = _BULLET.sub("", text)
+    text = _EMPHASIS.sub(r"\2", text)
+    text = _INLINE_CODE.sub(r"\1", text)
+    text = _HTML_TAG.sub("", text)
+    text = text.replace("|", " ")
+    text = _WHITESPACE.sub(" ", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    text = _BLANK_LINES.sub("\n", text)
+    return text.strip()
+
+
+def token_lengths(tokenizer, texts):
+    encoded = tokenizer(list(texts), add_special_tokens=False, truncation=False)["input_ids"]
+    return [len(ids) for ids in encoded]
+
+
+def length_sorted_batches(lengths, batch_size):
+    """Yields index arrays of inputs with similar length, longest first."""
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    for start in range(0, len(order), batch_size):
+        yield order[start:start + batch_size]
+
+
+def prepare_texts(texts, strip=STRIP_MARKDOWN):
+    return [strip_markdown(t) if strip else t for t in texts]
+
+
+def encode_bucketed(model, texts, max_tokens=MAX_TOKENS, batch_size=BATCH_SIZE, strip=STRIP_MARKDOWN):
+    """
+    Cleans the inputs, truncates them to `max_tokens` (the model tokenizer does
+    the truncation via max_seq_length), encodes them in length-sorted batches
+    and returns the embeddings in the original input order.
+    """
+    texts = prepare_texts(texts, strip=strip)
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    # max_seq_length counts the special tokens as well
+    model.max_seq_length = max_tokens
+    lengths = [min(n, max_tokens) for n in token_lengths(model.tokenizer, texts)]
+
+    embeddings = None
+    for batch_idx in length_sorted_batches(lengths, batch_size):
+        batch_vectors = model.encode([texts[i] for i in batch_idx], batch_size=len(batch_idx))
+        if embeddings is None:
+            embeddings = np.empty((len(texts), batch_vectors.shape[1]), dtype=batch_vectors.dtype)
+        embeddings[batch_idx] = batch_vectors
+    return embeddings
+
+
+def padding_stats(lengths, batch_size, sort=True):
+    """Real vs padded token count when the inputs are batched in order or length-sorted."""
+    lengths = np.asarray(lengths)
+    if sort:
+        batches = list(length_sorted_batches(lengths, batch_size))
+    else:
+        batches = [np.arange(start, min(start + batch_size, len(lengths)))
+                   for start in range(0, len(lengths), batch_size)]
+    padded = sum(int(lengths[idx].max()) * len(idx) for idx in batches)
+    real = int(lengths.sum())
+    return {"real_tokens": real, "padded_tokens": padded, "padding_ratio": round(1 - real / padded, 4) if padded else 0.0}
@@ -0,0 +1,96 @@
+"""
+Response encodings for /extract_text.
+
+The default response is the original JSON shape
+(predictions[0].values[i] = [sentence, [floats...]]). Clients that send one of
+the binary media types below in their Accept header get the embedding matrix
+as raw bytes instead, with the shape and dtype in response headers:
+
+    application/x-float32   raw little-endian float32, row major
+    application/x-float16   raw little-endian float16, row major
+    application/x-npy       NumPy .npy file (float32), self describing
+"""
+import io
+
+import numpy as np
+
+JSON = "application/json"
+FLOAT32 = "application/x-float32"
+FLOAT16 = "application/x-float16"
+NPY = "application/x-npy"
+
+BINARY_DTYPES = {
+    FLOAT32: np.dtype("<f4"),
+    FLOAT16: np.dtype("<f2"),
+}
+SUPPORTED = [JSON, FLOAT32, FLOAT16, NPY]
+
+SHAPE_HEADER = "X-Embedding-Shape"
+DTYPE_HEADER = "X-Embedding-Dtype"
+
+
+def choose_media_type(accept_header):
+    """Picks the first supported media type from an Accept header (q-values honoured), JSON otherwise."""
+    if not accept_header:
+        return JSON
+    candidates = []
+    for position, part in enumerate(accept_header.split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        media_type = fields[0].lower()
+        quality = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type in SUPPORTED and quality > 0:
+            candidates.append((-quality, position, media_type))
+    return min(candidates)[2] if candidates else JSON
+
+
+def encode_json(sentences, embeddings):
+    return {
+        'predictions': [
+            {
+                'fields': ['sentence', 'embedding'],
+                'values': [[sentence, embedding.tolist()] for sentence, embedding in zip(sentences, embeddings)]
+            }
+        ]
+    }
+
+
+def encode_binary(embeddings, media_type):
+    """Returns (body bytes, extra headers) for one of the binary media types."""
+    matrix = np.asarray(embeddings)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    if media_type == NPY:
+        buffer = io.BytesIO()
+        np.save(buffer, matrix.astype("<f4", copy=False), allow_pickle=False)
+        body = buffer.getvalue()
+        dtype = np.dtype("<f4")
+    else:
+        dtype = BINARY_DTYPES[media_type]
+        body = np.ascontiguousarray(matrix, dtype=dtype).tobytes()
+    headers = {
+        SHAPE_HEADER: f"{matrix.shape[0]},{matrix.shape[1]}",
+        DTYPE_HEADER: dtype.name,
+    }
+    return body, headers
+
+
+def decode_binary(body, content_type, shape_header=None):
+    """
+    Turns a binary response back into an (n, dim) array. For the raw formats this
+    is a zero-copy, read-only view over `body`.
+    """
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type == NPY:
+        return np.load(io.BytesIO(body), allow_pickle=False)
+    dtype = BINARY_DTYPES[content_type]
+    matrix = np.frombuffer(body, dtype=dtype)
+    if shape_header:
+        rows, dim = (int(x) for x in shape_header.split(","))
+        matrix = matrix.reshape(rows, dim)
+    return matrix